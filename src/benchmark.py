@@ -0,0 +1,155 @@
+import os
+
+import pandas as pd
+
+from services.onnx_embedding_model import OnnxEmbeddingModel
+from services.retrieval_benchmark import RetrievalBenchmark
+
+# --------------------------------------------------------
+# Retrieval benchmark: quality and performance of the KDB configurations
+# --------------------------------------------------------
+
+# Gates
+BENCHMARK_DEPUTADOS = True
+BENCHMARK_EXPENSES = True
+QUERY_SAMPLE_SIZE = 200  # Number of labeled queries per dataset
+
+# Files
+deputados_file = "./data/deputados.parquet"
+expenses_file = "./data/serie_despesas_diárias_deputados.parquet"
+benchmark_folder = "./data/benchmarks"
+embedding_model_name = "all-MiniLM-L6-v2"
+onnx_model_folder = "./data/faiss/onnx/all-MiniLM-L6-v2"
+
+# Configurations to compare, the first one is the baseline of the recall@k
+benchmark_configs = {
+    "flat": {"kdb": {"index_factory": "Flat"}},
+    "hnsw32": {"kdb": {"index_factory": "HNSW32"}},
+    "ivf64_sq8": {"kdb": {"index_factory": "IVF64,Flat", "embedding_dtype": "int8"}},
+    "flat_bm25": {"kdb": {"index_factory": "Flat"}, "search": {"mode": "bm25"}},
+    "flat_hybrid": {"kdb": {"index_factory": "Flat"}, "search": {"mode": "hybrid"}},
+    "flat_hybrid_context": {
+        "kdb": {"index_factory": "Flat"},
+        "search": {"mode": "hybrid"},
+        "context": {"token_budget": 1500},
+    },
+    "flat_onnx_int8": {
+        "kdb": {
+            "index_factory": "Flat",
+            "embedding_backend": "onnx",
+            "onnx_model_folder": onnx_model_folder,
+        }
+    },
+}
+
+
+# Embedding models loaded once and shared by the configurations, so the build
+# time and memory of a configuration don't include loading its model
+embedding_models = {}
+
+
+def load_embedding_model(kdb_options: dict):
+    """Load (once per backend) and warm up the embedding model of a configuration."""
+    backend = kdb_options.get("embedding_backend", "torch")
+    key = (backend, kdb_options.get("onnx_model_folder"))
+    if key not in embedding_models:
+        if backend == "onnx":
+            model = OnnxEmbeddingModel(kdb_options["onnx_model_folder"])
+        else:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(embedding_model_name, device="cpu")
+        model.encode(["warm up"])
+        embedding_models[key] = model
+    return embedding_models[key]
+
+
+def load_or_create_queries(dataset: str, create_queries) -> list:
+    """
+    Load the labeled queries of a dataset, creating and saving them on the first
+    run so every benchmark (and commit) is measured on the same queries.
+
+    :param dataset: Name of the dataset
+    :param create_queries: Function that creates the labeled queries
+    :return: List of dicts with the "query" and its "relevant_ids"
+    """
+    queries_file = os.path.join(benchmark_folder, f"queries_{dataset}.json")
+    if os.path.exists(queries_file):
+        return RetrievalBenchmark.load_queries(queries_file)
+
+    queries = create_queries()
+    RetrievalBenchmark.save_queries(queries, queries_file)
+    return queries
+
+
+def deputados_corpus() -> tuple:
+    """Deputados texts (same format as the deputados KDB) and entity lookup queries."""
+    deputados_df = pd.read_parquet(deputados_file)
+    texts = deputados_df.apply(
+        lambda row: f"{row['id']} || {row['nome']} || {row['siglaPartido']}", axis=1
+    ).to_list()
+
+    def create_queries():
+        sample_df = deputados_df.sample(
+            n=min(QUERY_SAMPLE_SIZE, len(deputados_df)), random_state=42
+        )
+        return [
+            {"query": f"Qual o partido de {row['nome']}?", "relevant_ids": [row["id"]]}
+            for _, row in sample_df.iterrows()
+        ]
+
+    queries = load_or_create_queries("deputados", create_queries)
+    return texts, deputados_df["id"].to_list(), queries
+
+
+def expenses_corpus() -> tuple:
+    """Expenses texts (same format as the expenses KDB) and deputado + expense type queries."""
+    names = pd.read_parquet(deputados_file).set_index("id")["nome"]
+    expenses_df = pd.read_parquet(expenses_file).reset_index(drop=True)
+    expenses_df["nomeDeputado"] = expenses_df["idDeputado"].map(names)
+    texts = expenses_df.apply(
+        lambda row: f"{row['nomeDeputado']} || {row['tipoDespesa']} || R${row['valorDocumento']}",
+        axis=1,
+    ).to_list()
+
+    def create_queries():
+        groups = expenses_df.groupby(["nomeDeputado", "tipoDespesa"]).groups
+        keys = pd.Series(list(groups.keys()))
+        sample = keys.sample(n=min(QUERY_SAMPLE_SIZE, len(keys)), random_state=42)
+        return [
+            {
+                "query": f"Despesas de {nome} com {tipo_despesa.lower()}",
+                "relevant_ids": [int(id) for id in groups[(nome, tipo_despesa)]],
+            }
+            for nome, tipo_despesa in sample
+        ]
+
+    queries = load_or_create_queries("expenses", create_queries)
+    return texts, expenses_df.index.to_list(), queries
+
+
+def run_benchmark(dataset: str, corpus):
+    """Run every configuration on a dataset and save the report."""
+    texts, ids, queries = corpus()
+    benchmark = RetrievalBenchmark(texts, ids, queries)
+
+    for name, config in benchmark_configs.items():
+        if config["kdb"].get("embedding_backend") == "onnx" and not os.path.exists(
+            onnx_model_folder
+        ):
+            print(f"[Benchmark] Skipping {name}: export the ONNX model with dataprep")
+            continue
+        kdb_options = {
+            **config["kdb"],
+            "embedding_model": load_embedding_model(config["kdb"]),
+        }
+        benchmark.run(name, kdb_options, config.get("search"), config.get("context"))
+
+    benchmark.save_report(benchmark_folder, dataset=dataset)
+
+
+if BENCHMARK_DEPUTADOS:
+    run_benchmark("deputados", deputados_corpus)
+
+if BENCHMARK_EXPENSES:
+    run_benchmark("expenses", expenses_corpus)
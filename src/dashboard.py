@@ -1,27 +1,59 @@
+import os
+from contextlib import nullcontext
+from datetime import date
+
 import streamlit as st
-import yaml
-import json
-import pandas as pd
 import plotly.express as px
-from PIL import Image
 
+from dashboard_data import (
+    load_deputado_expenses,
+    load_deputado_expenses_chart,
+    load_deputado_names,
+    load_expenses_deputados,
+    load_federated_retriever,
+    load_gemini,
+    load_image,
+    load_data_folder,
+    load_json,
+    load_propositions_store,
+    load_yaml,
+)
 from services.faiss_kdb import FaissKDB
 
 # --------------------------------------------------------
 # Exercício 8: Assistant Chat with RAG
 # --------------------------------------------------------
-from services.gemini import Gemini
+from services.context_assembler import ContextAssembler
+from services.tracing import configure_tracing, span, trace
+
+# Data of the current snapshot, resolved once per run
+data_folder = load_data_folder()
+
+# Load the available FAISS indices
+available_rag_kdbs = {
+    "Deputados": f"{data_folder}/faiss/deputados",
+    "Despesas": f"{data_folder}/faiss/expenses",
+    "Proposições": f"{data_folder}/faiss/propositions",
+}
+
 
+def load_faiss_index(topic) -> FaissKDB:
+    return load_federated_retriever(available_rag_kdbs).kdbs[topic]
 
-@st.cache_data
-def load_faiss_index(filepath) -> FaissKDB:
-    return FaissKDB.import_kdb(filepath)
+
+# Deduplicates, diversifies (MMR) and packs the RAG hits into a token budget
+context_assembler = ContextAssembler(token_budget=1500)
+
+# Timing of the chat turns: appended to the log and, when OTEL_TRACES_FILE is
+# set, also exported as OpenTelemetry spans (requires opentelemetry-sdk)
+configure_tracing(
+    log_file="./logs/chat_traces.jsonl", otel_file=os.environ.get("OTEL_TRACES_FILE")
+)
 
 
 # --------------------------------------------------------
 
-with open("./data/config.yml", "r", encoding="utf-8") as file:
-    config = yaml.safe_load(file)
+config = load_yaml(f"{data_folder}/config.yml")
 
 st.title("Análise de Dados - Câmara dos Deputados")
 st.write(config["overview_summary"])
@@ -30,35 +62,28 @@ tab1, tab2, tab3 = st.tabs(["Overview", "Despesas", "Proposições"])
 
 with tab1:
     st.subheader("Distribuição de Deputados por Partido")
-    image = Image.open("./data/distribuicao_deputados.png")
+    image = load_image(f"{data_folder}/distribuicao_deputados.png")
     st.image(image, use_container_width=True)
 
     st.subheader("Insights sobre a Distribuição dos Deputados")
 
-    def load_insights(filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data["insights"]
-
-    insights = load_insights("./data/insights_distribuicao_deputados.json")
+    insights = load_json(f"{data_folder}/insights_distribuicao_deputados.json")["insights"]
     for insight in insights:
         st.write(insight)
 
 
-insights = load_insights("./data/insights_distribuicao_deputados.json")
-
 with tab2:
+    despesas_file = f"{data_folder}/serie_despesas_diárias_deputados.parquet"
     try:
-        with open("./data/insights_despesas_deputados.json", "r") as f:
-            insights_despesas = json.load(f)
+        insights_despesas = load_json(f"{data_folder}/insights_despesas_deputados.json")
     except FileNotFoundError:
-        st.error("File ./data/insights_despesas_deputados.json not found.")
+        st.error(f"File {data_folder}/insights_despesas_deputados.json not found.")
         st.stop()
 
     try:
-        despesas_df = pd.read_parquet("./data/serie_despesas_diárias_deputados.parquet")
+        despesas_deputados = load_expenses_deputados(despesas_file)
     except FileNotFoundError:
-        st.error("File ./data/serie_despesas_diárias_deputados.parquet not found.")
+        st.error(f"File {despesas_file} not found.")
         st.stop()
 
     st.subheader("Insights sobre as Despesas dos Deputados")
@@ -66,33 +91,141 @@ with tab2:
         st.write(f"- {insight}")
 
     st.subheader("Despesas diárias por Deputado")
-    deputados = despesas_df["idDeputado"].unique()
-    selected_deputado = st.selectbox("Selecione o Deputado", deputados)
-    filtered_df = despesas_df[despesas_df["idDeputado"] == selected_deputado]
-    fig = px.bar(
-        filtered_df,
-        x="dataDocumento",
-        y="valorDocumento",
-        title=f"Despesas do Deputado {selected_deputado}",
+    deputado_names = load_deputado_names(f"{data_folder}/deputados.parquet")
+    deputados = sorted(
+        despesas_deputados, key=lambda id: deputado_names.get(id, str(id))
     )
-    st.plotly_chart(fig)
+    selected_deputado = st.selectbox(
+        "Selecione o Deputado",
+        deputados,
+        format_func=lambda id: deputado_names.get(id, str(id)),
+    )
+    deputado_df = load_deputado_expenses(despesas_file, selected_deputado)
+    deputado_name = deputado_names.get(selected_deputado, selected_deputado)
+
+    # No expenses to chart (e.g. an empty expenses file)
+    if deputado_df.empty:
+        st.info("Não há despesas para exibir.")
+    else:
+        # The chart is aggregated on the server in time buckets
+        available_buckets = {
+            "Automático": None,
+            "Dia": "day",
+            "Semana": "week",
+            "Mês": "month",
+        }
+        bucket_labels = {bucket: label for label, bucket in available_buckets.items()}
+        col1, col2 = st.columns(2)
+        min_date = deputado_df["dataDocumento"].min().date()
+        max_date = deputado_df["dataDocumento"].max().date()
+        date_range = col1.date_input(
+            "Período", (min_date, max_date), min_value=min_date, max_value=max_date
+        )
+        selected_bucket = col2.selectbox("Agrupar por", list(available_buckets))
+
+        if len(date_range) == 2:
+            chart_df, bucket, downsampled = load_deputado_expenses_chart(
+                despesas_file,
+                selected_deputado,
+                date_range[0],
+                date_range[1],
+                bucket=available_buckets[selected_bucket],
+            )
+            title = f"Despesas do Deputado {deputado_name} ({bucket_labels[bucket]})"
+            if downsampled:
+                fig = px.line(
+                    chart_df, x="dataDocumento", y="valorDocumento", title=title
+                )
+            else:
+                fig = px.bar(
+                    chart_df,
+                    x="dataDocumento",
+                    y="valorDocumento",
+                    color="tipoDespesa",
+                    title=title,
+                )
+            st.plotly_chart(fig)
 
 with tab3:
+    proposicoes_file = f"{data_folder}/proposicoes_deputados.parquet"
     try:
-        proposicoes_df = pd.read_parquet("./data/proposicoes_deputados.parquet")
+        proposicoes_store = load_propositions_store(proposicoes_file)
     except FileNotFoundError:
-        st.error("File ./data/proposicoes_deputados.parquet not found.")
+        st.error(f"File {proposicoes_file} not found.")
         st.stop()
 
     try:
-        with open("./data/sumarizacao_proposicoes.json", "r") as f:
-            sumarizacao_proposicoes = json.load(f)
+        sumarizacao_proposicoes = load_json(f"{data_folder}/sumarizacao_proposicoes.json")
     except FileNotFoundError:
-        st.error("File ./data/sumarizacao_proposicoes.json not found.")
+        st.error(f"File {data_folder}/sumarizacao_proposicoes.json not found.")
         st.stop()
 
     st.subheader("Proposições em Andamento")
-    st.dataframe(proposicoes_df)
+
+    # Filters, search and pagination run on the server: only the page is sent
+    col1, col2 = st.columns(2)
+    selected_temas = col1.multiselect("Tema", proposicoes_store.distinct("tema"))
+    selected_tipos = col2.multiselect("Tipo", proposicoes_store.distinct("siglaTipo"))
+
+    anos = proposicoes_store.distinct("ano")
+    selected_anos = None
+    if len(anos) > 1:
+        selected_anos = st.slider(
+            "Ano", min_value=anos[0], max_value=anos[-1], value=(anos[0], anos[-1])
+        )
+
+    # The presentation date is optional in the source data
+    datas = proposicoes_store.date_bounds()
+    selected_datas = None
+    if datas:
+        first_date, last_date = (date.fromisoformat(d) for d in datas)
+        selected_datas = st.date_input(
+            "Data de apresentação",
+            value=(first_date, last_date),
+            min_value=first_date,
+            max_value=last_date,
+        )
+        # Only the start is set while the range is being picked
+        if len(selected_datas) != 2:
+            selected_datas = None
+
+    search_text = st.text_input("Buscar na ementa")
+
+    page_size = 20
+    page_number = st.session_state.get("proposicoes_page", 1)
+    proposicoes_page, total = proposicoes_store.query(
+        temas=selected_temas,
+        siglas_tipo=selected_tipos,
+        year_range=selected_anos,
+        date_range=selected_datas,
+        text=search_text,
+        page=page_number,
+        page_size=page_size,
+    )
+    num_pages = max(1, -(-total // page_size))
+    if page_number > num_pages:
+        # The filters changed and the page no longer exists: go back to the first
+        page_number = 1
+        proposicoes_page, total = proposicoes_store.query(
+            temas=selected_temas,
+            siglas_tipo=selected_tipos,
+            year_range=selected_anos,
+            date_range=selected_datas,
+            text=search_text,
+            page=page_number,
+            page_size=page_size,
+        )
+        st.session_state["proposicoes_page"] = page_number
+
+    st.dataframe(proposicoes_page, hide_index=True)
+    col1, col2 = st.columns([1, 3])
+    col1.number_input(
+        "Página",
+        min_value=1,
+        max_value=num_pages,
+        key="proposicoes_page",
+    )
+    col2.caption(f"{total} proposições — página {page_number} de {num_pages}")
     st.subheader("Sumarização das Proposições")
     st.write(sumarizacao_proposicoes["summary"])
 
@@ -130,48 +263,144 @@ with tab3:
         The final answer should always be in Brazilian Portuguese.
         """
 
-        # Set gemini instance
-        gemini = Gemini(system_prompt=system_prompt)
-
-        # Load the available FAISS indices
-        available_rag_kdbs = {
-            "Deputados": "./data/faiss/deputados.faiss",
-            "Despesas": "./data/faiss/expenses.faiss",
-            "Proposições": "./data/faiss/propositions.faiss",
-        }
-
-        st.write("Selecione um tópico:")
-        selected_kdb = st.selectbox("Tópico", list(available_rag_kdbs.keys()))
-        faiss_kdb = load_faiss_index(available_rag_kdbs[selected_kdb])
-
-        # Add Chatbot
-        user_message = st.chat_input("Faça uma pergunta...")
-        if user_message:
-            st.chat_message("user").write(user_message)
-
-            # Load the selected FAISS index based on the selected topic
-            # and the user's message
-            rag_results = None
-            if faiss_kdb:
-                rag_results_list = faiss_kdb.search(user_message, num_results=40)
+        # Set gemini instance (shared by every session)
+        gemini = load_gemini(system_prompt)
+
+        # A submitted question is traced from the loading of its KDB to the answer
+        # (the chat input value is in the session state from the start of the run)
+        pending_message = st.session_state.get("chat_message")
+        with trace("chat_turn") if pending_message else nullcontext() as turn:
+            # "Todos" searches every topic at once with the federated retriever
+            st.write("Selecione um tópico:")
+            selected_kdb = st.selectbox("Tópico", ["Todos"] + list(available_rag_kdbs))
+            faiss_kdb = None
+            if selected_kdb != "Todos":
+                with span("load_kdb", topic=selected_kdb):
+                    faiss_kdb = load_faiss_index(selected_kdb)
+
+            # Metadata fields the search of each topic can be filtered by
+            available_rag_filters = {
+                "Deputados": {"siglaPartido": "Partido", "siglaUf": "UF"},
+                "Despesas": {
+                    "nomeDeputado": "Deputado",
+                    "siglaPartido": "Partido",
+                    "tipoDespesa": "Tipo de despesa",
+                },
+                "Proposições": {"tema": "Tema", "siglaTipo": "Tipo"},
+            }
+            # Date fields ("YYYY-MM-DD") the search of each topic can be filtered by
+            available_rag_date_filters = {
+                "Despesas": {"dataDocumento": "Data do documento"},
+            }
+
+            rag_filters = {}
+            with st.expander("Filtros"):
+                for field, label in available_rag_filters.get(selected_kdb, {}).items():
+                    selected_values = st.multiselect(
+                        label, faiss_kdb.metadata_values(field) if faiss_kdb else []
+                    )
+                    if selected_values:
+                        rag_filters[field] = selected_values
+
+                for field, label in available_rag_date_filters.get(
+                    selected_kdb, {}
+                ).items():
+                    dates = faiss_kdb.metadata_values(field) if faiss_kdb else []
+                    if not dates:
+                        continue
+                    first_date, last_date = (
+                        date.fromisoformat(dates[0]),
+                        date.fromisoformat(dates[-1]),
+                    )
+                    selected_dates = st.date_input(
+                        label,
+                        value=(first_date, last_date),
+                        min_value=first_date,
+                        max_value=last_date,
+                    )
+                    # Only the start is set while the range is being picked
+                    if len(selected_dates) == 2 and selected_dates != (
+                        first_date,
+                        last_date,
+                    ):
+                        rag_filters[field] = tuple(d.isoformat() for d in selected_dates)
+
+            # Debug panel with the timing breakdown of the answer
+            show_timings = st.toggle("Mostrar tempos da resposta")
+
+            # Add Chatbot
+            user_message = st.chat_input("Faça uma pergunta...", key="chat_message")
+            if user_message:
+                st.chat_message("user").write(user_message)
+                if turn is not None:
+                    turn.attributes.update(topic=selected_kdb, filters=len(rag_filters))
+
+                # Load the selected FAISS index based on the selected topic
+                # and the user's message
+                rag_results = None
+                if faiss_kdb:
+                    retriever = faiss_kdb
+
+                    # Hybrid search also matches exact names, acronyms and IDs
+                    with span("search", mode="hybrid") as attributes:
+                        rag_hits = retriever.search_many(
+                            [user_message],
+                            num_results=40,
+                            filters=rag_filters,
+                            mode="hybrid",
+                        )[0]
+                        attributes["hits"] = len(rag_hits)
+                    with span("get_embeddings"):
+                        rag_embeddings = retriever.get_embeddings(
+                            [hit["id"] for hit in rag_hits]
+                        )
+                else:
+                    with span("load_kdb", topic=selected_kdb):
+                        retriever = load_federated_retriever(available_rag_kdbs)
+                    with span("search", mode="federated") as attributes:
+                        rag_hits = retriever.search(user_message, num_results=40)
+                        attributes["hits"] = len(rag_hits)
+                    with span("get_embeddings"):
+                        rag_embeddings = retriever.get_embeddings(rag_hits)
+
+                # Drop duplicated and redundant hits, keeping the context in a token budget
+                with span("assemble_context") as attributes:
+                    rag_hits = context_assembler.assemble(
+                        retriever.encode_queries([user_message])[0],
+                        rag_hits,
+                        rag_embeddings,
+                    )
+                    attributes["hits"] = len(rag_hits)
+                rag_results_list = [
+                    f"[{hit['kdb']}] {hit['text']}" if "kdb" in hit else hit["text"]
+                    for hit in rag_hits
+                ]
                 if rag_results_list:
                     rag_results = "- " + "\n - ".join(rag_results_list)
 
-            # Prompt the user with the question and the RAG information
-            user_prompt = f"""
-            Respond to the user question in <| QUESTION |> considering the
-            information listed in <| RAG |>:
-            
-            <| QUESTION |>
-            {user_message}
-            
-            <| RAG |>
-            {rag_results}
-            """
+                # Prompt the user with the question and the RAG information
+                user_prompt = f"""
+                Respond to the user question in <| QUESTION |> considering the
+                information listed in <| RAG |>:
+                
+                <| QUESTION |>
+                {user_message}
+                
+                <| RAG |>
+                {rag_results}
+                """
+                if turn is not None:
+                    turn.attributes["prompt_chars"] = len(user_prompt)
+
+                with st.spinner("Aguarde um momento..."):
+                    response = gemini.ask(user_prompt)
 
-            print(user_prompt)
+        # The answer is shown once the turn is traced, with its timings
+        if user_message:
+            if response:
+                st.chat_message("assistant").write(response["response"])
 
-            with st.spinner("Aguarde um momento..."):
-                response = gemini.ask(user_prompt)
-                if response:
-                    st.chat_message("assistant").write(response["response"])
+            # The turn isn't traced if the question wasn't in the session state yet
+            if show_timings and turn is not None:
+                with st.expander(f"Tempos da resposta: {turn.duration:.2f}s", expanded=True):
+                    st.dataframe(turn.breakdown(), hide_index=True)
@@ -0,0 +1,220 @@
+import json
+import os
+
+import pandas as pd
+import streamlit as st
+import yaml
+
+from services.data_snapshots import DataSnapshots
+from services.faiss_kdb import KDB_MANIFEST_FILE
+from services.federated_retriever import FederatedRetriever
+from services.gemini import Gemini
+from services.propositions_store import PropositionsStore
+from services.time_series import choose_bucket, lttb, resample
+
+# --------------------------------------------------------
+# Data access for the dashboard
+#
+# Datasets are cached with st.cache_data, keyed on the file modification time
+# and size, so they are read once and again only when the file changes.
+# Heavy objects (FAISS indices with their embedding model, LLM client) are
+# cached with st.cache_resource, shared by every session instead of copied.
+#
+# The files are read from the current data snapshot published by the refresh
+# worker (see refresh_worker.py): when it switches, the paths change and every
+# cache is reloaded from the new, complete snapshot.
+# --------------------------------------------------------
+
+data_snapshots = DataSnapshots("./data_snapshots")
+
+
+def load_data_folder() -> str:
+    """
+    Data folder of the current snapshot (./data until the refresh worker publishes
+    one). Resolve it once per run, so a run never mixes files of two snapshots.
+    """
+    return data_snapshots.current_data_folder("./data")
+
+
+def file_version(filepath) -> tuple:
+    """Version of a file: changes whenever the file is rewritten."""
+    stat = os.stat(filepath)
+    return stat.st_mtime_ns, stat.st_size
+
+
+@st.cache_data(max_entries=32)
+def _read_parquet(filepath, version) -> pd.DataFrame:
+    return pd.read_parquet(filepath)
+
+
+def load_parquet(filepath) -> pd.DataFrame:
+    """Load a parquet file, cached until the file changes."""
+    return _read_parquet(filepath, file_version(filepath))
+
+
+@st.cache_data(max_entries=32)
+def _read_json(filepath, version):
+    with open(filepath, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_json(filepath):
+    """Load a JSON file, cached until the file changes."""
+    return _read_json(filepath, file_version(filepath))
+
+
+@st.cache_data(max_entries=8)
+def _read_yaml(filepath, version):
+    with open(filepath, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
+
+def load_yaml(filepath):
+    """Load a YAML file, cached until the file changes."""
+    return _read_yaml(filepath, file_version(filepath))
+
+
+@st.cache_data(max_entries=8)
+def _read_bytes(filepath, version) -> bytes:
+    with open(filepath, "rb") as file:
+        return file.read()
+
+
+def load_image(filepath) -> bytes:
+    """Load an image file (as bytes for st.image), cached until the file changes."""
+    return _read_bytes(filepath, file_version(filepath))
+
+
+@st.cache_data(max_entries=4)
+def _read_deputado_names(filepath, version) -> dict:
+    deputados_df = pd.read_parquet(filepath, columns=["id", "nome"])
+    return dict(zip(deputados_df["id"], deputados_df["nome"]))
+
+
+def load_deputado_names(filepath) -> dict:
+    """Map of deputado ID -> name, cached until the file changes."""
+    return _read_deputado_names(filepath, file_version(filepath))
+
+
+# Partitioned once per file version and shared (not copied): callers must not
+# modify the returned frames
+@st.cache_resource(max_entries=1)
+def _partition_expenses(filepath, version) -> dict:
+    expenses_df = pd.read_parquet(filepath).sort_values("dataDocumento")
+    return {
+        id: df.reset_index(drop=True) for id, df in expenses_df.groupby("idDeputado")
+    }
+
+
+def load_expenses_deputados(filepath) -> list:
+    """IDs of the deputados with expenses."""
+    return list(_partition_expenses(filepath, file_version(filepath)).keys())
+
+
+def load_deputado_expenses(filepath, deputado_id) -> pd.DataFrame:
+    """
+    Daily expenses of one deputado, sorted by date. The series is partitioned by
+    deputado once, so a selection costs O(1) instead of scanning every row.
+    """
+    partitions = _partition_expenses(filepath, file_version(filepath))
+    return partitions.get(deputado_id, pd.DataFrame())
+
+
+@st.cache_data(max_entries=256)
+def _aggregate_deputado_expenses(
+    filepath, version, deputado_id, start, end, bucket, max_points
+) -> tuple:
+    expenses_df = _partition_expenses(filepath, version).get(deputado_id)
+    if expenses_df is None:
+        return pd.DataFrame(columns=["dataDocumento", "valorDocumento"]), bucket, False
+
+    # The partition is sorted by date: slice the range without scanning it
+    dates = expenses_df["dataDocumento"]
+    first = dates.searchsorted(pd.Timestamp(start), side="left")
+    last = dates.searchsorted(pd.Timestamp(end) + pd.Timedelta(days=1), side="left")
+    expenses_df = expenses_df.iloc[first:last]
+
+    bucket = bucket or choose_bucket(start, end)
+    chart_df = resample(
+        expenses_df, "dataDocumento", "valorDocumento", bucket, "tipoDespesa"
+    )
+    if len(chart_df) <= max_points:
+        return chart_df, bucket, False
+
+    # Too many bars: a single line of the bucket totals, downsampled with LTTB
+    totals_df = resample(expenses_df, "dataDocumento", "valorDocumento", bucket)
+    keep = lttb(
+        totals_df["dataDocumento"].to_numpy(dtype="int64"),
+        totals_df["valorDocumento"].to_numpy(),
+        max_points,
+    )
+    return totals_df.iloc[keep].reset_index(drop=True), bucket, True
+
+
+def load_deputado_expenses_chart(
+    filepath, deputado_id, start, end, bucket=None, max_points=500
+) -> tuple:
+    """
+    Expenses of one deputado in a date range, summed per time bucket and expense
+    type on the server, so the chart size doesn't grow with the raw series.
+
+    :param filepath: Path of the daily expenses parquet file
+    :param deputado_id: ID of the deputado
+    :param start: Start date of the range
+    :param end: End date of the range (inclusive)
+    :param bucket: "day", "week" or "month" (chosen from the range if None)
+    :param max_points: Maximum number of points sent to the chart
+    :return: Tuple (chart DataFrame, bucket used, True if it's a downsampled
+        line of totals instead of bars per expense type)
+    """
+    return _aggregate_deputado_expenses(
+        filepath, file_version(filepath), deputado_id, start, end, bucket, max_points
+    )
+
+
+# Only the latest version of the propositions is kept open
+@st.cache_resource(max_entries=1)
+def _load_propositions_store(filepath, db_file, version) -> PropositionsStore:
+    store = PropositionsStore(db_file)
+    if not store.is_current(str(version)):
+        store.build(pd.read_parquet(filepath), source_version=str(version))
+    return store
+
+
+def load_propositions_store(filepath, db_file=None) -> PropositionsStore:
+    """
+    Propositions store for server-side filtering, search and pagination. The
+    SQLite database is (re)built from the parquet file when the file changes,
+    by default in the 02_intermediate folder next to the parquet file.
+    """
+    db_file = db_file or os.path.join(
+        os.path.dirname(filepath), "02_intermediate", "proposicoes.sqlite"
+    )
+    return _load_propositions_store(filepath, db_file, file_version(filepath))
+
+
+# Only the latest version of the KDBs is kept in memory
+@st.cache_resource(max_entries=1)
+def _load_federated_retriever(folders: tuple, versions: tuple) -> FederatedRetriever:
+    return FederatedRetriever.load(dict(folders))
+
+
+def load_federated_retriever(folders: dict) -> FederatedRetriever:
+    """
+    Load the KDBs, sharing a single embedding model, once for every session.
+    They are reloaded when a KDB is rebuilt (its manifest changes).
+    """
+    versions = tuple(
+        file_version(os.path.join(folder, KDB_MANIFEST_FILE))
+        for folder in folders.values()
+    )
+    return _load_federated_retriever(tuple(folders.items()), versions)
+
+
+@st.cache_resource
+def load_gemini(system_prompt: str) -> Gemini:
+    """
+    Create the Gemini client once for every session. Sessions may call ask
+    concurrently: it doesn't store the response in the shared instance.
+    """
+    return Gemini(system_prompt=system_prompt)
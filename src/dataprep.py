@@ -1,25 +1,33 @@
 import pandas as pd
 import numpy as np
 import json
+import os
 
+from models.insights import Insights
 from services.camara_deputados import CamaraDeputados
 from services.gemini import Gemini
 from services.chunk_summarizer import ChunkSummarizer
 from services.faiss_kdb import FaissKDB
+from services.onnx_embedding_model import OnnxEmbeddingModel, ONNX_CONFIG_FILE
+from services.data_snapshots import REFRESH_RUN_ENV
 
 # Set gemini instance
 gemini = Gemini()
 
+# Runs of the refresh worker (see refresh_worker.py) crawl the data and rebuild the
+# aggregates, insights and FAISS indices, but don't generate the dashboard code
+REFRESH_RUN = os.environ.get(REFRESH_RUN_ENV) == "1"
+
 
 # -------------------------------------
 # Exercício 3: Process "Deputados" data
 # -------------------------------------
 
 # Gates
-RETRIEVE_DEPUTADOS_PARQUET = False
-GENERATE_PARTY_DISTRIBUTION_PARQUET = False
-GENERATE_PARTY_DISTRIBUTION_CHART = False
-GENERATE_PARTY_DISTRIBUTION_INSIGHTS = False
+RETRIEVE_DEPUTADOS_PARQUET = REFRESH_RUN
+GENERATE_PARTY_DISTRIBUTION_PARQUET = REFRESH_RUN
+GENERATE_PARTY_DISTRIBUTION_CHART = REFRESH_RUN
+GENERATE_PARTY_DISTRIBUTION_INSIGHTS = REFRESH_RUN
 
 
 # Files
@@ -105,12 +113,12 @@ def generate_deputados_by_party_analysis():
 
     # Generate and Execute the code with Gemini
     if GENERATE_PARTY_DISTRIBUTION_INSIGHTS:
-        json_str = gemini.ask_and_generate_json_str(prompt=prompt)
-        json_obj = json.loads(json_str)
+        insights = gemini.ask_and_generate_json(prompt=prompt, schema=Insights)
 
         # Save the insights to a file
-        with open(deputados_insights_file, "w") as file:
-            json.dump(json_obj, file, indent=4)
+        if insights:
+            with open(deputados_insights_file, "w") as file:
+                json.dump(insights.model_dump(), file, indent=4)
 
 
 # Request deputados data and save to parquet file
@@ -126,9 +134,9 @@ generate_deputados_by_party_analysis()
 # -------------------------------------
 
 # Gates
-RETRIEVE_DEPUTADOS_EXPENSES_PARQUET = False
-GENERATE_EXPENSES_ANALYSIS_JSON = False
-GENERATE_EXPENSES_INSIGHTS = False
+RETRIEVE_DEPUTADOS_EXPENSES_PARQUET = REFRESH_RUN
+GENERATE_EXPENSES_ANALYSIS_JSON = REFRESH_RUN
+GENERATE_EXPENSES_INSIGHTS = REFRESH_RUN
 
 # Files
 expenses_file_original = "./data/02_intermediate/despesas-deputados-original.parquet"
@@ -272,12 +280,12 @@ def generate_deputados_expenses_analysis():
     """
     # Generate and Execute the code with Gemini
     if GENERATE_EXPENSES_INSIGHTS:
-        json_str = gemini.ask_and_generate_json_str(prompt=prompt)
-        json_obj = json.loads(json_str)
+        insights = gemini.ask_and_generate_json(prompt=prompt, schema=Insights)
 
         # Save the insights to a file
-        with open(expenses_insights_file, "w") as file:
-            json.dump(json_obj, file, indent=4)
+        if insights:
+            with open(expenses_insights_file, "w") as file:
+                json.dump(insights.model_dump(), file, indent=4)
 
 
 # Request deputados expenses data and save to parquet file
@@ -294,12 +302,15 @@ generate_deputados_expenses_analysis()
 # -------------------------------------
 
 # Gates
-RETRIEVE_PROPOSITIONS_PARQUET = False
-GENERATE_PROPOSITIONS_SUMMARY = False
+RETRIEVE_PROPOSITIONS_PARQUET = REFRESH_RUN
+GENERATE_PROPOSITIONS_SUMMARY = REFRESH_RUN
 
 # Files
 propositions_file = "./data/proposicoes_deputados.parquet"
 propositions_summary_file = "./data/sumarizacao_proposicoes.json"
+propositions_summary_cache_file = (
+    "./data/02_intermediate/sumarizacao_proposicoes_cache.json"
+)
 
 
 # 5.a) Retrieve propositions data and save to parquet file
@@ -322,26 +333,19 @@ def retrieve_propositions_parquet() -> pd.DataFrame:
 def generate_propositions_summary():
     """Generate an AI powered summary of the propositions data."""
 
-    df_propositions = pd.read_parquet(propositions_file)
-    # Convert the DataFrame to a readable text maintaining the columns order
-    propositions = df_propositions.to_dict(orient="records")
-    propositions_text = "\n".join(
-        [
-            f"{proposition['id']} - {proposition['siglaTipo']} - {proposition['ementa']}"
-            for proposition in propositions
-        ]
-    )
-
-    complete_text = f"""
-    Current propositions:
-    {propositions_text}
-    """
     print(f"\nSummarizing propositions...\n")
-    propositions_summary = ChunkSummarizer(
+
+    # Stream one record per proposition, so chunks never cut through an ementa
+    propositions_summary = ChunkSummarizer.from_parquet(
         ai_provider=gemini,
-        text=complete_text,
-        window_size=400,
+        filepath=propositions_file,
+        formatter=lambda row: f"{row['id']} - {row['siglaTipo']} - {row['ementa']}",
+        columns=["id", "siglaTipo", "ementa"],
+        window_size=2000,
         overlap_size=100,
+        chunk_prompt_append="\n\nEach line is a proposition: id - siglaTipo - ementa.",
+        cache_file=propositions_summary_cache_file,
+        dedup_threshold=0.9,
         final_summary_prompt_append="\nReturn your answer in Brazilian Portuguese.",
     ).summarize()
 
@@ -364,7 +368,7 @@ if GENERATE_PROPOSITIONS_SUMMARY:
 # --------------------------------------------------------
 
 # Gates
-GENERATE_DASHBOARD = True
+GENERATE_DASHBOARD = not REFRESH_RUN
 GENERATE_DASHBOARD_STEP_1 = False
 GENERATE_DASHBOARD_STEP_2 = False
 GENERATE_DASHBOARD_STEP_3 = False
@@ -538,50 +542,118 @@ if GENERATE_DASHBOARD_STEP_4:
 
 # Gates
 GENERATE_FAISS_INDEX = True
-PROCESS_DEPUTADOS_TO_FAISS = False
-PROCESS_EXPENSES_TO_FAISS = False
-PROCESS_PROPOSITIONS_TO_FAISS = False
+PROCESS_DEPUTADOS_TO_FAISS = REFRESH_RUN
+PROCESS_EXPENSES_TO_FAISS = REFRESH_RUN
+PROCESS_PROPOSITIONS_TO_FAISS = REFRESH_RUN
 LIMIT_EXPENSES_PER_DEPUTADO_COUNT = 8  # Use this so the file size is not too big
+# "onnx" encodes with the int8 quantized ONNX export of the model (no PyTorch
+# needed to serve the KDBs), "torch" with the SentenceTransformer model
+EMBEDDING_BACKEND = "onnx"
 
 # Files
 faiss_index_folder = "./data/faiss"
+faiss_embeddings_cache_folder = "./data/faiss/embeddings"
+faiss_embedding_model_name = "all-MiniLM-L6-v2"
+faiss_onnx_model_folder = "./data/faiss/onnx/all-MiniLM-L6-v2"
+
+
+# (embedding backend, use the int8 ONNX model), resolved once per run
+faiss_embedding_backend = None
+
+
+def resolve_embedding_backend() -> tuple:
+    """
+    Export and verify the ONNX model on first use. When the int8 model fails the
+    verification the fp32 ONNX model is used, and the PyTorch model when that
+    fails too, so the refresh still publishes a snapshot.
+
+    :return: Tuple (embedding backend, use the int8 quantized ONNX model)
+    """
+    global faiss_embedding_backend
+    if faiss_embedding_backend is not None:
+        return faiss_embedding_backend
+
+    faiss_embedding_backend = (EMBEDDING_BACKEND, False)
+    if EMBEDDING_BACKEND != "onnx":
+        return faiss_embedding_backend
+
+    config_file = os.path.join(faiss_onnx_model_folder, ONNX_CONFIG_FILE)
+    if not os.path.exists(config_file):
+        for quantize in [True, False]:
+            try:
+                OnnxEmbeddingModel.export(
+                    faiss_embedding_model_name,
+                    faiss_onnx_model_folder,
+                    quantize=quantize,
+                    cache_folder=faiss_index_folder + "/cache",
+                )
+                break
+            except ValueError as e:
+                print(f"ONNX export failed the verification: {str(e)}")
+        else:
+            print("Falling back to the PyTorch embedding backend")
+            faiss_embedding_backend = ("torch", False)
+            return faiss_embedding_backend
+
+    # The int8 model is only used if it passed the verification
+    with open(config_file, "r") as file:
+        faiss_embedding_backend = ("onnx", "int8_cosine_agreement" in json.load(file))
+    return faiss_embedding_backend
+
+
+def create_faiss_kdb() -> FaissKDB:
+    """Create an empty FAISS KDB with the configured embedding backend."""
+    embedding_backend, onnx_quantized = resolve_embedding_backend()
+    return FaissKDB(
+        model_name=faiss_embedding_model_name,
+        cache_folder=faiss_index_folder + "/cache",
+        embedding_cache_folder=faiss_embeddings_cache_folder,
+        embedding_backend=embedding_backend,
+        onnx_model_folder=faiss_onnx_model_folder,
+        onnx_quantized=onnx_quantized,
+    )
 
 
 def generate_faiss_index():
     """Generate the FAISS index with the collected data."""
 
-    faiss_db = FaissKDB(cache_folder=faiss_index_folder + "/cache")
-
     # DEPUTADOS
     # Add the deputados data to the index, converting each row to a text
     if PROCESS_DEPUTADOS_TO_FAISS:
+        faiss_db = create_faiss_kdb()
         deputados_df = pd.read_parquet(deputados_file)
         deputados_df["text"] = deputados_df.apply(
             lambda row: f"{row['id']} || {row['nome']} || {row['siglaPartido']}", axis=1
         )
 
+        print(deputados_df["text"])
+
+        # Generate the index, using the deputado id as the stable id, with the
+        # fields the searches can be filtered by as metadata
+        deputados_metadata = (
+            deputados_df[["id", "nome", "siglaPartido", "siglaUf"]]
+            .rename(columns={"id": "idDeputado"})
+            .to_dict(orient="records")
+        )
+        faiss_db.add_text(
+            deputados_df["text"].to_list(),
+            ids=deputados_df["id"],
+            metadata=deputados_metadata,
+        )
+
         # Add the deputados insights to the index
         with open(deputados_insights_file, "r") as file:
             deputados_insights = json.load(file)
             deputados_insights_text = "\n".join(deputados_insights["insights"])
-            deputados_df = pd.concat(
-                [
-                    deputados_df,
-                    pd.DataFrame([deputados_insights_text], columns=["text"]),
-                ]
-            )
-
-        print(deputados_df["text"])
-
-        # Generate the index
-        faiss_db.add_text(deputados_df["text"].to_list())
+            faiss_db.add_text([deputados_insights_text])
 
         # Export the index
-        faiss_db.export_kdb(faiss_index_folder + "/deputados.faiss")
+        faiss_db.export_kdb(faiss_index_folder + "/deputados")
 
     # EXPENSES
     # Add the expenses data to the index, converting each row to a text
     if PROCESS_EXPENSES_TO_FAISS:
+        faiss_db = create_faiss_kdb()
         expenses_df = pd.read_parquet(expenses_file_grouped)
 
         # Keep only the first 50 expenses of each deputado
@@ -599,6 +671,29 @@ def generate_faiss_index():
                 )
             expenses_df = _expenses_df
 
+        # Metadata to filter the searches by deputado, party, expense type and date
+        deputados_df = pd.read_parquet(deputados_file)[["id", "nome", "siglaPartido"]]
+        expenses_metadata = (
+            expenses_df[
+                ["idDeputado", "tipoDespesa", "dataDocumento", "valorDocumento"]
+            ]
+            .merge(
+                deputados_df.rename(
+                    columns={"id": "idDeputado", "nome": "nomeDeputado"}
+                ),
+                on="idDeputado",
+                how="left",
+            )
+            .assign(
+                dataDocumento=lambda df: df["dataDocumento"].dt.strftime("%Y-%m-%d")
+            )
+            .to_dict(orient="records")
+        )
+        expenses_metadata = [
+            {key: value for key, value in row.items() if not pd.isna(value)}
+            for row in expenses_metadata
+        ]
+
         # Add R$ to the valorDocumento column
         expenses_df["valorDocumento"] = expenses_df["valorDocumento"].apply(
             lambda x: f"R${x}"
@@ -626,37 +721,51 @@ def generate_faiss_index():
         )
         print(expenses_df["text"])
 
-        # Generate the index
-        faiss_db.add_text(expenses_df["text"].to_list())
+        # Generate the index (the insights text, added last, has no metadata)
+        faiss_db.add_text(
+            expenses_df["text"].to_list(),
+            metadata=expenses_metadata + [{}],
+        )
 
         # Export the index
-        faiss_db.export_kdb(faiss_index_folder + "/expenses.faiss")
+        faiss_db.export_kdb(faiss_index_folder + "/expenses")
 
     # PROPOSITIONS
     # Add the propositions data to the index, converting each row to a text
     if PROCESS_PROPOSITIONS_TO_FAISS:
+        faiss_db = create_faiss_kdb()
         propositions_df = pd.read_parquet(propositions_file)
         propositions_df["text"] = propositions_df.apply(
             lambda row: f"{row['id']} || {row['siglaTipo']} || {row['ementa']}",
             axis=1,
         )
 
+        # The same proposition can be listed under more than one tema: it's indexed
+        # once, with the list of all its temas
+        temas = propositions_df.groupby("id", sort=False)["tema"].agg(
+            lambda temas: list(dict.fromkeys(temas))
+        )
+        propositions_df = propositions_df.drop_duplicates(subset="id")
+        propositions_df["tema"] = propositions_df["id"].map(temas)
+        print(propositions_df)
+
+        # Generate the index, using the proposition id as the stable id
+        faiss_db.add_text(
+            propositions_df["text"].to_list(),
+            ids=propositions_df["id"],
+            metadata=propositions_df[["siglaTipo", "ano", "tema"]].to_dict(
+                orient="records"
+            ),
+        )
+
         # Add the propositions summary to the index
         with open(propositions_summary_file, "r", encoding="utf-8") as file:
             propositions_summary = json.load(file)
             propositions_summary_text = propositions_summary["summary"]
-            propositions_df = pd.concat(
-                [
-                    propositions_df,
-                    pd.DataFrame([propositions_summary_text], columns=["text"]),
-                ]
-            )
-
-        print(propositions_df)
-        faiss_db.add_text(propositions_df["text"].to_list())
+            faiss_db.add_text([propositions_summary_text])
 
         # Export the index
-        faiss_db.export_kdb(faiss_index_folder + "/propositions.faiss")
+        faiss_db.export_kdb(faiss_index_folder + "/propositions")
 
 
 # Generate the FAISS index
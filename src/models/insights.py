@@ -0,0 +1,5 @@
+from pydantic import BaseModel
+
+
+class Insights(BaseModel):
+    insights: list[str]
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from services.data_snapshots import REFRESH_RUN_ENV, DataSnapshots
+
+# --------------------------------------------------------
+# Background refresh: runs the data preparation (crawl -> aggregate -> insights
+# -> index) on a schedule into a staging snapshot and publishes it when the run
+# succeeds. The dashboard reads the current snapshot and reloads when it changes.
+# --------------------------------------------------------
+
+# Gates
+REFRESH_INTERVAL_HOURS = 24
+RUN_ONCE = False  # Refresh once and exit (e.g. when scheduled by cron)
+KEEP_SNAPSHOTS = 3
+
+# Files
+data_folder = "./data"
+snapshots_folder = "./data_snapshots"
+dataprep_script = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "dataprep.py"
+)
+
+
+def refresh() -> bool:
+    """
+    Build and publish a new snapshot of the data.
+
+    :return: True if the snapshot was published, False if the run failed
+    """
+    snapshots = DataSnapshots(snapshots_folder)
+    staging = snapshots.create_staging(snapshots.current_data_folder(data_folder))
+    # Remove the stagings of previous runs that were killed before finishing
+    snapshots.cleanup(keep=KEEP_SNAPSHOTS, staging=staging)
+
+    # dataprep.py writes to ./data, so it runs from the staging directory
+    started = time.time()
+    result = subprocess.run(
+        [sys.executable, dataprep_script],
+        cwd=staging,
+        env={**os.environ, REFRESH_RUN_ENV: "1"},
+    )
+    if result.returncode != 0:
+        print(f"[RefreshWorker] dataprep failed with code {result.returncode}")
+        snapshots.discard(staging)
+        return False
+
+    version = snapshots.publish(staging)
+    snapshots.cleanup(keep=KEEP_SNAPSHOTS)
+    print(f"[RefreshWorker] Snapshot {version} built in {time.time() - started:.0f}s")
+    return True
+
+
+def run_forever():
+    """Refresh the data every REFRESH_INTERVAL_HOURS, a failed run is retried on the next one."""
+    while True:
+        refresh()
+        next_run = time.time() + REFRESH_INTERVAL_HOURS * 3600
+        print(
+            f"[RefreshWorker] Next refresh at {datetime.fromtimestamp(next_run):%Y-%m-%d %H:%M}"
+        )
+        time.sleep(max(0, next_run - time.time()))
+
+
+if RUN_ONCE:
+    sys.exit(0 if refresh() else 1)
+else:
+    run_forever()
@@ -0,0 +1,179 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+class BM25Index:
+    """
+    A sparse inverted index ranked with Okapi BM25, for queries that name exact
+    entities (deputado names, party acronyms, proposition numbers) where dense
+    embeddings perform poorly.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Initializes an empty index.
+
+        :param k1: Term frequency saturation parameter
+        :param b: Document length normalization parameter (0 to 1)
+        """
+        self.k1 = k1
+        self.b = b
+
+        # Inverted index: term -> {document ID: term frequency}
+        self.postings = {}
+        # Document ID -> number of terms
+        self.doc_lengths = {}
+        # Document ID -> its distinct terms, to update only their postings on removal
+        # (None after load until a removal needs it, see _get_doc_terms)
+        self.doc_terms = {}
+        self.total_length = 0
+
+    def add(self, ids: list, texts: list):
+        """
+        Add documents to the index.
+
+        :param ids: List of document IDs
+        :param texts: List of document texts
+        """
+        for id, text in zip(ids, texts):
+            tokens = self.tokenize(text)
+            self.doc_lengths[id] = len(tokens)
+            self.total_length += len(tokens)
+            frequencies = Counter(tokens)
+            if self.doc_terms is not None:
+                self.doc_terms[id] = tuple(frequencies)
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, {})[id] = frequency
+
+    def remove(self, ids: list):
+        """
+        Remove documents from the index.
+
+        :param ids: List of document IDs
+        """
+        doc_terms = self._get_doc_terms()
+        for id in set(ids):
+            if id not in self.doc_lengths:
+                continue
+
+            self.total_length -= self.doc_lengths.pop(id)
+            for term in doc_terms.pop(id):
+                postings = self.postings[term]
+                del postings[id]
+                if not postings:
+                    del self.postings[term]
+
+    def save(self, filepath):
+        """
+        Save the postings to a parquet file (one row per term and document), so
+        the index is loaded without tokenizing the texts again.
+
+        :param filepath: Path of the parquet file
+        """
+        # The rows of each term are kept together, load relies on it
+        terms, ids, frequencies = [], [], []
+        for term, postings in self.postings.items():
+            terms += [term] * len(postings)
+            ids += postings.keys()
+            frequencies += postings.values()
+
+        pd.DataFrame({"term": terms, "id": ids, "frequency": frequencies}).to_parquet(
+            filepath
+        )
+
+    @staticmethod
+    def load(filepath, ids: list, k1=1.5, b=0.75):
+        """
+        Load an index saved with save.
+
+        :param filepath: Path of the parquet file
+        :param ids: List of all the document IDs (documents without terms have no postings)
+        :param k1: Term frequency saturation parameter
+        :param b: Document length normalization parameter (0 to 1)
+        :return: The BM25Index
+        """
+        postings_df = pd.read_parquet(filepath)
+        doc_ids = postings_df["id"].to_list()
+        frequencies = postings_df["frequency"].to_list()
+
+        # The rows of a term are contiguous (see save): split them at term changes
+        codes, terms = pd.factorize(postings_df["term"])
+        bounds = [0, *(np.flatnonzero(np.diff(codes)) + 1).tolist(), len(codes)]
+
+        index = BM25Index(k1=k1, b=b)
+        for term, start, end in zip(terms, bounds, bounds[1:]):
+            index.postings[term] = dict(zip(doc_ids[start:end], frequencies[start:end]))
+
+        index.doc_lengths = dict.fromkeys(ids, 0)
+        index.doc_lengths.update(postings_df.groupby("id")["frequency"].sum().to_dict())
+        index.total_length = sum(index.doc_lengths.values())
+
+        # Only needed to remove documents, built from the postings when it happens
+        index.doc_terms = None
+        return index
+
+    def search(self, query: str, num_results=5, ids=None) -> list:
+        """
+        Rank the documents that contain at least one of the query terms.
+
+        :param query: The query text
+        :param num_results: The number of results to return
+        :param ids: Optional set of document IDs the search is restricted to
+        :return: List of (document ID, BM25 score) tuples, best first
+        """
+        if not self.doc_lengths:
+            return []
+
+        count = len(self.doc_lengths)
+        average_length = self.total_length / count
+
+        scores = {}
+        for term in set(self.tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for id, frequency in postings.items():
+                if ids is not None and id not in ids:
+                    continue
+                length = self.doc_lengths[id]
+                norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                scores[id] = scores.get(id, 0.0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + norm
+                )
+
+        return heapq.nlargest(num_results, scores.items(), key=lambda item: item[1])
+
+    def _get_doc_terms(self) -> dict:
+        """
+        Get the distinct terms of each document, built from the postings after load.
+
+        :return: Dict of document ID -> tuple of terms
+        """
+        if self.doc_terms is None:
+            doc_terms = {id: [] for id in self.doc_lengths}
+            for term, postings in self.postings.items():
+                for id in postings:
+                    doc_terms[id].append(term)
+            self.doc_terms = {id: tuple(terms) for id, terms in doc_terms.items()}
+        return self.doc_terms
+
+    @staticmethod
+    def tokenize(text: str) -> list:
+        """
+        Split a text into lowercase terms without accents, so "Proposição" and
+        "proposicao" match, and "PL 1234/2024" becomes ["pl", "1234", "2024"].
+
+        :param text: The text to split
+        :return: List of terms
+        """
+        text = unicodedata.normalize("NFKD", str(text).lower())
+        text = "".join(char for char in text if not unicodedata.combining(char))
+        return re.findall(r"\w+", text)
@@ -1,4 +1,21 @@
+import hashlib
+import json
+import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from services.near_duplicates import MinHashDeduplicator
+from services.rate_limiter import RateLimiter
+from services.tokens import estimate_tokens
+
+
+# A record is a content-defined boundary when its hash is divisible by this value
+BOUNDARY_MODULUS = 4
 
 
 class ChunkSummarizer:
@@ -6,24 +23,54 @@ class ChunkSummarizer:
         self,
         ai_provider,
         text,
-        window_size=200,
-        overlap_size=50,
+        window_size=2000,
+        overlap_size=100,
         chunk_prompt_template=None,
         chunk_prompt_append=None,
         final_summary_prompt_template=None,
         final_summary_prompt_append=None,
+        intermediate_summary_prompt_template=None,
+        reduce_mode="auto",
+        reduce_fan_in=10,
+        reduce_max_tokens=8000,
+        max_reduce_levels=10,
+        token_counter=None,
+        max_workers=4,
+        requests_per_minute=60,
+        max_retries=3,
+        retry_backoff=2,
+        cache_file=None,
+        dedup_threshold=None,
     ):
         """
         Initializes the summarizer.
 
         :param ai_provider: An AI provider with an 'ask' method for generating responses
-        :param text: Input text to summarize (str or list of strings)
-        :param window_size: Number of lines or characters per chunk
-        :param overlap_size: Overlap between chunks
+        :param text: Input text to summarize: a str with one record per line, a list or
+            iterator of records, or a pathlib.Path to a text file (one record per line).
+            Iterators and files are read lazily, as the chunks are summarized.
+        :param window_size: Maximum number of tokens per chunk
+        :param overlap_size: Number of tokens of records repeated between consecutive chunks
         :param chunk_prompt_template: Optional template for chunk summarization
         :param final_summary_prompt_template: Optional template for final summary generation
+        :param intermediate_summary_prompt_template: Optional template for the intermediate
+            (tree-reduce) summaries
+        :param reduce_mode: How chunk summaries are combined: "flat" (single final prompt),
+            "tree" (recursive batches) or "auto" (tree only when the summaries exceed the budget)
+        :param reduce_fan_in: Maximum number of summaries combined in a single reduce prompt
+        :param reduce_max_tokens: Maximum number of tokens of summaries in a single reduce prompt
+        :param max_reduce_levels: Maximum number of intermediate reduce levels
+        :param token_counter: Optional function that counts the tokens of a text
+        :param max_workers: Number of chunks summarized concurrently
+        :param requests_per_minute: Rate limit of the AI provider (None to disable)
+        :param max_retries: Number of retries for a failed chunk summary
+        :param retry_backoff: Base delay in seconds between retries (doubled on each attempt)
+        :param cache_file: Optional JSON file to cache chunk and intermediate summaries.
+            When set, chunk and batch boundaries are content-defined, so new records
+            only invalidate the chunks around them.
+        :param dedup_threshold: Optional similarity threshold (0-1) to drop near-duplicate
+            records before summarization (None to keep every record)
         """
-        # # Ensure text is a list
         self.text = text
 
         # Chunk-related parameters
@@ -51,6 +98,47 @@ class ChunkSummarizer:
             + (final_summary_prompt_append or "")
         )
 
+        self.intermediate_summary_prompt_template = (
+            intermediate_summary_prompt_template
+            or (
+                """Based on the following partial summaries:
+            - {combined_summaries}
+            ######
+            Combine them into a single summary that keeps every key point
+            and removes redundant information.
+
+            Provide the summary as plain text string.
+            Do not add any additional information or other fields."""
+            )
+        )
+
+        # Reduce-related parameters
+        if reduce_mode not in ("flat", "tree", "auto"):
+            raise ValueError("reduce_mode must be 'flat', 'tree' or 'auto'.")
+        self.reduce_mode = reduce_mode
+        self.reduce_fan_in = max(2, reduce_fan_in)
+        self.reduce_max_tokens = reduce_max_tokens
+        self.max_reduce_levels = max_reduce_levels
+        self.token_counter = token_counter or estimate_tokens
+
+        # Concurrency and rate limit parameters
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.rate_limiter = RateLimiter(requests_per_minute)
+
+        # Summary cache, keyed by the hash of the prompt (template + content)
+        self.cache_file = cache_file
+        self.cache = self._load_cache()
+        self.cache_hits = 0
+        self._cache_used = set()
+        self._cache_lock = threading.Lock()
+
+        # Near-duplicate records elimination
+        self.deduplicator = (
+            MinHashDeduplicator(threshold=dedup_threshold) if dedup_threshold else None
+        )
+
         # AI Provider
         self.ai_provider = ai_provider
 
@@ -60,67 +148,305 @@ class ChunkSummarizer:
                 "AI provider must have an 'ask' method that accepts a prompt."
             )
 
-        # Process text into chunks
-        self.chunks = self._text_to_chunks()
+        # Chunks are produced lazily while summarizing
+        self.chunks_count = 0
         self.chunks_summaries = []
 
-    def _text_to_chunks(self) -> list:
-        """Breaks the text into chunks based on window_size and overlap_size."""
-        n = self.window_size  # Size of each chunk
-        m = self.overlap_size  # Overlap between chunks
+    @classmethod
+    def from_parquet(
+        cls, ai_provider, filepath, formatter, columns=None, batch_size=1024, **kwargs
+    ):
+        """
+        Creates a summarizer that streams records from a parquet file, one row group
+        batch at a time, so the whole file is never loaded in memory.
+
+        :param ai_provider: An AI provider with an 'ask' method for generating responses
+        :param filepath: Path to the parquet file
+        :param formatter: Function that converts a row (dict) into a record string
+        :param columns: Optional list of columns to read
+        :param batch_size: Number of rows read per batch
+        :param kwargs: Other ChunkSummarizer parameters
+        :return: The ChunkSummarizer instance
+        """
+        records = cls._iter_parquet_records(filepath, formatter, columns, batch_size)
+        return cls(ai_provider=ai_provider, text=records, **kwargs)
+
+    @staticmethod
+    def _iter_parquet_records(filepath, formatter, columns, batch_size):
+        """
+        Lazily reads the rows of a parquet file as records.
 
-        # If text is a string, split by lines
+        :param filepath: Path to the parquet file
+        :param formatter: Function that converts a row (dict) into a record string
+        :param columns: Optional list of columns to read
+        :param batch_size: Number of rows read per batch
+        :return: Generator of records
+        """
+        parquet_file = pq.ParquetFile(filepath)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            for row in batch.to_pylist():
+                yield formatter(row)
+
+    def _iter_lines(self):
+        """
+        Lazily iterates over the lines of the input.
+
+        :return: Generator of lines
+        """
+        # If text is a string, each line is a record
         if isinstance(self.text, str):
-            self.text = self.text.split("\n")
+            yield from self.text.split("\n")
+
+        # If text is a file path, read it line by line
+        elif isinstance(self.text, Path):
+            with open(self.text, "r", encoding="utf-8") as file:
+                yield from file
 
-        # If text is a list of strings, join into a single string
-        if isinstance(self.text, list):
-            self.text = "\n".join(self.text)
+        # Otherwise, it should be an iterable of records
+        elif hasattr(self.text, "__iter__"):
+            yield from self.text
 
-        # If text is not a string, raise an error
-        if not isinstance(self.text, str):
-            raise ValueError("Input text must be a string or a list of strings.")
+        else:
+            raise ValueError(
+                "Input text must be a string, an iterable of strings or a file path."
+            )
+
+    def _iter_records(self):
+        """
+        Lazily splits the input into records (one per line), the units that are never
+        cut by the chunking. Records larger than a whole window are split by words.
+
+        :return: Generator of records
+        """
+        for record in self._iter_lines():
+            record = str(record).strip()
+            if not record:
+                continue
+
+            # Skip records that are near-duplicates of a previous one
+            if self.deduplicator and self.deduplicator.is_duplicate(record):
+                continue
 
-        # Split text into chunks
-        chunks = []
-        for i in range(0, len(self.text), n - m):
-            chunk = self.text[i : i + n]
-            chunks.append(chunk)
+            if self.token_counter(record) > self.window_size:
+                yield from self._split_record(record)
+            else:
+                yield record
 
-        return chunks
+    def _split_record(self, record: str) -> list:
+        """
+        Splits a record that doesn't fit in a window into pieces at word boundaries.
+
+        :param record: The record to split
+        :return: List of pieces that fit in a window
+        """
+        pieces = []
+        piece = []
+        for word in record.split():
+            if piece and self.token_counter(" ".join(piece + [word])) > self.window_size:
+                pieces.append(" ".join(piece))
+                piece = []
+            piece.append(word)
+
+        if piece:
+            pieces.append(" ".join(piece))
+
+        return pieces
+
+    def _overlap_records(self, chunk: list) -> list:
+        """
+        Gets the trailing records of a chunk that fit in overlap_size tokens.
+
+        :param chunk: List of records of the previous chunk
+        :return: List of records to repeat at the start of the next chunk
+        """
+        overlap = []
+        overlap_tokens = 0
+        for record in reversed(chunk):
+            tokens = self.token_counter(record)
+            if overlap_tokens + tokens > self.overlap_size:
+                break
+            overlap.insert(0, record)
+            overlap_tokens += tokens
+
+        return overlap
+
+    def _iter_chunks(self):
+        """
+        Lazily breaks the text into chunks of up to window_size tokens, with about
+        overlap_size tokens of overlap, without cutting through records.
+
+        :return: Generator of chunks (lists of records)
+        """
+        chunk = []
+        chunk_tokens = 0
+        for record in self._iter_records():
+            tokens = self.token_counter(record)
+
+            if chunk and (
+                chunk_tokens + tokens > self.window_size
+                or (
+                    chunk_tokens >= self.window_size // 2
+                    and self._is_boundary(chunk[-1])
+                )
+            ):
+                yield chunk
+
+                # Start the next chunk with the overlapping records,
+                # dropping the oldest ones if the new record doesn't fit
+                chunk = self._overlap_records(chunk)
+                chunk_tokens = sum(self.token_counter(r) for r in chunk)
+                while chunk and chunk_tokens + tokens > self.window_size:
+                    chunk_tokens -= self.token_counter(chunk.pop(0))
+
+            chunk.append(record)
+            chunk_tokens += tokens
+
+        if chunk:
+            yield chunk
 
     def _create_chunk_prompt(self, chunk) -> str:
         """
         Generates a prompt for summarizing a chunk of text.
 
-        :param chunk: The chunk of text to summarize
+        :param chunk: The chunk to summarize (list of records)
         :return: The prompt for summarizing the chunk
         """
         content = "\n".join(chunk)
         return self.chunk_prompt_template.format(content=content).strip()
 
+    def _summarize_chunk(self, i: int, chunk) -> str:
+        """
+        Summarizes a single chunk of text.
+
+        :param i: Index of the chunk
+        :param chunk: The chunk of text to summarize
+        :return: The summary of the chunk
+        """
+        print(f"Summarizing chunk {i + 1}")
+
+        # Create prompt for this chunk
+        prompt = self._create_chunk_prompt(chunk)
+
+        # Use AI provider's ask method to get summary
+        return self._ask_cached(prompt)
+
     def _summarize_chunks(self) -> list:
         """
         Summarizes each chunk of text using the AI provider.
+        Chunks are summarized concurrently as they are produced, keeping the
+        original chunk order. Only a bounded number of chunks is kept in memory.
 
         :return: List of summaries for each chunk
         """
         chunk_summaries = []
-        for i, chunk in enumerate(self.chunks):
-            print(f"Summarizing chunk {i + 1} of {len(self.chunks)}")
-
-            # Create prompt for this chunk
-            prompt = self._create_chunk_prompt(chunk)
-
-            # Use AI provider's ask method to get summary
-            summary = self.ask(prompt)
-            if summary:
-                chunk_summaries.append(summary)
-                time.sleep(2)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for i, chunk in enumerate(self._iter_chunks()):
+                pending.append(executor.submit(self._summarize_chunk, i, chunk))
+                self.chunks_count = i + 1
+
+                # Wait for the oldest chunk when there are enough chunks in flight
+                if len(pending) >= self.max_workers * 2:
+                    chunk_summaries.append(pending.popleft().result())
+
+            while pending:
+                chunk_summaries.append(pending.popleft().result())
+
+        if self.deduplicator:
+            print(
+                f"Near-duplicate records merged: {self.deduplicator.merged_count}"
+                f" of {self.deduplicator.seen_count}"
+            )
 
         self.chunks_summaries = chunk_summaries
+        # Checkpoint the chunk summaries, so a failed reduce doesn't lose them
+        self._save_cache(prune=False)
         return chunk_summaries
 
+    def _batch_summaries(self, summaries: list) -> list:
+        """
+        Groups summaries into batches bounded by reduce_fan_in and reduce_max_tokens.
+
+        :param summaries: List of summaries to group
+        :return: List of batches (lists of summaries)
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for summary in summaries:
+            tokens = self.token_counter(summary)
+
+            # Close the current batch if this summary doesn't fit
+            if batch and (
+                len(batch) >= self.reduce_fan_in
+                or batch_tokens + tokens > self.reduce_max_tokens
+                or (
+                    len(batch) >= self.reduce_fan_in // 2
+                    and self._is_boundary(batch[-1])
+                )
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+
+            batch.append(summary)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _fits_in_single_prompt(self, summaries: list) -> bool:
+        """
+        Checks whether the summaries can be combined in a single reduce prompt.
+
+        :param summaries: List of summaries
+        :return: True if the summaries fit within the fan-in and token budgets
+        """
+        tokens = sum(self.token_counter(summary) for summary in summaries)
+        if self.reduce_mode == "auto":
+            return tokens <= self.reduce_max_tokens
+        return len(summaries) <= self.reduce_fan_in and tokens <= self.reduce_max_tokens
+
+    def _reduce_batch(self, batch: list) -> str:
+        """
+        Summarizes a batch of summaries into a single intermediate summary.
+
+        :param batch: List of summaries
+        :return: The intermediate summary
+        """
+        prompt = self.intermediate_summary_prompt_template.format(
+            combined_summaries="\n- ".join(batch)
+        ).strip()
+        return self._ask_cached(prompt)
+
+    def _tree_reduce(self, summaries: list) -> list:
+        """
+        Recursively summarizes batches of summaries until they fit in a single prompt.
+        The batches of each level are summarized concurrently.
+
+        :param summaries: List of chunk summaries
+        :return: List of summaries that fit in the final prompt
+        """
+        level = 0
+        while (
+            len(summaries) > 1
+            and not self._fits_in_single_prompt(summaries)
+            and level < self.max_reduce_levels
+        ):
+            level += 1
+            batches = self._batch_summaries(summaries)
+            print(
+                f"Reducing {len(summaries)} summaries into {len(batches)} (level {level})"
+            )
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                summaries = list(executor.map(self._reduce_batch, batches))
+            self._save_cache(prune=False)
+
+        return summaries
+
     def summarize(self) -> str:
         """
         Generates the final summary based on chunk summaries.
@@ -133,8 +459,13 @@ class ChunkSummarizer:
         if not self.chunks_summaries:
             self._summarize_chunks()
 
+        # Reduce the chunk summaries until they fit in the final prompt
+        summaries = self.chunks_summaries
+        if self.reduce_mode != "flat":
+            summaries = self._tree_reduce(summaries)
+
         # Combine chunk summaries
-        combined_summaries = "\n- ".join(self.chunks_summaries)
+        combined_summaries = "\n- ".join(summaries)
 
         # Create final summary prompt
         final_prompt = self.final_summary_prompt_template.format(
@@ -144,7 +475,11 @@ class ChunkSummarizer:
         print("Generating final summary...")
 
         # Get final summary using AI provider
-        final_summary = self.ask(final_prompt)
+        final_summary = self._ask_cached(final_prompt)
+
+        self._save_cache()
+        if self.cache_file:
+            print(f"Summary cache hits: {self.cache_hits}")
 
         return final_summary
 
@@ -162,3 +497,104 @@ class ChunkSummarizer:
             response = response["response"]
 
         return str(response) if response else ""
+
+    def ask_with_retry(self, prompt: str) -> str:
+        """
+        Ask the AI provider respecting the rate limit, retrying with
+        exponential backoff when the provider fails or returns nothing.
+
+        :param prompt: The prompt to ask the AI provider
+        :return: The response from the AI provider
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            response = self.ask(prompt)
+            if response:
+                return response
+
+            if attempt < self.max_retries:
+                delay = self.retry_backoff * (2**attempt)
+                print(f"Empty response, retrying in {delay} seconds...")
+                time.sleep(delay)
+
+        raise RuntimeError(
+            f"AI provider failed to respond after {self.max_retries + 1} attempts."
+        )
+
+    # ----------------------------
+    # Cache
+    # ----------------------------
+
+    def _is_boundary(self, text: str) -> bool:
+        """
+        Checks whether a record is a content-defined boundary. Only used when the
+        cache is enabled, so boundaries depend on the content and not on offsets.
+
+        :param text: The record (or summary) to check
+        :return: True if a chunk (or batch) may end after this text
+        """
+        if not self.cache_file:
+            return False
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return int(digest[:8], 16) % BOUNDARY_MODULUS == 0
+
+    def _ask_cached(self, prompt: str) -> str:
+        """
+        Ask the AI provider, reusing a cached response for the same prompt.
+
+        :param prompt: The prompt to ask the AI provider
+        :return: The response from the AI provider (or the cache)
+        """
+        if not self.cache_file:
+            return self.ask_with_retry(prompt)
+
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._cache_lock:
+            response = self.cache.get(key)
+
+        if response:
+            with self._cache_lock:
+                self.cache_hits += 1
+        else:
+            response = self.ask_with_retry(prompt)
+
+        with self._cache_lock:
+            self.cache[key] = response
+            self._cache_used.add(key)
+
+        return response
+
+    def _load_cache(self) -> dict:
+        """
+        Load the summary cache from the cache file.
+
+        :return: Dictionary of prompt hashes to summaries
+        """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+
+        with open(self.cache_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_cache(self, prune: bool = True) -> None:
+        """
+        Save the summaries to the cache file.
+
+        :param prune: Keep only the summaries used in this run, so the cache follows
+            the corpus size. Checkpoints during the run keep every entry, as the
+            ones not used yet (e.g. reduce summaries) may still be needed.
+        """
+        if not self.cache_file:
+            return
+
+        with self._cache_lock:
+            if prune:
+                cache = {key: self.cache[key] for key in self._cache_used}
+            else:
+                cache = dict(self.cache)
+
+        # Write to a temporary file first so the cache is never half-written
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(cache, file, indent=4, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
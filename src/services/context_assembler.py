@@ -0,0 +1,96 @@
+import numpy as np
+
+from services.tokens import estimate_tokens
+
+
+class ContextAssembler:
+    """
+    Turns ranked search hits into a compact RAG context: duplicate hits are
+    removed, the remaining ones are picked with Maximal Marginal Relevance (MMR)
+    over their embeddings and greedily packed into a token budget, then returned
+    in their original relevance order.
+    """
+
+    def __init__(
+        self,
+        token_budget=2000,
+        mmr_lambda=0.7,
+        duplicate_threshold=0.95,
+        token_counter=None,
+    ):
+        """
+        Initializes the context assembler.
+
+        :param token_budget: Maximum number of tokens of the selected texts
+        :param mmr_lambda: Trade-off between relevance (1) and diversity (0)
+        :param duplicate_threshold: Cosine similarity above which a hit is a near-duplicate
+            of an already selected one and is dropped
+        :param token_counter: Optional function that counts the tokens of a text
+        """
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.token_counter = token_counter or estimate_tokens
+
+    def assemble(
+        self, query_embedding: np.ndarray, hits: list, embeddings: np.ndarray
+    ) -> list:
+        """
+        Select the hits that make up the context.
+
+        :param query_embedding: Normalized embedding of the query
+        :param hits: Ranked hits (dicts with at least the "text", and the "id")
+        :param embeddings: Normalized embeddings of the hits (one row per hit)
+        :return: The selected hits, in their original order
+        """
+        # Exact duplicates: the same entry or the same text returned more than once
+        unique = []
+        seen = set()
+        for i, hit in enumerate(hits):
+            keys = {(hit.get("kdb"), hit.get("id")), " ".join(hit["text"].split())}
+            if seen.isdisjoint(keys):
+                unique.append(i)
+            seen.update(keys)
+
+        if not unique:
+            return []
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)[unique]
+        relevance = embeddings @ np.asarray(query_embedding, dtype=np.float32)
+        similarities = embeddings @ embeddings.T
+
+        selected = []
+        candidates = list(range(len(unique)))
+        tokens = 0
+        duplicates = 0
+        while candidates:
+            if selected:
+                redundancy = similarities[np.ix_(candidates, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(candidates))
+
+            scores = (
+                self.mmr_lambda * relevance[candidates]
+                - (1 - self.mmr_lambda) * redundancy
+            )
+            best = int(np.argmax(scores))
+            candidate = candidates.pop(best)
+
+            if redundancy[best] >= self.duplicate_threshold:
+                duplicates += 1
+                continue
+
+            # Greedy packing: skip the texts that don't fit, smaller ones may still fit
+            candidate_tokens = self.token_counter(hits[unique[candidate]]["text"])
+            if tokens + candidate_tokens > self.token_budget:
+                continue
+
+            selected.append(candidate)
+            tokens += candidate_tokens
+
+        print(
+            f"[ContextAssembler] Selected {len(selected)} of {len(hits)} hits"
+            f" ({len(hits) - len(unique) + duplicates} duplicates),"
+            f" {tokens} of {self.token_budget} tokens"
+        )
+        return [hits[unique[i]] for i in sorted(selected)]
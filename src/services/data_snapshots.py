@@ -0,0 +1,183 @@
+import os
+import shutil
+from datetime import datetime
+
+# Environment variable set by the refresh worker when it runs dataprep.py: it
+# turns on the crawl, aggregate, insights and index stages
+REFRESH_RUN_ENV = "DATAPREP_REFRESH"
+
+# File with the name of the current snapshot
+CURRENT_POINTER_FILE = "CURRENT"
+
+# Cache folders (relative to the data folder) shared by every snapshot instead of
+# copied: they are keyed by content, so a new snapshot can safely reuse them
+SHARED_CACHE_FOLDERS = ["faiss/cache", "faiss/embeddings"]
+
+
+class DataSnapshots:
+    """
+    Versioned copies of the data folder. A snapshot is built in a staging
+    directory and published by atomically switching a "current" pointer, so
+    readers only ever see complete snapshots and a failed build is discarded:
+
+        <root>/CURRENT                   name of the current snapshot
+        <root>/<version>/data/...        published snapshots
+        <root>/<version>.staging/data/   snapshot being built
+        <root>/shared/...                caches shared by the snapshots
+    """
+
+    def __init__(self, root):
+        """
+        Initializes the snapshots.
+
+        :param root: Directory of the snapshots
+        """
+        self.root = root
+
+    def current(self) -> str:
+        """
+        Get the current snapshot.
+
+        :return: The version of the current snapshot, or None if none was published
+        """
+        try:
+            with open(os.path.join(self.root, CURRENT_POINTER_FILE), "r") as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def current_data_folder(self, default="./data") -> str:
+        """
+        Get the data folder of the current snapshot.
+
+        :param default: Data folder to use when no snapshot was published
+        :return: Path of the data folder
+        """
+        version = self.current()
+        if version is None:
+            return default
+        return os.path.join(self.root, version, "data")
+
+    def create_staging(self, seed_folder) -> str:
+        """
+        Create a staging directory for a new snapshot, with a copy of a data folder
+        (usually the current snapshot) so the stages that don't run keep its files.
+
+        :param seed_folder: Data folder copied into the staging directory
+        :return: Path of the staging directory (the data is in its "data" folder)
+        """
+        version = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        staging = os.path.join(self.root, f"{version}.staging")
+        staging_data = os.path.join(staging, "data")
+        seed_folder = os.path.realpath(seed_folder)
+
+        shared = [
+            os.path.join(seed_folder, *c.split("/")) for c in SHARED_CACHE_FOLDERS
+        ]
+        shutil.copytree(
+            seed_folder,
+            staging_data,
+            ignore=lambda folder, names: [
+                name for name in names if os.path.join(folder, name) in shared
+            ],
+        )
+
+        # Link the shared caches, seeding them on the first run
+        for cache_folder in SHARED_CACHE_FOLDERS:
+            shared_folder = os.path.abspath(
+                os.path.join(self.root, "shared", cache_folder)
+            )
+            if not os.path.exists(shared_folder):
+                seed_cache = os.path.join(seed_folder, *cache_folder.split("/"))
+                if os.path.isdir(seed_cache):
+                    shutil.copytree(seed_cache, shared_folder)
+                else:
+                    os.makedirs(shared_folder)
+
+            link = os.path.join(staging_data, *cache_folder.split("/"))
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(shared_folder, link, target_is_directory=True)
+
+        print(f"[DataSnapshots] Staging {staging} from {seed_folder}")
+        return staging
+
+    def publish(self, staging) -> str:
+        """
+        Publish a staging directory as the current snapshot. The pointer file is
+        replaced atomically: readers see either the previous or the new snapshot.
+
+        :param staging: Staging directory created by create_staging
+        :return: The version of the published snapshot
+        """
+        version = os.path.basename(os.path.normpath(staging)).removesuffix(".staging")
+        os.replace(staging, os.path.join(self.root, version))
+
+        pointer_file = os.path.join(self.root, CURRENT_POINTER_FILE)
+        with open(f"{pointer_file}.tmp", "w") as file:
+            file.write(version)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{pointer_file}.tmp", pointer_file)
+
+        print(f"[DataSnapshots] Published snapshot {version}")
+        return version
+
+    def discard(self, staging):
+        """
+        Remove a staging directory (e.g. after a failed build).
+
+        :param staging: Staging directory created by create_staging
+        """
+        shutil.rmtree(staging, ignore_errors=True)
+        print(f"[DataSnapshots] Discarded {staging}")
+
+    def versions(self) -> list:
+        """
+        Get the published snapshots.
+
+        :return: Sorted list of versions, oldest first
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+            and name != "shared"
+            and not name.endswith(".staging")
+        )
+
+    def cleanup(self, keep=3, staging=None):
+        """
+        Remove the oldest snapshots and the staging directories left by failed
+        builds (e.g. a killed worker). The previous snapshots are kept for a while,
+        as dashboard sessions may still be reading them when the pointer switches.
+
+        :param keep: Number of snapshots to keep (the current one is always kept)
+        :param staging: Optional staging directory still being built, not removed
+        """
+        current = self.current()
+        for version in self.versions()[:-keep] if keep > 0 else self.versions():
+            if version != current:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+                print(f"[DataSnapshots] Removed snapshot {version}")
+
+        in_progress = os.path.basename(os.path.normpath(staging)) if staging else None
+        for name in self.stagings():
+            if name != in_progress:
+                self.discard(os.path.join(self.root, name))
+
+    def stagings(self) -> list:
+        """
+        Get the staging directories.
+
+        :return: Sorted list of staging directory names, oldest first
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+            and name.endswith(".staging")
+        )
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+# Files inside the cache folder of a model
+CACHE_VECTORS_FILE = "vectors.f32"
+CACHE_KEYS_FILE = "keys.txt"
+CACHE_META_FILE = "meta.json"
+
+
+class EmbeddingCache:
+    """
+    An on-disk embedding cache keyed by (model name, text hash), shared across
+    KDB rebuilds. Vectors are appended to a raw float32 file that is read through
+    a NumPy memory map, and the text hashes are appended to a keys file where
+    line N is the hash of vector N.
+    """
+
+    def __init__(self, folder, model_name):
+        """
+        Initializes the cache for an embedding model.
+
+        :param folder: Root folder of the cache
+        :param model_name: Name of the embedding model (each model has its own store)
+        """
+        self.model_name = model_name
+        self.folder = os.path.join(folder, re.sub(r"[^\w.-]", "_", model_name))
+        os.makedirs(self.folder, exist_ok=True)
+
+        self.vectors_file = os.path.join(self.folder, CACHE_VECTORS_FILE)
+        self.keys_file = os.path.join(self.folder, CACHE_KEYS_FILE)
+        self.meta_file = os.path.join(self.folder, CACHE_META_FILE)
+
+        self.dimension = None
+        self.rows = {}
+        self._vectors = None
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def get_many(self, texts: list) -> tuple:
+        """
+        Look up the embeddings of a list of texts.
+
+        :param texts: List of texts
+        :return: Tuple (embeddings, misses): array with the cached embeddings (rows of
+            the missing texts are left empty) and the list of positions not cached
+        """
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            rows = [self.rows.get(key) for key in keys]
+            misses = [i for i, row in enumerate(rows) if row is None]
+
+            if self.dimension is None:
+                return None, misses
+
+            embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+            hits = [i for i, row in enumerate(rows) if row is not None]
+            if hits:
+                embeddings[hits] = self._get_vectors()[[rows[i] for i in hits]]
+
+        return embeddings, misses
+
+    def put_many(self, texts: list, embeddings: np.ndarray):
+        """
+        Add the embeddings of a list of texts to the cache.
+
+        :param texts: List of texts
+        :param embeddings: Array of embeddings (one row per text)
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = embeddings.shape[1]
+                with open(self.meta_file, "w") as file:
+                    json.dump(
+                        {"model_name": self.model_name, "dimension": self.dimension},
+                        file,
+                    )
+
+            new_keys = {}
+            for i, text in enumerate(texts):
+                key = self._key(text)
+                if key not in self.rows and key not in new_keys:
+                    new_keys[key] = i
+
+            if not new_keys:
+                return
+
+            # Vectors are written before keys: a crash in between only leaves
+            # unused trailing vectors, never keys pointing to missing vectors
+            start = len(self.rows)
+            with open(self.vectors_file, "ab") as file:
+                file.truncate(start * self.dimension * 4)
+                file.write(embeddings[list(new_keys.values())].tobytes())
+            with open(self.keys_file, "a") as file:
+                file.write("".join(f"{key}\n" for key in new_keys))
+
+            for offset, key in enumerate(new_keys):
+                self.rows[key] = start + offset
+            self._vectors = None  # Reopen the memory map on the next read
+
+    def _load(self):
+        """Load the keys and the model dimension from disk."""
+        if not os.path.exists(self.meta_file):
+            return
+
+        with open(self.meta_file, "r") as file:
+            self.dimension = json.load(file)["dimension"]
+
+        if os.path.exists(self.keys_file):
+            with open(self.keys_file, "r") as file:
+                keys = file.read().split()
+
+            # Ignore keys without a complete vector (interrupted write)
+            size = 0
+            if os.path.exists(self.vectors_file):
+                size = os.path.getsize(self.vectors_file)
+            keys = keys[: size // (self.dimension * 4)]
+            self.rows = {key: row for row, key in enumerate(keys)}
+
+    def _get_vectors(self) -> np.ndarray:
+        """
+        Get the memory-mapped array of cached vectors.
+
+        :return: Array of shape (number of keys, dimension)
+        """
+        if self._vectors is None:
+            self._vectors = np.memmap(
+                self.vectors_file,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self.rows), self.dimension),
+            )
+        return self._vectors
+
+    @staticmethod
+    def _key(text: str) -> str:
+        """
+        Get the cache key of a text.
+
+        :param text: The text
+        :return: SHA-256 hex digest of the text
+        """
+        return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
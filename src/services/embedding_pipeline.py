@@ -0,0 +1,133 @@
+import time
+
+import faiss
+import numpy as np
+import pyarrow.parquet as pq
+
+
+class EmbeddingPipeline:
+    """
+    Encodes texts into L2-normalized float32 embeddings in batches, optionally
+    spreading the work over a pool of CPU processes, and reports the throughput.
+    """
+
+    def __init__(
+        self,
+        embedding_model,
+        batch_size=64,
+        num_workers=1,
+        show_progress_bar=False,
+        cache=None,
+    ):
+        """
+        Initializes the embedding pipeline.
+
+        :param embedding_model: A SentenceTransformer model
+        :param batch_size: Number of texts encoded per batch
+        :param num_workers: Number of CPU processes used for encoding (1 to encode in-process)
+        :param show_progress_bar: Show a progress bar while encoding
+        :param cache: Optional EmbeddingCache, only the texts missing from it are encoded
+        """
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+        self.show_progress_bar = show_progress_bar
+        self.cache = cache
+        self._pool = None
+
+    def encode(
+        self, texts: list, report: bool = True, use_cache: bool = True
+    ) -> np.ndarray:
+        """
+        Encodes texts into normalized embeddings.
+
+        :param texts: List of texts to encode
+        :param report: Print the throughput in texts/sec
+        :param use_cache: Look up and store the embeddings in the cache, if any
+        :return: Array of float32 embeddings (one row per text)
+        """
+        if self.cache is None or not use_cache:
+            return self._encode(texts, report)
+
+        embeddings, misses = self.cache.get_many(texts)
+        if report:
+            hits = len(texts) - len(misses)
+            print(f"[EmbeddingPipeline] Cache hits: {hits} of {len(texts)}")
+
+        if misses:
+            missing_texts = [texts[i] for i in misses]
+            missing_embeddings = self._encode(missing_texts, report)
+            self.cache.put_many(missing_texts, missing_embeddings)
+
+            if embeddings is None:
+                return missing_embeddings
+            embeddings[misses] = missing_embeddings
+
+        return embeddings
+
+    def _encode(self, texts: list, report: bool = True) -> np.ndarray:
+        """
+        Encodes texts into normalized embeddings with the embedding model.
+
+        :param texts: List of texts to encode
+        :param report: Print the throughput in texts/sec
+        :return: Array of float32 embeddings (one row per text)
+        """
+        start_time = time.time()
+
+        # The process pool only pays off when every worker gets a few batches
+        if self.num_workers > 1 and len(texts) >= self.batch_size * self.num_workers:
+            embeddings = self.embedding_model.encode_multi_process(
+                texts, self._get_pool(), batch_size=self.batch_size
+            )
+        else:
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=self.batch_size,
+                show_progress_bar=self.show_progress_bar,
+                convert_to_numpy=True,
+            )
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)  # Normalize embeddings to unit length
+
+        if report:
+            time_taken = max(time.time() - start_time, 1e-9)
+            print(
+                f"[EmbeddingPipeline] Encoded {len(texts)} texts in {time_taken:.2f} seconds"
+                f" ({len(texts) / time_taken:.1f} texts/sec)"
+            )
+
+        return embeddings
+
+    def close(self):
+        """Stop the encoding process pool, if started."""
+        if self._pool is not None:
+            self.embedding_model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def _get_pool(self):
+        """
+        Start the encoding process pool on first use and keep it for the next calls.
+
+        :return: The SentenceTransformer multi-process pool
+        """
+        if self._pool is None:
+            self._pool = self.embedding_model.start_multi_process_pool(
+                ["cpu"] * self.num_workers
+            )
+        return self._pool
+
+    @staticmethod
+    def iter_parquet(filepath, columns=None, batch_size=10000):
+        """
+        Lazily reads the rows of a parquet file, one batch at a time.
+
+        :param filepath: Path to the parquet file
+        :param columns: Optional list of columns to read
+        :param batch_size: Number of rows per batch
+        :return: Generator of lists of rows (dicts)
+        """
+        parquet_file = pq.ParquetFile(filepath)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pylist()
@@ -1,7 +1,47 @@
+import json
+import os
+import shutil
+import time
+
 import faiss
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import pandas as pd
 import joblib
 
+from services.bm25_index import BM25Index
+from services.embedding_cache import EmbeddingCache
+from services.embedding_pipeline import EmbeddingPipeline
+from services.lru_cache import LRUCache
+from services.tracing import span
+
+# Version of the on-disk KDB directory format
+KDB_FORMAT_VERSION = 3
+
+# Files inside a KDB directory
+KDB_INDEX_FILE = "index.faiss"
+KDB_TEXTS_FILE = "texts.parquet"
+KDB_METADATA_FILE = "metadata.parquet"
+KDB_BM25_FILE = "bm25.parquet"
+KDB_MANIFEST_FILE = "manifest.json"
+
+# Embedding backends: PyTorch SentenceTransformer or an exported ONNX model
+EMBEDDING_BACKENDS = ("torch", "onnx")
+
+# FAISS vector encodings for each embedding storage dtype
+EMBEDDING_DTYPE_ENCODINGS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+# Filtered searches over at most this many vectors are scored exactly
+EXACT_SEARCH_MAX_IDS = 2048
+
+# Search modes: dense vectors, sparse BM25 or both fused with Reciprocal Rank Fusion
+SEARCH_MODES = ("vector", "bm25", "hybrid")
+
+# RRF constant: a hit's fused score is the sum of 1 / (RRF_K + rank) over the rankings
+RRF_K = 60
+
+# Candidates taken from each ranking before fusing, per requested result
+HYBRID_CANDIDATES_FACTOR = 4
+
 
 class FaissKDB(object):
     def __init__(
@@ -9,118 +49,945 @@ class FaissKDB(object):
         model_name="all-MiniLM-L6-v2",
         cache_folder=None,
         device="cpu",
+        index_factory="Flat",
+        train_sample_size=50000,
+        nprobe=16,
+        ef_search=64,
+        batch_size=64,
+        num_workers=1,
+        embedding_dtype="float32",
+        embedding_cache_folder=None,
+        query_cache_size=1024,
+        embedding_model=None,
+        embedding_backend="torch",
+        onnx_model_folder=None,
+        onnx_quantized=True,
     ):
         """
         Initializes the Faiss Knowledge Database (KDB) with a SentenceTransformer model.
 
+        The embeddings are L2-normalized, so a single inner product index is used
+        (equivalent to cosine similarity). The index type is chosen by a FAISS
+        factory string, for example:
+         - "Flat": exact search (default, best for small KDBs)
+         - "IVF1024,Flat": inverted file, needs training
+         - "IVF1024,PQ16": inverted file with product quantization, needs training
+         - "HNSW32": graph-based approximate search, no training
+         - "SQ8" / "HNSW32,SQ8": 8-bit scalar quantized vectors
+
         :param model_name: Name of the SentenceTransformer model to use
         :param cache_folder: Folder to cache the model files
         :param device: Device to run the model on (CPU or GPU)
+        :param index_factory: FAISS index factory string
+        :param train_sample_size: Maximum number of vectors used to train the index
+        :param nprobe: Number of inverted lists visited on search (IVF indices)
+        :param ef_search: Size of the candidate list on search (HNSW indices)
+        :param batch_size: Number of texts encoded per batch
+        :param num_workers: Number of CPU processes used to encode texts
+        :param embedding_dtype: Storage type of the vectors in the index: "float32",
+            "float16" or "int8" (scalar quantization of the factory's Flat storage)
+        :param embedding_cache_folder: Optional folder of an embedding cache shared across
+            KDB rebuilds, so only new or changed texts are encoded
+        :param query_cache_size: Number of query embeddings kept in an LRU cache
+        :param embedding_model: Optional already loaded SentenceTransformer of model_name,
+            to share a single model instance between several KDBs
+        :param embedding_backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime,
+            PyTorch is not imported), see OnnxEmbeddingModel.export
+        :param onnx_model_folder: Folder of the exported ONNX model (onnx backend)
+        :param onnx_quantized: Use the int8 quantized ONNX model, if exported
         """
+        if embedding_dtype not in EMBEDDING_DTYPE_ENCODINGS:
+            raise ValueError(
+                f"embedding_dtype must be one of {list(EMBEDDING_DTYPE_ENCODINGS)}"
+            )
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(
+                f"embedding_backend must be one of {list(EMBEDDING_BACKENDS)}"
+            )
+        if embedding_backend == "onnx" and not onnx_model_folder:
+            raise ValueError("onnx_model_folder is required by the onnx backend")
 
         # Config
         self.model_name = model_name
         self.cache_folder = cache_folder
         self.device = device
-        self.texts = []
+        self.index_factory = index_factory
+        self.train_sample_size = train_sample_size
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.embedding_dtype = embedding_dtype
+        self.embedding_backend = embedding_backend
+        self.onnx_model_folder = onnx_model_folder
+        self.onnx_quantized = onnx_quantized
+
+        # Texts and metadata by their stable ID, and the next ID to assign
+        self.texts = {}
+        self.metadata = {}
+        self.next_id = 0
 
-        # Create the embedding model
-        self.embedding_model = SentenceTransformer(
-            model_name, cache_folder=cache_folder, device=device
+        # Metadata as a DataFrame indexed by ID, built lazily for filtered searches
+        self._metadata_df = None
+
+        # Sparse index of the same texts, for BM25 and hybrid searches
+        self.bm25_index = BM25Index()
+
+        # Recently used query embeddings
+        self.query_cache = LRUCache(maxsize=query_cache_size)
+
+        # Create the embedding model, unless a shared one is given
+        self.embedding_model = embedding_model or self._load_embedding_model()
+
+        # ONNX Runtime already uses every CPU core in a single process
+        if embedding_backend == "onnx":
+            num_workers = 1
+
+        # Quantized models get their own cache, their embeddings differ slightly
+        cache_model_name = getattr(self.embedding_model, "name", model_name)
+        self.embedding_pipeline = EmbeddingPipeline(
+            self.embedding_model,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            cache=(
+                EmbeddingCache(embedding_cache_folder, cache_model_name)
+                if embedding_cache_folder
+                else None
+            ),
         )
 
-        # Initialize FAISS indices
-        self.index_l2 = None
-        self.index_ip = None
+        # Initialize FAISS index
+        self.index = None
+        # The index is memory-mapped (see import_kdb): read-only for IVF indices
+        self.index_mmapped = False
 
-    def add_embeddings(self, embeddings):
+    def _load_embedding_model(self):
         """
-        Add embeddings to the FAISS indices.
+        Load the embedding model of the configured backend. The backends are
+        imported here, so serving with ONNX never imports PyTorch.
 
-        :param embeddings: List of embeddings to add to the indices
+        :return: A SentenceTransformer or an OnnxEmbeddingModel
         """
-        d = embeddings.shape[1]  # Dimension of the embeddings
-        if self.index_l2 is None:
-            self.index_l2 = faiss.IndexFlatL2(
-                d
-            )  # Using L2 (Euclidean distance) as the metric
+        if self.embedding_backend == "onnx":
+            from services.onnx_embedding_model import OnnxEmbeddingModel
 
-        if self.index_ip is None:
-            self.index_ip = faiss.IndexFlatIP(
-                d
-            )  # Using inner product (cosine similarity) as the metric
+            return OnnxEmbeddingModel(
+                self.onnx_model_folder, quantized=self.onnx_quantized
+            )
 
-        # Add the embeddings to both indices
-        self.index_l2.add(embeddings)
-        self.index_ip.add(embeddings)
+        from sentence_transformers import SentenceTransformer
 
-    def add_text(self, texts: list):
+        return SentenceTransformer(
+            self.model_name, cache_folder=self.cache_folder, device=self.device
+        )
+
+    def add_embeddings(self, embeddings, ids):
+        """
+        Add embeddings to the FAISS index, creating and training it if needed.
+
+        :param embeddings: List of embeddings to add to the index
+        :param ids: Stable IDs of the embeddings
         """
-        Add text to the FAISS indices.
+        if self.index is None:
+            self.index = self._create_index(embeddings.shape[1])
+        self._ensure_writable_index()
+
+        if not self.index.is_trained:
+            self.train(embeddings)
+
+        self.index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
 
-        :param texts: List of texts to add to the indices
+    def _create_index(self, d):
+        """
+        Create an empty FAISS index where vectors keep stable IDs. IVF indices
+        store the IDs natively, the other index types are wrapped in an ID map.
+
+        :param d: Dimension of the embeddings
+        :return: The FAISS index
+        """
+        index_factory = self._storage_index_factory()
+        index = faiss.index_factory(d, index_factory, faiss.METRIC_INNER_PRODUCT)
+        if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+            return index
+
+        return faiss.index_factory(
+            d, f"IDMap2,{index_factory}", faiss.METRIC_INNER_PRODUCT
+        )
+
+    def _storage_index_factory(self) -> str:
+        """
+        Get the index factory string with the vector storage matching embedding_dtype,
+        e.g. "HNSW32" with int8 becomes "HNSW32,SQ8" and "IVF1024,Flat" becomes "IVF1024,SQ8".
+
+        :return: The FAISS index factory string
+        """
+        if self.embedding_dtype == "float32":
+            return self.index_factory
+
+        encoding = EMBEDDING_DTYPE_ENCODINGS[self.embedding_dtype]
+        parts = self.index_factory.split(",")
+        if parts[-1] == "Flat":
+            parts[-1] = encoding
+        elif parts[-1].startswith("HNSW"):
+            parts.append(encoding)
+        else:
+            raise ValueError(
+                f"embedding_dtype can't be applied to the index '{self.index_factory}',"
+                " set the vector encoding in the index factory string instead."
+            )
+        return ",".join(parts)
+
+    def _needs_training(self) -> bool:
+        """
+        Check if the index must be trained before vectors can be added.
+
+        :return: True if the index is not trained yet
+        """
+        if self.index is None:
+            d = self.embedding_model.get_sentence_embedding_dimension()
+            self.index = self._create_index(d)
+        return not self.index.is_trained
+
+    def train(self, embeddings):
+        """
+        Train the FAISS index (IVF and PQ indices) on a random sample of embeddings.
+
+        :param embeddings: Embeddings to sample the training set from
+        """
+        sample = embeddings
+        if len(embeddings) > self.train_sample_size:
+            rng = np.random.default_rng(42)
+            rows = rng.choice(len(embeddings), self.train_sample_size, replace=False)
+            sample = embeddings[rows]
+
+        print(
+            f"[FaissKDB] Training {self.index_factory} index on {len(sample)} vectors"
+        )
+        self.index.train(sample)
+
+    def add_text(self, texts: list, ids: list = None, metadata: list = None) -> list:
+        """
+        Add text to the FAISS index, appending to the texts already indexed.
+
+        :param texts: List of texts to add to the index
+        :param ids: Optional list of stable IDs for the texts (auto-assigned if not given)
+        :param metadata: Optional list of metadata dicts for the texts
+        :return: List of IDs of the added texts
         """
         if isinstance(texts, str):
             texts = [texts]  # Ensure input is a list of texts
 
-        self.texts = texts
-        embeddings = self.embedding_model.encode(texts)  # Generate embeddings
-        faiss.normalize_L2(embeddings)  # Normalize embeddings to unit length
+        if ids is None:
+            ids = list(range(self.next_id, self.next_id + len(texts)))
+        else:
+            ids = [int(id) for id in ids]
+            if len(ids) != len(texts):
+                raise ValueError("The number of ids must match the number of texts.")
+            if len(set(ids)) != len(ids):
+                raise ValueError("The ids must be unique.")
+            existing = [id for id in ids if id in self.texts]
+            if existing:
+                raise ValueError(
+                    f"IDs already in the KDB (use upsert to replace them): {existing[:10]}"
+                )
+
+        if metadata is not None and len(metadata) != len(texts):
+            raise ValueError(
+                "The number of metadata items must match the number of texts."
+            )
+
+        if not texts:
+            return []
+
+        embeddings = self.embedding_pipeline.encode(texts)  # Generate embeddings
         self.add_embeddings(
-            embeddings
-        )  # Add the normalized embeddings to FAISS indices
+            embeddings, ids
+        )  # Add the normalized embeddings to FAISS index
+
+        self.texts.update(zip(ids, texts))
+        self.bm25_index.add(ids, texts)
+        if metadata is not None:
+            self.metadata.update(zip(ids, metadata))
+            self._metadata_df = None
+        self.next_id = max(self.next_id, max(ids) + 1)
+
+        return ids
+
+    def add_parquet(
+        self,
+        filepath,
+        formatter,
+        id_column=None,
+        metadata_columns=None,
+        columns=None,
+        read_batch_size=10000,
+    ) -> int:
+        """
+        Add the rows of a parquet file to the FAISS index, streaming the file in batches
+        so the whole dataset is never loaded in memory. Indices that need training are
+        trained on the first train_sample_size rows.
+
+        :param filepath: Path to the parquet file
+        :param formatter: Function that converts a row (dict) into the text to index
+        :param id_column: Optional column with the stable IDs of the rows
+        :param metadata_columns: Optional list of columns stored as metadata of the rows
+        :param columns: Optional list of columns to read
+        :param read_batch_size: Number of rows read and encoded per batch
+        :return: Number of rows added
+        """
+        start_time = time.time()
+        count = 0
+        texts = []
+        ids = []
+        metadata = []
+
+        for rows in EmbeddingPipeline.iter_parquet(filepath, columns, read_batch_size):
+            texts.extend(formatter(row) for row in rows)
+            if id_column:
+                ids.extend(row[id_column] for row in rows)
+            if metadata_columns:
+                metadata.extend(
+                    {column: row[column] for column in metadata_columns} for row in rows
+                )
+
+            # Buffer enough rows to train the index before adding anything
+            if self._needs_training() and len(texts) < self.train_sample_size:
+                continue
+
+            self.add_text(
+                texts,
+                ids=ids if id_column else None,
+                metadata=metadata if metadata_columns else None,
+            )
+            count += len(texts)
+            texts = []
+            ids = []
+            metadata = []
+
+        if texts:
+            self.add_text(
+                texts,
+                ids=ids if id_column else None,
+                metadata=metadata if metadata_columns else None,
+            )
+            count += len(texts)
+
+        time_taken = max(time.time() - start_time, 1e-9)
+        print(
+            f"[FaissKDB] Indexed {count} rows from {filepath} in {time_taken:.2f} seconds"
+            f" ({count / time_taken:.1f} rows/sec)"
+        )
+        return count
+
+    def upsert(self, ids: list, texts: list, metadata: list = None) -> list:
+        """
+        Add or replace texts by their stable IDs. Only the given texts are embedded.
+
+        :param ids: List of stable IDs
+        :param texts: List of texts for the IDs
+        :param metadata: Optional list of metadata dicts for the texts
+        :return: List of IDs of the upserted texts
+        """
+        ids = [int(id) for id in ids]
+        self.remove([id for id in ids if id in self.texts])
+        return self.add_text(texts, ids=ids, metadata=metadata)
+
+    def remove(self, ids: list) -> int:
+        """
+        Remove texts and their vectors by their stable IDs.
+
+        :param ids: List of IDs to remove
+        :return: Number of removed texts
+        """
+        ids = [int(id) for id in ids if int(id) in self.texts]
+        if not ids:
+            return 0
+
+        self._ensure_writable_index()
+        ids_array = np.asarray(ids, dtype=np.int64)
+        try:
+            self.index.remove_ids(ids_array)
+        except RuntimeError:
+            # Some index types (e.g. HNSW) don't support removal:
+            # rebuild the index from the stored vectors, without re-embedding
+            self._rebuild_index(exclude_ids=set(ids))
+
+        for id in ids:
+            del self.texts[id]
+            self.metadata.pop(id, None)
+        self.bm25_index.remove(ids)
+        self._metadata_df = None
+
+        return len(ids)
+
+    def _ensure_writable_index(self):
+        """
+        Load a memory-mapped index in memory before it's modified: the inverted
+        lists of a memory-mapped IVF index are read-only.
+        """
+        if not self.index_mmapped:
+            return
+
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            print("[FaissKDB] Loading the memory-mapped index in memory to modify it")
+            invlists = ivf.invlists
+            in_memory = faiss.ArrayInvertedLists(invlists.nlist, invlists.code_size)
+            for list_no in range(invlists.nlist):
+                list_size = invlists.list_size(list_no)
+                if list_size:
+                    in_memory.add_entries(
+                        list_no,
+                        list_size,
+                        invlists.get_ids(list_no),
+                        invlists.get_codes(list_no),
+                    )
+            ivf.replace_invlists(in_memory, True)
+            in_memory.this.disown()  # Owned by the index now
+
+        self.index_mmapped = False
+
+    def _rebuild_index(self, exclude_ids: set):
+        """
+        Rebuild the FAISS index from its own vectors, excluding some IDs.
+
+        :param exclude_ids: IDs of the vectors to leave out
+        """
+        keep_ids = np.asarray(
+            [id for id in self.texts if id not in exclude_ids], dtype=np.int64
+        )
+        embeddings = self.index.reconstruct_batch(keep_ids)
+
+        index = self._create_index(self.index.d)
+        if not index.is_trained:
+            index.train(embeddings)
+        index.add_with_ids(embeddings, keep_ids)
+        self.index = index
+
+    def export_kdb(self, folder):
+        """
+        Export the Knowledge Database (KDB) to a directory with:
+         - index.faiss: the FAISS index, in the native FAISS format
+         - texts.parquet: the texts of the vectors
+         - metadata.parquet: the metadata of the texts, if any
+         - bm25.parquet: the postings of the BM25 index
+         - manifest.json: the embedding model and index configuration
+
+        The embedding model is not saved, only its name. The directory is written
+        to a temporary location first and then moved, so it is never half-written.
+
+        :param folder: Directory to save the KDB to
+        """
+        folder = os.path.normpath(folder)
+        tmp_folder = f"{folder}.tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
 
-    def export_kdb(self, filename):
+        faiss.write_index(self.index, os.path.join(tmp_folder, KDB_INDEX_FILE))
+        pd.DataFrame(
+            {"id": list(self.texts.keys()), "text": list(self.texts.values())}
+        ).to_parquet(os.path.join(tmp_folder, KDB_TEXTS_FILE))
+        if self.metadata:
+            metadata_df = pd.DataFrame(list(self.metadata.values()))
+            metadata_df.insert(0, "id", list(self.metadata.keys()))
+            metadata_df.to_parquet(os.path.join(tmp_folder, KDB_METADATA_FILE))
+        self.bm25_index.save(os.path.join(tmp_folder, KDB_BM25_FILE))
+
+        manifest = {
+            "format_version": KDB_FORMAT_VERSION,
+            "model_name": self.model_name,
+            "index_factory": self.index_factory,
+            "dimension": self.index.d,
+            "count": self.index.ntotal,
+            "next_id": self.next_id,
+            "train_sample_size": self.train_sample_size,
+            "nprobe": self.nprobe,
+            "ef_search": self.ef_search,
+            "embedding_dtype": self.embedding_dtype,
+            "embedding_backend": self.embedding_backend,
+            # Relative to the KDB directory, so the directory can be moved along
+            # with the model (e.g. into a versioned data snapshot)
+            "onnx_model_folder": (
+                os.path.relpath(self.onnx_model_folder, folder)
+                if self.onnx_model_folder
+                else None
+            ),
+            "onnx_quantized": self.onnx_quantized,
+        }
+        with open(os.path.join(tmp_folder, KDB_MANIFEST_FILE), "w") as file:
+            json.dump(manifest, file, indent=4)
+
+        # Replace the previous version of the KDB: it's moved aside before the new
+        # one is moved in, so one complete version is always on disk (import_kdb
+        # falls back to the previous one if the process dies in between)
+        old_folder = f"{folder}.old"
+        shutil.rmtree(old_folder, ignore_errors=True)
+        if os.path.exists(folder):
+            os.replace(folder, old_folder)
+        os.replace(tmp_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+    @staticmethod
+    def import_kdb(
+        folder,
+        mmap=True,
+        cache_folder=None,
+        device="cpu",
+        embedding_model=None,
+        embedding_backend=None,
+        onnx_model_folder=None,
+    ):
         """
-        Export the Knowledge Database (KDB) to a file.
+        Import the Knowledge Database (KDB) from a directory created by export_kdb.
+        Legacy KDB files (joblib pickles) are converted to the current layout by
+        adding their texts again (export the result to keep the conversion).
 
-        :param filename: Name of the file to save the KDB to
+        :param folder: Directory to load the KDB from
+        :param mmap: Memory-map the FAISS index instead of reading it in memory
+            (an IVF index is then loaded in memory when it's first modified)
+        :param cache_folder: Folder to cache the embedding model files
+        :param device: Device to run the embedding model on (CPU or GPU)
+        :param embedding_model: Optional already loaded SentenceTransformer to share
+            instead of loading the model again
+        :param embedding_backend: Optional embedding backend overriding the one the KDB
+            was built with (e.g. serve with "onnx" a KDB built with "torch")
+        :param onnx_model_folder: Optional folder of the exported ONNX model overriding
+            the one the KDB was built with
+        :return: The loaded FaissKDB
         """
-        # Save the entire object, including texts and FAISS indices
-        joblib.dump(self, f"{filename}", compress=9)
+        # Legacy format: the whole object pickled in a single file
+        if os.path.isfile(folder):
+            return FaissKDB._convert_legacy_kdb(
+                joblib.load(folder), cache_folder, device, embedding_model
+            )
+
+        # An export interrupted between moving the previous version aside and
+        # moving the new one in: load the previous version
+        if not os.path.exists(folder) and os.path.isdir(
+            f"{os.path.normpath(folder)}.old"
+        ):
+            folder = f"{os.path.normpath(folder)}.old"
+
+        with open(os.path.join(folder, KDB_MANIFEST_FILE), "r") as file:
+            manifest = json.load(file)
+
+        # Since format 3 the ONNX model folder is relative to the KDB directory
+        manifest_onnx_model_folder = manifest.get("onnx_model_folder")
+        if manifest_onnx_model_folder and manifest.get("format_version", 1) >= 3:
+            manifest_onnx_model_folder = os.path.normpath(
+                os.path.join(folder, manifest_onnx_model_folder)
+            )
+
+        kdb = FaissKDB(
+            model_name=manifest["model_name"],
+            cache_folder=cache_folder,
+            device=device,
+            index_factory=manifest["index_factory"],
+            train_sample_size=manifest["train_sample_size"],
+            nprobe=manifest["nprobe"],
+            ef_search=manifest["ef_search"],
+            embedding_dtype=manifest.get("embedding_dtype", "float32"),
+            embedding_model=embedding_model,
+            embedding_backend=embedding_backend
+            or manifest.get("embedding_backend", "torch"),
+            onnx_model_folder=onnx_model_folder or manifest_onnx_model_folder,
+            onnx_quantized=manifest.get("onnx_quantized", True),
+        )
+
+        index_file = os.path.join(folder, KDB_INDEX_FILE)
+        try:
+            kdb.index = faiss.read_index(
+                index_file, faiss.IO_FLAG_MMAP if mmap else 0
+            )
+            kdb.index_mmapped = mmap
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            kdb.index = faiss.read_index(index_file)
+
+        texts_df = pd.read_parquet(os.path.join(folder, KDB_TEXTS_FILE))
+        kdb.texts = dict(zip(texts_df["id"].to_list(), texts_df["text"].to_list()))
+        bm25_file = os.path.join(folder, KDB_BM25_FILE)
+        if os.path.exists(bm25_file):
+            kdb.bm25_index = BM25Index.load(bm25_file, list(kdb.texts.keys()))
+        else:
+            # Exported before the BM25 postings were saved
+            kdb.bm25_index.add(list(kdb.texts.keys()), list(kdb.texts.values()))
+        kdb.next_id = manifest["next_id"]
+
+        metadata_file = os.path.join(folder, KDB_METADATA_FILE)
+        if os.path.exists(metadata_file):
+            for row in pd.read_parquet(metadata_file).to_dict(orient="records"):
+                id = row.pop("id")
+                # List fields (e.g. the temas of a proposition) are read as arrays
+                kdb.metadata[id] = {
+                    k: v.tolist() if isinstance(v, np.ndarray) else v
+                    for k, v in row.items()
+                    if isinstance(v, np.ndarray) or not pd.isna(v)
+                }
+
+        return kdb
 
     @staticmethod
-    def import_kdb(filename):
+    def _convert_legacy_kdb(
+        legacy, cache_folder=None, device="cpu", embedding_model=None
+    ):
         """
-        Import the Knowledge Database (KDB) from a file.
+        Convert a legacy KDB (a pickled object with index_l2/index_ip FAISS indices
+        and a list of texts) to the current layout, encoding its texts again.
+
+        :param legacy: The unpickled legacy KDB
+        :param cache_folder: Folder to cache the embedding model files
+        :param device: Device to run the embedding model on (CPU or GPU)
+        :param embedding_model: Optional already loaded embedding model to share
+            (the model pickled with the legacy KDB is used otherwise)
+        :return: The converted FaissKDB
         """
-        # Load the KDB from the given file
-        return joblib.load(filename)
+        state = vars(legacy)
+        kdb = FaissKDB(
+            model_name=state.get("model_name", "all-MiniLM-L6-v2"),
+            cache_folder=cache_folder or state.get("cache_folder"),
+            device=device,
+            embedding_model=embedding_model or state.get("embedding_model"),
+        )
+
+        texts = list(state.get("texts") or [])
+        if texts:
+            kdb.add_text(texts)
+
+        print(f"[FaissKDB] Converted a legacy KDB with {len(texts)} texts")
+        return kdb
 
-    def search(self, query, num_results=5, index_type="l2") -> list:
+    def search(
+        self, query, num_results=5, filters: dict = None, mode: str = "vector"
+    ) -> list:
         """
         Search for the most similar texts in the vector space.
 
         :param query: The query text to search for
         :param num_results: The number of results to return
-        :param index_type: The type of index to use for the search (L2, IP, or both)
+        :param filters: Optional metadata filters (see search_embeddings)
+        :param mode: Search mode (see search_many)
 
         :return: List of most similar texts based on the query
         """
-        query_embedding = self.embedding_model.encode(
-            [query]
-        )  # Generate embedding for the query
-        faiss.normalize_L2(
-            query_embedding
-        )  # Normalize the query embedding to unit length
+        return [
+            hit["text"]
+            for hit in self.search_many(
+                [query], num_results, filters=filters, mode=mode
+            )[0]
+        ]
+
+    def search_many(
+        self, queries: list, num_results=5, filters: dict = None, mode: str = "vector"
+    ) -> list:
+        """
+        Search for the most similar texts of several queries in a single call.
+
+        The search mode can be:
+         - "vector": dense search by cosine similarity of the embeddings
+         - "bm25": sparse keyword search, better for exact names, acronyms and IDs
+         - "hybrid": both rankings fused with Reciprocal Rank Fusion (RRF)
+
+        :param queries: List of query texts
+        :param num_results: The number of results to return per query
+        :param filters: Optional metadata filters (see search_embeddings)
+        :param mode: Search mode, one of SEARCH_MODES
+        :return: List (one per query) of lists of hits, each hit a dict with
+            the "id", "score" (cosine similarity, BM25 or RRF score depending
+            on the mode), "text" and "metadata"
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {list(SEARCH_MODES)}")
+
+        if mode == "vector":
+            query_embeddings = self.encode_queries(queries)
+            return self.search_embeddings(
+                query_embeddings, num_results, filters=filters
+            )
+
+        allowed_ids = set(self._filtered_ids(filters).tolist()) if filters else None
+        if mode == "bm25":
+            with span("bm25_search", queries=len(queries), k=num_results):
+                return [
+                    [
+                        self._hit(id, score)
+                        for id, score in self.bm25_index.search(
+                            query, num_results, ids=allowed_ids
+                        )
+                    ]
+                    for query in queries
+                ]
+
+        # Hybrid: fuse the ranks of a larger pool of candidates from each ranking
+        num_candidates = num_results * HYBRID_CANDIDATES_FACTOR
+        dense_results = self.search_embeddings(
+            self.encode_queries(queries), num_candidates, filters=filters
+        )
 
         results = []
+        with span("bm25_search_fusion", queries=len(queries), k=num_candidates):
+            for query, dense_hits in zip(queries, dense_results):
+                sparse_ids = [
+                    id
+                    for id, _ in self.bm25_index.search(
+                        query, num_candidates, ids=allowed_ids
+                    )
+                ]
+                dense_ids = [hit["id"] for hit in dense_hits]
+
+                scores = {}
+                for ranking in (dense_ids, sparse_ids):
+                    for rank, id in enumerate(ranking):
+                        scores[id] = scores.get(id, 0.0) + 1 / (RRF_K + rank + 1)
+
+                fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+                results.append(
+                    [self._hit(id, score) for id, score in fused[:num_results]]
+                )
+
+        return results
 
-        # Perform search based on selected index type (L2, IP, or both)
-        if index_type.lower() == "l2" or index_type.lower() == "both":
-            distances, indices = self.index_l2.search(query_embedding, num_results)
-            for i in range(num_results):
-                if indices[0][i] < len(self.texts):
-                    results.append(
-                        self.texts[indices[0][i]]
-                    )  # Add the most similar texts based on L2 distance
-
-        if index_type.lower() == "ip" or index_type.lower() == "both":
-            distances, indices = self.index_ip.search(query_embedding, num_results)
-            for i in range(num_results):
-                if indices[0][i] < len(self.texts):
-                    results.append(
-                        self.texts[indices[0][i]]
-                    )  # Add the most similar texts based on inner product
+    def search_embeddings(
+        self, query_embeddings: np.ndarray, num_results=5, filters: dict = None
+    ) -> list:
+        """
+        Search for the most similar texts of already encoded queries.
+
+        Filters restrict the search to the entries whose metadata match all of them
+        (the filter is applied inside the search, so num_results hits are returned
+        whenever enough entries match). Each filter value can be:
+         - a scalar: the field must be equal to it, e.g. {"siglaPartido": "PT"}
+         - a list or set: the field must be one of its values
+         - a tuple (min, max): the field must be in the inclusive range, either
+           bound can be None, e.g. {"dataDocumento": ("2024-01-01", None)}
+        A field holding a list (e.g. the temas of a proposition) matches when any of
+        its values does.
+
+        :param query_embeddings: Array of normalized query embeddings (one row per query)
+        :param num_results: The number of results to return per query
+        :param filters: Optional dict of metadata field -> filter value
+        :return: List (one per query) of lists of hits (see search_many)
+        """
+        if self.index is None or self.index.ntotal == 0:
+            return [[] for _ in range(len(query_embeddings))]
+
+        with span(
+            "faiss_search",
+            index=self.index_factory,
+            queries=len(query_embeddings),
+            k=num_results,
+            filtered=bool(filters),
+        ):
+            if filters:
+                scores, indices = self._search_filtered(
+                    query_embeddings, num_results, filters
+                )
+            else:
+                scores, indices = self.index.search(
+                    query_embeddings, num_results, params=self._search_parameters()
+                )
+
+        results = []
+        for query_scores, query_ids in zip(scores, indices):
+            hits = []
+            for score, id in zip(query_scores, query_ids):
+                # FAISS pads missing results with -1
+                if id < 0 or id not in self.texts:
+                    continue
+                hits.append(self._hit(id, score))
+            results.append(hits)
 
         return results
+
+    def _hit(self, id, score) -> dict:
+        """
+        Build a search hit.
+
+        :param id: ID of the entry
+        :param score: Score of the entry for the query
+        :return: Dict with the "id", "score", "text" and "metadata" of the entry
+        """
+        id = int(id)
+        return {
+            "id": id,
+            "score": float(score),
+            "text": self.texts[id],
+            "metadata": self.metadata.get(id, {}),
+        }
+
+    def _search_filtered(
+        self, query_embeddings: np.ndarray, num_results: int, filters: dict
+    ) -> tuple:
+        """
+        Search only the entries whose metadata match the filters.
+
+        Small subsets are scored exactly against their reconstructed vectors, since
+        approximate indices (e.g. HNSW) lose recall when most entries are excluded.
+        Larger subsets are searched in the index with a FAISS ID selector.
+
+        :param query_embeddings: Array of normalized query embeddings (one row per query)
+        :param num_results: The number of results to return per query
+        :param filters: Dict of metadata field -> filter value
+        :return: Tuple (scores, ids) of arrays shaped (queries, num_results)
+        """
+        ids = self._filtered_ids(filters)
+        empty = (
+            np.zeros((len(query_embeddings), 0), dtype=np.float32),
+            np.zeros((len(query_embeddings), 0), dtype=np.int64),
+        )
+        if len(ids) == 0:
+            return empty
+
+        if len(ids) <= EXACT_SEARCH_MAX_IDS:
+            try:
+                vectors = self.index.reconstruct_batch(ids)
+            except RuntimeError:
+                # Some index types can't reconstruct vectors (e.g. IVF without
+                # a direct map): use the ID selector instead
+                vectors = None
+
+            if vectors is not None:
+                scores = query_embeddings @ vectors.T
+                k = min(num_results, len(ids))
+                top = np.argsort(-scores, axis=1)[:, :k]
+                return np.take_along_axis(scores, top, axis=1), ids[top]
+
+        selector = faiss.IDSelectorBatch(ids)
+        # The selector must stay referenced until the search is done
+        return self.index.search(
+            query_embeddings,
+            num_results,
+            params=self._search_parameters(selector=selector),
+        )
+
+    def _filtered_ids(self, filters: dict) -> np.ndarray:
+        """
+        Get the IDs of the entries whose metadata match all the filters.
+
+        :param filters: Dict of metadata field -> filter value (see search_embeddings)
+        :return: Array of matching IDs
+        """
+        with span("filter_ids", filters=len(filters)):
+            metadata_df = self._get_metadata_df()
+            mask = pd.Series(True, index=metadata_df.index)
+
+            for field, value in filters.items():
+                if field not in metadata_df.columns:
+                    return np.zeros(0, dtype=np.int64)
+
+                # A list field (e.g. the temas of a proposition) matches when
+                # any of its values does
+                column = metadata_df[field].explode()
+                if isinstance(value, tuple):
+                    low, high = value
+                    matches = pd.Series(True, index=column.index)
+                    if low is not None:
+                        matches &= column >= low
+                    if high is not None:
+                        matches &= column <= high
+                elif isinstance(value, (list, set)):
+                    matches = column.isin(list(value))
+                else:
+                    matches = column == value
+
+                if len(column) != len(metadata_df):
+                    matches = matches.groupby(level=0).any()
+                mask &= matches
+
+            return metadata_df.index[mask].to_numpy(dtype=np.int64)
+
+    def _get_metadata_df(self) -> pd.DataFrame:
+        """
+        Get the metadata as a DataFrame indexed by ID (rebuilt after changes).
+
+        :return: DataFrame with one row per entry with metadata
+        """
+        if self._metadata_df is None:
+            self._metadata_df = pd.DataFrame.from_dict(self.metadata, orient="index")
+        return self._metadata_df
+
+    def metadata_values(self, field: str) -> list:
+        """
+        Get the distinct values of a metadata field, e.g. to build filter widgets.
+
+        :param field: The metadata field
+        :return: Sorted list of the distinct values
+        """
+        metadata_df = self._get_metadata_df()
+        if field not in metadata_df.columns:
+            return []
+        return sorted(metadata_df[field].explode().dropna().unique().tolist())
+
+    def encode_queries(self, queries: list) -> np.ndarray:
+        """
+        Encode queries into normalized embeddings, reusing recently encoded queries.
+
+        :param queries: List of query texts
+        :return: Array of query embeddings (one row per query)
+        """
+        with span("encode_queries", queries=len(queries)) as attributes:
+            if len(queries) == 0:
+                d = (
+                    self.index.d
+                    if self.index is not None
+                    else self.embedding_model.get_sentence_embedding_dimension()
+                )
+                return np.zeros((0, d), dtype=np.float32)
+
+            embeddings = [self.query_cache.get(query) for query in queries]
+            misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            attributes["cache_misses"] = len(misses)
+
+            if misses:
+                missing_embeddings = self.embedding_pipeline.encode(
+                    [queries[i] for i in misses], report=False, use_cache=False
+                )
+                for i, embedding in zip(misses, missing_embeddings):
+                    self.query_cache.put(queries[i], embedding)
+                    embeddings[i] = embedding
+
+            return np.vstack(embeddings).astype(np.float32)
+
+    def get_embeddings(self, ids: list) -> np.ndarray:
+        """
+        Get the stored embeddings of entries, e.g. to diversify search results.
+
+        :param ids: List of IDs
+        :return: Array of normalized embeddings (one row per ID)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return np.zeros((0, self.index.d), dtype=np.float32)
+
+        try:
+            with span("reconstruct_embeddings", ids=len(ids)):
+                embeddings = self.index.reconstruct_batch(ids)
+        except RuntimeError:
+            # Some index types can't reconstruct vectors (e.g. IVF without a
+            # direct map): encode the texts again (hits the embedding cache, if any)
+            with span("encode_embeddings", ids=len(ids)):
+                return self.embedding_pipeline.encode(
+                    [self.texts[id] for id in ids.tolist()], report=False
+                )
+
+        # Quantized vectors are only approximately normalized
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _search_parameters(self, selector=None) -> faiss.SearchParameters:
+        """
+        Build the search parameters for the index type (nprobe for IVF, efSearch for HNSW).
+
+        :param selector: Optional FAISS ID selector restricting the searched vectors
+        :return: FAISS search parameters
+        """
+        index = faiss.downcast_index(self.index)
+        if isinstance(index, faiss.IndexIDMap):
+            index = faiss.downcast_index(index.index)
+
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=self.nprobe, sel=selector)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=self.ef_search, sel=selector)
+        if selector is not None:
+            return faiss.SearchParameters(sel=selector)
+        return None
@@ -0,0 +1,231 @@
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from services.faiss_kdb import KDB_MANIFEST_FILE, RRF_K, FaissKDB
+from services.tracing import span
+
+# Maximum number of stored texts sampled per KDB as calibration queries
+CALIBRATION_SAMPLE_SIZE = 256
+
+# Number of hits per calibration query whose scores are measured
+CALIBRATION_TOP_K = 10
+
+
+class FederatedRetriever:
+    """
+    Searches several FaissKDBs (shards) built with the same embedding model as
+    if they were a single one: the query is encoded once, the shards are
+    searched in parallel and the hits are merged by calibrated score.
+
+    Raw cosine similarities are not comparable across corpora (templated texts,
+    such as the expenses, are all similar to each other), so each shard's scores
+    are standardized against the distribution of the scores of its top hits.
+    That distribution is measured with a sample of the shard's own texts used
+    as queries, an approximation of the real queries: a question is shorter and
+    less similar to its hits than a stored text. When a shard can't be
+    calibrated (too few texts), the shards are merged by rank with Reciprocal
+    Rank Fusion instead.
+    """
+
+    def __init__(self, kdbs: dict, max_workers=None):
+        """
+        Initializes the retriever.
+
+        :param kdbs: Dict of shard name -> FaissKDB, all with the same embedding model
+        :param max_workers: Number of threads searching the shards (one per shard by default)
+        """
+        if not kdbs:
+            raise ValueError("At least one KDB is required.")
+
+        # Embeddings of another backend or quantization drift from the shard's own
+        embedding_keys = {
+            FederatedRetriever._embedding_key(
+                kdb.model_name, kdb.embedding_backend, kdb.onnx_quantized
+            )
+            for kdb in kdbs.values()
+        }
+        if len(embedding_keys) > 1:
+            raise ValueError(
+                "All KDBs must use the same embedding model, backend and quantization,"
+                f" got: {sorted(embedding_keys)}"
+            )
+
+        self.kdbs = kdbs
+        self.max_workers = max_workers or len(kdbs)
+
+        # Mean and standard deviation of the top-k scores of each shard (None if
+        # it can't be calibrated)
+        self.calibration = {name: self._calibrate(kdb) for name, kdb in kdbs.items()}
+
+    @staticmethod
+    def load(folders: dict, mmap=True, cache_folder=None, device="cpu"):
+        """
+        Load several KDB directories sharing a single embedding model instance. The
+        model is only shared by KDBs built with the same model, backend and
+        quantization (the retriever then requires all of them to match).
+
+        :param folders: Dict of shard name -> KDB directory (see FaissKDB.export_kdb)
+        :param mmap: Memory-map the FAISS indices
+        :param cache_folder: Folder to cache the embedding model files
+        :param device: Device to run the embedding model on (CPU or GPU)
+        :return: The FederatedRetriever
+        """
+        kdbs = {}
+        embedding_models = {}
+        for name, folder in folders.items():
+            embedding_key = None
+            if os.path.isdir(folder):
+                with open(os.path.join(folder, KDB_MANIFEST_FILE), "r") as file:
+                    manifest = json.load(file)
+                embedding_key = FederatedRetriever._embedding_key(
+                    manifest["model_name"],
+                    manifest.get("embedding_backend", "torch"),
+                    manifest.get("onnx_quantized", True),
+                )
+
+            kdb = FaissKDB.import_kdb(
+                folder,
+                mmap=mmap,
+                cache_folder=cache_folder,
+                device=device,
+                embedding_model=embedding_models.get(embedding_key),
+            )
+            if embedding_key is not None:
+                embedding_models[embedding_key] = kdb.embedding_model
+            kdbs[name] = kdb
+
+        return FederatedRetriever(kdbs)
+
+    def search(self, query: str, num_results=5, filters: dict = None) -> list:
+        """
+        Search all the shards for the most similar texts.
+
+        :param query: The query text to search for
+        :param num_results: The total number of results to return
+        :param filters: Optional dict of shard name -> metadata filters of the shard
+            (see FaissKDB.search_embeddings), shards without filters are fully searched
+        :return: List of hits sorted by calibrated score, each hit a dict with the
+            "kdb" (shard name), "id", "score" (calibrated, or the RRF score if a
+            shard isn't calibrated), "similarity" (cosine), "text" and "metadata"
+        """
+        filters = filters or {}
+
+        # Encode the query once, with the model shared by every shard
+        query_embeddings = self.encode_queries([query])
+
+        def search_shard(name):
+            kdb = self.kdbs[name]
+            with span("shard_search", kdb=name):
+                return kdb.search_embeddings(
+                    query_embeddings, num_results, filters=filters.get(name)
+                )[0]
+
+        # FAISS releases the GIL while searching, so the shards run in parallel
+        # (each in a copy of the caller's context, to keep the tracing spans)
+        names = list(self.kdbs)
+        contexts = [contextvars.copy_context() for _ in names]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            shard_results = executor.map(
+                lambda context, name: context.run(search_shard, name), contexts, names
+            )
+
+        calibrated = all(
+            calibration is not None for calibration in self.calibration.values()
+        )
+        hits = []
+        for name, shard_hits in zip(names, shard_results):
+            for rank, hit in enumerate(shard_hits):
+                if calibrated:
+                    mean, std = self.calibration[name]
+                    score = (hit["score"] - mean) / std
+                else:
+                    score = 1 / (RRF_K + rank + 1)
+                hits.append(
+                    {"kdb": name, **hit, "score": score, "similarity": hit["score"]}
+                )
+
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits[:num_results]
+
+    def encode_queries(self, queries: list) -> np.ndarray:
+        """
+        Encode queries with the embedding model shared by the shards.
+
+        :param queries: List of query texts
+        :return: Array of query embeddings (one row per query)
+        """
+        return next(iter(self.kdbs.values())).encode_queries(queries)
+
+    def get_embeddings(self, hits: list) -> np.ndarray:
+        """
+        Get the stored embeddings of hits returned by search.
+
+        :param hits: List of hits (with the "kdb" and "id" of each entry)
+        :return: Array of normalized embeddings (one row per hit)
+        """
+        embeddings = None
+        for name, kdb in self.kdbs.items():
+            positions = [i for i, hit in enumerate(hits) if hit["kdb"] == name]
+            if not positions:
+                continue
+
+            shard_embeddings = kdb.get_embeddings([hits[i]["id"] for i in positions])
+            if embeddings is None:
+                embeddings = np.zeros(
+                    (len(hits), shard_embeddings.shape[1]), dtype=np.float32
+                )
+            embeddings[positions] = shard_embeddings
+
+        return embeddings
+
+    @staticmethod
+    def _embedding_key(model_name, embedding_backend, onnx_quantized) -> tuple:
+        """
+        Get the key of the embedding model a KDB is searched with.
+
+        :param model_name: Name of the embedding model
+        :param embedding_backend: Embedding backend ("torch" or "onnx")
+        :param onnx_quantized: Whether the ONNX model is the int8 quantized one
+        :return: Tuple (model name, backend, "int8", "fp32" or "" for torch)
+        """
+        if embedding_backend != "onnx":
+            return model_name, embedding_backend, ""
+        return model_name, embedding_backend, "int8" if onnx_quantized else "fp32"
+
+    @staticmethod
+    def _calibrate(kdb: FaissKDB) -> tuple:
+        """
+        Estimate the distribution of the scores of the top hits of a KDB, searching
+        it with a random sample of its texts as queries (the embeddings are the
+        stored ones, so the texts are not encoded again).
+
+        :param kdb: The KDB
+        :return: Tuple (mean, standard deviation) of the scores, or None if the KDB
+            has too few texts to be calibrated
+        """
+        ids = np.fromiter(kdb.texts.keys(), dtype=np.int64)
+        if kdb.index is None or len(ids) < 2:
+            return None
+
+        rng = np.random.default_rng(42)
+        sample = rng.choice(
+            ids, size=min(len(ids), CALIBRATION_SAMPLE_SIZE), replace=False
+        )
+        results = kdb.search_embeddings(
+            kdb.get_embeddings(sample), CALIBRATION_TOP_K + 1
+        )
+
+        # A text is its own best match: its hit is left out
+        scores = [
+            hit["score"]
+            for id, hits in zip(sample.tolist(), results)
+            for hit in hits
+            if hit["id"] != id
+        ]
+        if len(scores) < 2:
+            return None
+        return float(np.mean(scores)), max(float(np.std(scores)), 1e-6)
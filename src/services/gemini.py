@@ -3,7 +3,9 @@ import google.generativeai as genai
 import os
 import json
 
+from pydantic import BaseModel, ValidationError
 from models.ai_response import AIResponse
+from services.tracing import span
 from load_dotenv import load_dotenv
 
 # Load the environment variables
@@ -42,24 +44,30 @@ class Gemini:
     # Main Methods
     # ----------------------------
 
-    def ask(self, prompt: str) -> AIResponse:
+    def ask(self, prompt: str, generation_config: dict = None) -> AIResponse:
         """
         Ask the Gemini API a question based on a prompt.
 
         :param prompt: The prompt to ask the Gemini API
+        :param generation_config: Optional generation config (e.g. JSON response MIME type/schema)
         :return: The response from the Gemini API
         """
+        # The response is kept local, as the dashboard shares one instance between
+        # sessions: the ask_and_* methods store it in self.response themselves
         try:
-            # Clean previous response
-            self.response = None
-
             # Count the time taken to generate the content
             start_time = time.time()
 
-            model = genai.GenerativeModel(
-                model_name=self.model_name, system_instruction=self.system_prompt
-            )
-            response = model.generate_content(prompt)
+            with span(
+                "gemini", model=self.model_name, prompt_chars=len(prompt)
+            ) as attributes:
+                model = genai.GenerativeModel(
+                    model_name=self.model_name, system_instruction=self.system_prompt
+                )
+                response = model.generate_content(
+                    prompt, generation_config=generation_config
+                )
+                attributes["response_chars"] = len(response.text)
 
             # Calculate the time taken to generate the content
             end_time = time.time()
@@ -69,7 +77,6 @@ class Gemini:
                 "[Gemini] Content ready! Time taken: {:.2f} seconds".format(time_taken)
             )
             response = {"response": response.text, "provider": "Google Gemini"}
-            self.response = response
 
             # Print the response
             print(response)
@@ -87,7 +94,7 @@ class Gemini:
         :param prompt: The prompt to ask the Gemini API
         :return: The response from the Gemini API
         """
-        self.ask(prompt)
+        self.response = self.ask(prompt)
         self._execute()
         return self.response
 
@@ -98,7 +105,7 @@ class Gemini:
         :param prompt: The prompt to ask the Gemini API
         :return: The generated Python code
         """
-        self.ask(prompt)
+        self.response = self.ask(prompt)
         return self._to_python_code()
 
     def ask_and_generate_json_str(self, prompt: str) -> str:
@@ -108,9 +115,56 @@ class Gemini:
         :param prompt: The prompt to ask the Gemini API
         :return: The generated JSON string
         """
-        self.ask(prompt)
+        self.response = self.ask(prompt)
         return self._to_json_str()
 
+    def ask_and_generate_json(self, prompt: str, schema: type[BaseModel]) -> BaseModel:
+        """
+        Ask the Gemini API a question using the native JSON output mode and
+        validate the response against a pydantic model.
+
+        If the response does not match the schema, a single repair request is
+        sent with the validation errors instead of re-generating from scratch.
+
+        :param prompt: The prompt to ask the Gemini API
+        :param schema: The pydantic model the response must conform to
+        :return: The parsed model instance, or None if the response is still invalid
+        """
+        generation_config = genai.GenerationConfig(
+            response_mime_type="application/json", response_schema=schema
+        )
+
+        self.response = self.ask(prompt, generation_config=generation_config)
+        if not self.response:
+            return None
+
+        try:
+            return self._to_model(schema)
+        except ValidationError as e:
+            print(f"[Gemini] Response does not match the schema: {str(e)}")
+            errors = str(e)
+
+        # Targeted repair: only fix the invalid JSON, don't redo the whole task
+        repair_prompt = f"""
+        The JSON object below does not conform to the expected schema.
+        Fix it so it conforms, keeping the original content whenever possible.
+
+        Validation errors:
+        {errors}
+
+        <|JSON|>
+        {self.response["response"]}
+        """
+        self.response = self.ask(repair_prompt, generation_config=generation_config)
+        if not self.response:
+            return None
+
+        try:
+            return self._to_model(schema)
+        except ValidationError as e:
+            print(f"[Gemini] Repaired response is still invalid: {str(e)}")
+            return None
+
     # ----------------------------
     # Utils
     # ----------------------------
@@ -148,6 +202,15 @@ class Gemini:
         self.response["response"] = json_str
         return json_str
 
+    def _to_model(self, schema: type[BaseModel]) -> BaseModel:
+        """
+        Parse and validate the response against a pydantic model.
+
+        :param schema: The pydantic model to validate against
+        :return: The parsed model instance
+        """
+        return schema.model_validate_json(self.response["response"])
+
     def _execute(self) -> None:
         """Execute the generated code."""
         code = self._to_python_code()
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe Least Recently Used (LRU) cache with a maximum number of items.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Initializes the cache.
+
+        :param maxsize: Maximum number of items kept in the cache
+        """
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get an item from the cache, marking it as recently used.
+
+        :param key: The key of the item
+        :param default: Value returned when the key is not cached
+        :return: The cached item or the default value
+        """
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        """
+        Add an item to the cache, evicting the least recently used item if full.
+
+        :param key: The key of the item
+        :param value: The item to cache
+        """
+        if not self.maxsize:
+            return
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
@@ -0,0 +1,121 @@
+import hashlib
+import re
+
+import numpy as np
+
+# Mersenne prime used by the MinHash permutations (fits in 32 bits)
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+class MinHashDeduplicator:
+    """
+    Detects near-duplicate texts in a stream with MinHash signatures and
+    Locality-Sensitive Hashing (LSH), without comparing every pair of texts.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=64, shingle_size=3, seed=42):
+        """
+        Initializes the deduplicator.
+
+        :param threshold: Minimum estimated Jaccard similarity to consider two texts duplicates
+        :param num_perm: Number of MinHash permutations (signature size)
+        :param shingle_size: Number of words per shingle
+        :param seed: Seed for the MinHash permutations
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        # Random permutations h(x) = (a * x + b) mod p
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        # LSH bands, tuned so the detection threshold is close to the requested one
+        self.bands, self.rows = self._optimal_bands()
+        self._buckets = [{} for _ in range(self.bands)]
+
+        # Stats
+        self.seen_count = 0
+        self.merged_count = 0
+
+    def is_duplicate(self, text: str) -> bool:
+        """
+        Checks if a text is a near-duplicate of a previously seen text.
+        Texts that are not duplicates are remembered for the next checks.
+
+        :param text: The text to check
+        :return: True if the text is a near-duplicate
+        """
+        self.seen_count += 1
+        signature = self._signature(text)
+
+        # Compare only with the candidates that share at least one band
+        keys = [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+        for band, key in enumerate(keys):
+            candidate = self._buckets[band].get(key)
+            if candidate is not None:
+                similarity = np.mean(candidate == signature)
+                if similarity >= self.threshold:
+                    self.merged_count += 1
+                    return True
+
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, signature)
+
+        return False
+
+    def _shingles(self, text: str) -> set:
+        """
+        Splits a normalized text into word shingles.
+
+        :param text: The text to split
+        :return: Set of shingles
+        """
+        words = re.findall(r"\w+", text.lower())
+        if len(words) <= self.shingle_size:
+            return {" ".join(words)}
+        return {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def _signature(self, text: str) -> np.ndarray:
+        """
+        Computes the MinHash signature of a text.
+
+        :param text: The text to hash
+        :return: Array with num_perm minimum hashes
+        """
+        hashes = np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(),
+                    "little",
+                )
+                for shingle in self._shingles(text)
+            ],
+            dtype=np.uint64,
+        )
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+        return permuted.min(axis=0)
+
+    def _optimal_bands(self) -> tuple:
+        """
+        Chooses the number of bands and rows per band whose LSH threshold
+        (1 / bands) ^ (1 / rows) is closest to the requested threshold.
+
+        :return: Tuple (bands, rows)
+        """
+        options = [
+            (bands, self.num_perm // bands)
+            for bands in range(1, self.num_perm + 1)
+            if self.num_perm % bands == 0
+        ]
+        return min(
+            options,
+            key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - self.threshold),
+        )
@@ -0,0 +1,249 @@
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+
+# Files inside an exported ONNX model folder
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_int8.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+ONNX_CONFIG_FILE = "embedding_config.json"
+
+# Minimum cosine similarity between the ONNX and PyTorch embeddings to accept an export
+MIN_COSINE_AGREEMENT = 0.98
+
+# Texts used to verify an export when none are given
+VERIFICATION_TEXTS = [
+    "Quais deputados do PT são de São Paulo?",
+    "Despesas com combustíveis e lubrificantes em 2024",
+    "PL 1234/2024 - Dispõe sobre a reforma tributária",
+    "Arthur Lira || PP || AL",
+    "Qual partido tem mais deputados na Câmara?",
+]
+
+
+class OnnxEmbeddingModel:
+    """
+    A SentenceTransformer-compatible embedding model (encode and
+    get_sentence_embedding_dimension) that runs a mean-pooling transformer
+    exported to ONNX with ONNX Runtime, without importing PyTorch.
+    """
+
+    def __init__(self, folder, quantized=True, num_threads=None):
+        """
+        Loads an ONNX model exported with OnnxEmbeddingModel.export.
+
+        :param folder: Folder of the exported model
+        :param quantized: Use the int8 dynamically quantized model, if exported
+        :param num_threads: Number of CPU threads used by ONNX Runtime (all by default)
+        """
+        with open(os.path.join(folder, ONNX_CONFIG_FILE), "r") as file:
+            self.config = json.load(file)
+
+        model_file = os.path.join(folder, ONNX_MODEL_FILE)
+        quantized_model_file = os.path.join(folder, ONNX_QUANTIZED_MODEL_FILE)
+        self.quantized = quantized and os.path.exists(quantized_model_file)
+        if self.quantized:
+            model_file = quantized_model_file
+
+        # Embeddings of the quantized model differ slightly from the original ones
+        self.name = self.config["model_name"] + ("-onnx-int8" if self.quantized else "")
+
+        session_options = ort.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            model_file, session_options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {input.name for input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(folder, ONNX_TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(
+            pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"]
+        )
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """
+        Get the dimension of the embeddings.
+
+        :return: The embedding dimension
+        """
+        return self.config["dimension"]
+
+    def encode(
+        self, texts, batch_size=32, show_progress_bar=False, convert_to_numpy=True
+    ) -> np.ndarray:
+        """
+        Encodes texts into embeddings (same signature as SentenceTransformer.encode).
+
+        :param texts: A text or a list of texts
+        :param batch_size: Number of texts encoded per batch
+        :param show_progress_bar: Ignored, kept for compatibility
+        :param convert_to_numpy: Ignored, embeddings are always NumPy arrays
+        :return: Array of float32 embeddings (one row per text)
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+
+        # Sort by length so each batch is padded to similar lengths
+        order = np.argsort([len(text) for text in texts])
+        embeddings = np.zeros((len(texts), self.config["dimension"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start : start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+
+        return embeddings
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        """
+        Encodes a batch of texts with mean pooling over the token embeddings.
+
+        :param texts: List of texts
+        :return: Array of embeddings (one row per text)
+        """
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        inputs = {
+            name: value for name, value in inputs.items() if name in self.input_names
+        }
+
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(
+            mask.sum(axis=1), 1e-9, None
+        )
+
+        if self.config.get("normalize", False):
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    @staticmethod
+    def export(
+        model_name,
+        folder,
+        quantize=True,
+        cache_folder=None,
+        verification_texts=None,
+    ) -> dict:
+        """
+        Export a SentenceTransformer model to ONNX (optionally with an int8 dynamically
+        quantized copy) and verify it against the PyTorch embeddings by cosine agreement.
+        PyTorch is only needed here, not to load the exported model.
+
+        :param model_name: Name of the SentenceTransformer model (mean pooling)
+        :param folder: Folder to export the model to
+        :param quantize: Also export an int8 dynamically quantized model
+        :param cache_folder: Folder to cache the PyTorch model files
+        :param verification_texts: Texts to compare the embeddings on
+        :return: The export config, with the cosine agreement of each exported model
+        """
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, cache_folder=cache_folder, device="cpu")
+        transformer = model[0]
+        tokenizer = transformer.tokenizer
+        modules = [type(module).__name__ for module in model]
+
+        os.makedirs(folder, exist_ok=True)
+        model_file = os.path.join(folder, ONNX_MODEL_FILE)
+
+        # Export the transformer; pooling and normalization run in NumPy
+        dummy = tokenizer(["ONNX export"], return_tensors="pt")
+        input_names = [
+            name
+            for name in ["input_ids", "attention_mask", "token_type_ids"]
+            if name in dummy
+        ]
+
+        class TokenEmbeddings(torch.nn.Module):
+            """Transformer forward by keyword, returning only the token embeddings."""
+
+            def __init__(self, auto_model):
+                super().__init__()
+                self.auto_model = auto_model
+
+            def forward(self, *inputs):
+                features = dict(zip(input_names, inputs))
+                return self.auto_model(**features, return_dict=True).last_hidden_state
+
+        with torch.no_grad():
+            torch.onnx.export(
+                TokenEmbeddings(transformer.auto_model).eval(),
+                tuple(dummy[name] for name in input_names),
+                model_file,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    name: {0: "batch", 1: "sequence"}
+                    for name in input_names + ["last_hidden_state"]
+                },
+                opset_version=17,
+                dynamo=False,
+            )
+
+        tokenizer.backend_tokenizer.save(os.path.join(folder, ONNX_TOKENIZER_FILE))
+
+        config = {
+            "model_name": model_name,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length,
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id,
+            "normalize": "Normalize" in modules,
+        }
+        with open(os.path.join(folder, ONNX_CONFIG_FILE), "w") as file:
+            json.dump(config, file, indent=4)
+
+        if quantize:
+            quantize_dynamic(
+                model_file,
+                os.path.join(folder, ONNX_QUANTIZED_MODEL_FILE),
+                weight_type=QuantType.QInt8,
+            )
+
+        # Verify every exported model against the PyTorch embeddings
+        # The config file marks a usable export (dataprep.py only exports again when
+        # it's missing), so it's removed when the verification fails
+        try:
+            texts = verification_texts or VERIFICATION_TEXTS
+            expected = model.encode(
+                texts, convert_to_numpy=True, normalize_embeddings=True
+            )
+            for quantized in [False, True] if quantize else [False]:
+                onnx_model = OnnxEmbeddingModel(folder, quantized=quantized)
+                embeddings = onnx_model.encode(texts)
+                embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+                agreement = np.sum(embeddings * expected, axis=1)
+
+                key = "int8_cosine_agreement" if quantized else "cosine_agreement"
+                config[key] = {
+                    "min": float(agreement.min()),
+                    "mean": float(agreement.mean()),
+                }
+                print(
+                    f"[OnnxEmbeddingModel] {onnx_model.name}: cosine agreement with PyTorch"
+                    f" min {agreement.min():.4f}, mean {agreement.mean():.4f}"
+                )
+                if agreement.min() < MIN_COSINE_AGREEMENT:
+                    raise ValueError(
+                        f"The ONNX model {onnx_model.name} disagrees with PyTorch"
+                        f" (min cosine {agreement.min():.4f} < {MIN_COSINE_AGREEMENT})"
+                    )
+        except Exception:
+            os.remove(os.path.join(folder, ONNX_CONFIG_FILE))
+            raise
+
+        with open(os.path.join(folder, ONNX_CONFIG_FILE), "w") as file:
+            json.dump(config, file, indent=4)
+
+        return config
@@ -0,0 +1,248 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+# Columns of the propositions table (besides the temas, stored apart)
+PROPOSITION_COLUMNS = ["id", "uri", "siglaTipo", "numero", "ano", "ementa"]
+
+# Optional presentation date column, filtered by date range when available
+PROPOSITION_DATE_COLUMN = "dataApresentacao"
+
+
+class PropositionsStore:
+    """
+    A SQLite copy of the propositions for server-side queries: filters by tema,
+    siglaTipo, year and presentation date, full-text search over the ementa
+    with an FTS5 index, and pagination, so only one page is ever loaded.
+    """
+
+    def __init__(self, db_file):
+        """
+        Initializes the store.
+
+        :param db_file: Path of the SQLite database file
+        """
+        self.db_file = db_file
+
+    def build(self, propositions_df: pd.DataFrame, source_version: str = None):
+        """
+        (Re)build the database from the propositions DataFrame. A proposition
+        listed under several temas is stored once, with all its temas.
+
+        :param propositions_df: DataFrame with the propositions (one row per tema)
+        :param source_version: Optional version of the source data, see is_current
+        """
+        columns = PROPOSITION_COLUMNS + (
+            [PROPOSITION_DATE_COLUMN]
+            if PROPOSITION_DATE_COLUMN in propositions_df.columns
+            else []
+        )
+        propositions = propositions_df.drop_duplicates(subset="id")[columns].copy()
+        if PROPOSITION_DATE_COLUMN in propositions:
+            propositions[PROPOSITION_DATE_COLUMN] = pd.to_datetime(
+                propositions[PROPOSITION_DATE_COLUMN]
+            ).dt.strftime("%Y-%m-%d")
+        else:
+            propositions[PROPOSITION_DATE_COLUMN] = None
+
+        temas = propositions_df[["id", "tema"]].drop_duplicates()
+        propositions["temas"] = propositions["id"].map(
+            temas.groupby("id")["tema"].agg(", ".join)
+        )
+
+        # Build in a temporary file and replace the database atomically
+        os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+        tmp_file = self.db_file + ".tmp"
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+        # closing() closes the connection, the inner with commits the transaction
+        with closing(sqlite3.connect(tmp_file)) as connection, connection:
+            connection.executescript("""
+                CREATE TABLE proposicoes (
+                    id INTEGER PRIMARY KEY,
+                    uri TEXT,
+                    siglaTipo TEXT,
+                    numero INTEGER,
+                    ano INTEGER,
+                    ementa TEXT,
+                    dataApresentacao TEXT,
+                    temas TEXT
+                );
+                CREATE TABLE proposicoes_temas (id INTEGER, tema TEXT);
+                CREATE INDEX idx_temas ON proposicoes_temas (tema, id);
+                CREATE INDEX idx_tipo_ano ON proposicoes (siglaTipo, ano);
+                CREATE INDEX idx_ano ON proposicoes (ano);
+                CREATE VIRTUAL TABLE proposicoes_fts USING fts5(
+                    ementa,
+                    content='proposicoes',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                """)
+            propositions[
+                PROPOSITION_COLUMNS + [PROPOSITION_DATE_COLUMN, "temas"]
+            ].to_sql("proposicoes", connection, if_exists="append", index=False)
+            temas.to_sql(
+                "proposicoes_temas", connection, if_exists="append", index=False
+            )
+            connection.execute(
+                "INSERT INTO proposicoes_fts (rowid, ementa) SELECT id, ementa FROM proposicoes"
+            )
+            connection.execute(
+                "INSERT INTO meta VALUES ('source_version', ?)", (source_version,)
+            )
+
+        os.replace(tmp_file, self.db_file)
+        print(f"[PropositionsStore] Indexed {len(propositions)} propositions")
+
+    def is_current(self, source_version: str) -> bool:
+        """
+        Check if the database was built from a given version of the source data.
+
+        :param source_version: Version of the source data
+        :return: True if the database exists and matches the version
+        """
+        if not os.path.exists(self.db_file):
+            return False
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM meta WHERE key = 'source_version'"
+            ).fetchone()
+        return row is not None and row[0] == source_version
+
+    def query(
+        self,
+        temas: list = None,
+        siglas_tipo: list = None,
+        year_range: tuple = None,
+        date_range: tuple = None,
+        text: str = None,
+        page: int = 1,
+        page_size: int = 20,
+    ) -> tuple:
+        """
+        Query one page of propositions.
+
+        :param temas: Optional list of temas (any of them)
+        :param siglas_tipo: Optional list of siglaTipo values (any of them)
+        :param year_range: Optional (min, max) inclusive range of the year
+        :param date_range: Optional (start, end) inclusive range of the presentation date
+        :param text: Optional full-text search over the ementa (all words, by prefix,
+            accents ignored), results are then ranked by relevance
+        :param page: Page number, starting at 1
+        :param page_size: Number of propositions per page
+        :return: Tuple (DataFrame with the page, total number of matching propositions)
+        """
+        conditions = []
+        params = []
+
+        if temas:
+            conditions.append(
+                f"p.id IN (SELECT id FROM proposicoes_temas WHERE tema IN ({self._placeholders(temas)}))"
+            )
+            params += list(temas)
+        if siglas_tipo:
+            conditions.append(f"p.siglaTipo IN ({self._placeholders(siglas_tipo)})")
+            params += list(siglas_tipo)
+        if year_range:
+            conditions.append("p.ano BETWEEN ? AND ?")
+            params += [int(year_range[0]), int(year_range[1])]
+        if date_range:
+            conditions.append("p.dataApresentacao BETWEEN ? AND ?")
+            params += [str(date_range[0]), str(date_range[1])]
+
+        source = "proposicoes p"
+        order = "p.ano DESC, p.id DESC"
+        match = self._match_expression(text)
+        if match:
+            source += " JOIN proposicoes_fts f ON f.rowid = p.id"
+            conditions.append("proposicoes_fts MATCH ?")
+            params.append(match)
+            order = "f.rank"
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as connection:
+            total = connection.execute(
+                f"SELECT COUNT(*) FROM {source} {where}", params
+            ).fetchone()[0]
+            page_df = pd.read_sql_query(
+                f"""
+                SELECT p.id, p.siglaTipo, p.numero, p.ano, p.temas, p.ementa,
+                       p.dataApresentacao, p.uri
+                FROM {source} {where}
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+                """,
+                connection,
+                params=params + [page_size, (max(page, 1) - 1) * page_size],
+            )
+
+        return page_df.dropna(axis=1, how="all"), total
+
+    def distinct(self, column: str) -> list:
+        """
+        Get the distinct values of a filter column, e.g. to build filter widgets.
+
+        :param column: "tema", "siglaTipo" or "ano"
+        :return: Sorted list of values
+        """
+        table = {
+            "tema": "proposicoes_temas",
+            "siglaTipo": "proposicoes",
+            "ano": "proposicoes",
+        }[column]
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY {column}"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def date_bounds(self) -> tuple:
+        """
+        Get the range of the presentation dates, e.g. to build a date filter.
+
+        :return: Tuple (first, last) of "YYYY-MM-DD" dates, or None if the
+            propositions have no presentation date
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT MIN({PROPOSITION_DATE_COLUMN}), MAX({PROPOSITION_DATE_COLUMN}) FROM proposicoes"
+            ).fetchone()
+        return None if row[0] is None else (row[0], row[1])
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a read connection (one per call, so the store can be shared by threads).
+
+        :return: SQLite connection
+        """
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+
+    @staticmethod
+    def _match_expression(text: str) -> str:
+        """
+        Turn free text into an FTS5 query: every word must match, by prefix.
+        Words are quoted, so FTS5 operators typed by the user are not interpreted.
+
+        :param text: The text typed by the user
+        :return: The FTS5 MATCH expression, or None for an empty text
+        """
+        words = re.findall(r"\w+", text or "")
+        if not words:
+            return None
+        return " ".join(f'"{word}"*' for word in words)
+
+    @staticmethod
+    def _placeholders(values: list) -> str:
+        """
+        Build the SQL placeholders of a list of values.
+
+        :param values: List of values
+        :return: String with one "?" per value
+        """
+        return ", ".join("?" * len(values))
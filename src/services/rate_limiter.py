@@ -0,0 +1,36 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A thread-safe rate limiter that spaces calls evenly so that a maximum
+    number of requests per minute is never exceeded, even across threads.
+    """
+
+    def __init__(self, requests_per_minute: int = 60):
+        """
+        Initialize the rate limiter.
+
+        :param requests_per_minute: Maximum number of requests per minute (None or 0 to disable)
+        """
+        self.requests_per_minute = requests_per_minute
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        """Block until the caller is allowed to perform the next request."""
+        if not self.interval:
+            return
+
+        # Reserve the next free slot, then sleep outside the lock
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
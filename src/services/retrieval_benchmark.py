@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from services.context_assembler import ContextAssembler
+from services.faiss_kdb import FaissKDB
+from services.tokens import estimate_tokens
+
+
+class RetrievalBenchmark:
+    """
+    Measures the retrieval quality and performance of FaissKDB configurations
+    (index type, embedding backend, search mode, top-k) on a labeled query set.
+
+    For each configuration it reports the recall@k against a baseline configuration
+    (usually exact "Flat" search), the label recall@k (queries with a relevant ID
+    in the top k), QPS, p50/p95 latency, build time, on-disk size and resident memory.
+    Optionally, the RAG context assembled from the top hits is measured too (size
+    in tokens and label recall), to compare it with sending the raw top k.
+    """
+
+    def __init__(self, texts: list, ids: list, queries: list, ks=(1, 5, 10, 20, 40)):
+        """
+        Initializes the benchmark.
+
+        :param texts: Texts of the corpus
+        :param ids: Stable IDs of the texts
+        :param queries: Labeled queries, dicts with the "query" text and the
+            "relevant_ids" expected in the results
+        :param ks: Values of k the recall is reported at
+        """
+        self.texts = texts
+        self.ids = [int(id) for id in ids]
+        self.queries = queries
+        self.ks = sorted(ks)
+        self.results = []
+
+        # Top results of each query with the baseline configuration
+        self.baseline_name = None
+        self._baseline_ids = None
+
+    def run(
+        self,
+        name: str,
+        kdb_options: dict = None,
+        search_options: dict = None,
+        context_options: dict = None,
+    ):
+        """
+        Build a KDB with a configuration and measure it.
+
+        :param name: Name of the configuration in the report
+        :param kdb_options: Keyword arguments of FaissKDB (e.g. index_factory), pass
+            a loaded "embedding_model" shared by the configurations so the build
+            time and memory don't include loading the model
+        :param search_options: Keyword arguments of FaissKDB.search_many (e.g. mode)
+        :param context_options: Optional keyword arguments of ContextAssembler
+            (e.g. token_budget) to also assemble and measure the context of the top hits
+        :return: The result of the configuration
+        """
+        kdb_options = kdb_options or {}
+        search_options = search_options or {}
+        print(f"[RetrievalBenchmark] Running {name}: {kdb_options} {search_options}")
+
+        # Only the encoding and indexing of the texts is measured
+        kdb = FaissKDB(**kdb_options)
+        rss_before = self._rss_bytes()
+        start_time = time.perf_counter()
+        kdb.add_text(self.texts, ids=self.ids)
+        build_seconds = time.perf_counter() - start_time
+        rss_bytes = self._rss_bytes() - rss_before
+
+        tmp_folder = tempfile.mkdtemp()
+        try:
+            kdb.export_kdb(os.path.join(tmp_folder, "kdb"))
+            disk_bytes = self._folder_size(os.path.join(tmp_folder, "kdb"))
+        finally:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+        # Warm up (model and index pages), then time one query at a time
+        kdb.search_many([self.queries[0]["query"]], self.ks[-1], **search_options)
+        latencies = []
+        retrieved_hits = []
+        for query in self.queries:
+            query_start = time.perf_counter()
+            hits = kdb.search_many([query["query"]], self.ks[-1], **search_options)[0]
+            latencies.append(time.perf_counter() - query_start)
+            retrieved_hits.append(hits)
+        retrieved_ids = [[hit["id"] for hit in hits] for hits in retrieved_hits]
+
+        if self._baseline_ids is None:
+            self.baseline_name = name
+            self._baseline_ids = retrieved_ids
+
+        latencies_ms = np.array(latencies) * 1000
+        result = {
+            "name": name,
+            "kdb_options": {
+                key: value
+                for key, value in kdb_options.items()
+                if key != "embedding_model"
+            },
+            "search_options": search_options,
+            "build_seconds": build_seconds,
+            "disk_bytes": disk_bytes,
+            "rss_bytes": rss_bytes,
+            "qps": len(latencies) / sum(latencies),
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)),
+            "latency_p95_ms": float(np.percentile(latencies_ms, 95)),
+            "recall_at_k": {
+                k: self._baseline_recall(retrieved_ids, k) for k in self.ks
+            },
+            "label_recall_at_k": {
+                k: self._label_recall(retrieved_ids, k) for k in self.ks
+            },
+            # Size of a RAG context made of the raw top k texts
+            "context_tokens_mean": float(
+                np.mean(
+                    [
+                        sum(estimate_tokens(hit["text"]) for hit in hits)
+                        for hits in retrieved_hits
+                    ]
+                )
+            ),
+        }
+        if context_options is not None:
+            result.update(self._measure_context(kdb, retrieved_hits, context_options))
+        self.results.append(result)
+
+        print(
+            f"[RetrievalBenchmark] {name}: build {build_seconds:.2f}s,"
+            f" {result['qps']:.1f} QPS, p95 {result['latency_p95_ms']:.1f} ms,"
+            f" recall@{self.ks[-1]} {result['recall_at_k'][self.ks[-1]]:.3f},"
+            f" label recall@{self.ks[-1]} {result['label_recall_at_k'][self.ks[-1]]:.3f}"
+        )
+        return result
+
+    def _measure_context(
+        self, kdb: FaissKDB, retrieved_hits: list, context_options: dict
+    ) -> dict:
+        """
+        Assemble the context of each query from its hits and measure it.
+
+        :param kdb: The KDB the hits come from
+        :param retrieved_hits: Hits retrieved for each query
+        :param context_options: Keyword arguments of ContextAssembler
+        :return: Dict with the mean size in tokens and the label recall of the contexts
+        """
+        assembler = ContextAssembler(**context_options)
+        context_ids = []
+        context_tokens = []
+        for query, hits in zip(self.queries, retrieved_hits):
+            query_embedding = kdb.encode_queries([query["query"]])[0]
+            embeddings = kdb.get_embeddings([hit["id"] for hit in hits])
+            context = assembler.assemble(query_embedding, hits, embeddings)
+            context_ids.append([hit["id"] for hit in context])
+            context_tokens.append(sum(estimate_tokens(hit["text"]) for hit in context))
+
+        return {
+            "context_options": context_options,
+            "assembled_context_tokens_mean": float(np.mean(context_tokens)),
+            "assembled_context_label_recall": self._label_recall(
+                context_ids, max(len(ids) for ids in context_ids)
+            ),
+        }
+
+    def report(self, dataset: str = None) -> dict:
+        """
+        Build the machine-readable report of the configurations run so far.
+
+        :param dataset: Optional name of the benchmarked corpus
+        :return: The report
+        """
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": self._git_commit(),
+            "dataset": dataset,
+            "corpus_size": len(self.texts),
+            "query_count": len(self.queries),
+            "ks": self.ks,
+            "baseline": self.baseline_name,
+            "results": self.results,
+        }
+
+    def save_report(self, folder, dataset: str = None) -> str:
+        """
+        Save the report as JSON, named by date and commit so reports of different
+        commits can be compared.
+
+        :param folder: Folder to save the report to
+        :param dataset: Optional name of the benchmarked corpus
+        :return: Path of the saved report
+        """
+        report = self.report(dataset)
+        os.makedirs(folder, exist_ok=True)
+
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        name = "_".join(part for part in [timestamp, dataset, report["commit"]] if part)
+        filepath = os.path.join(folder, f"{name}.json")
+        with open(filepath, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4, ensure_ascii=False)
+
+        print(f"[RetrievalBenchmark] Report saved to {filepath}")
+        return filepath
+
+    @staticmethod
+    def load_queries(filepath) -> list:
+        """
+        Load a labeled query set from a JSON file.
+
+        :param filepath: Path of the JSON file
+        :return: List of dicts with the "query" and its "relevant_ids"
+        """
+        with open(filepath, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def save_queries(queries: list, filepath):
+        """
+        Save a labeled query set to a JSON file, so every run uses the same queries.
+
+        :param queries: List of dicts with the "query" and its "relevant_ids"
+        :param filepath: Path of the JSON file
+        """
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        with open(filepath, "w", encoding="utf-8") as file:
+            json.dump(queries, file, indent=4, ensure_ascii=False)
+
+    def _baseline_recall(self, retrieved_ids: list, k: int) -> float:
+        """
+        Average fraction of the baseline top k found in the top k of each query.
+
+        :param retrieved_ids: IDs retrieved for each query
+        :param k: Number of results considered
+        :return: The recall@k against the baseline
+        """
+        recalls = []
+        for ids, baseline_ids in zip(retrieved_ids, self._baseline_ids):
+            expected = set(baseline_ids[:k])
+            if expected:
+                recalls.append(len(expected.intersection(ids[:k])) / len(expected))
+        return float(np.mean(recalls)) if recalls else 0.0
+
+    def _label_recall(self, retrieved_ids: list, k: int) -> float:
+        """
+        Fraction of the queries with at least one relevant ID in the top k.
+
+        :param retrieved_ids: IDs retrieved for each query
+        :param k: Number of results considered
+        :return: The label recall@k
+        """
+        found = [
+            bool(set(query["relevant_ids"]).intersection(ids[:k]))
+            for query, ids in zip(self.queries, retrieved_ids)
+        ]
+        return float(np.mean(found)) if found else 0.0
+
+    @staticmethod
+    def _rss_bytes() -> int:
+        """
+        Get the resident memory of the process.
+
+        :return: Resident set size in bytes (0 if unknown)
+        """
+        try:
+            with open("/proc/self/statm", "r") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # Not Linux: fall back to the peak resident memory
+            try:
+                import resource
+
+                return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            except ImportError:
+                return 0
+
+    @staticmethod
+    def _folder_size(folder) -> int:
+        """
+        Get the total size of the files in a folder.
+
+        :param folder: The folder
+        :return: Size in bytes
+        """
+        return sum(
+            os.path.getsize(os.path.join(root, filename))
+            for root, _, filenames in os.walk(folder)
+            for filename in filenames
+        )
+
+    @staticmethod
+    def _git_commit() -> str:
+        """
+        Get the current git commit, to compare reports across commits.
+
+        :return: Short commit hash, or None outside a git repository
+        """
+        try:
+            return (
+                subprocess.check_output(
+                    ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+                )
+                .decode()
+                .strip()
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
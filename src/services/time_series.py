@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Time buckets and their pandas frequencies (weeks start on Monday)
+BUCKET_FREQUENCIES = {"day": "D", "week": "W-MON", "month": "MS"}
+
+# Approximate length of each bucket, used to pick one for a date range
+BUCKET_DAYS = {"day": 1, "week": 7, "month": 30}
+
+
+def choose_bucket(start, end, max_buckets=120) -> str:
+    """
+    Choose the smallest time bucket that splits a date range in at most max_buckets.
+
+    :param start: Start of the range
+    :param end: End of the range
+    :param max_buckets: Maximum number of buckets
+    :return: "day", "week" or "month"
+    """
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for bucket, bucket_days in BUCKET_DAYS.items():
+        if days / bucket_days <= max_buckets:
+            return bucket
+    return "month"
+
+
+def resample(
+    df: pd.DataFrame, date_column, value_column, bucket, group_column=None
+) -> pd.DataFrame:
+    """
+    Sum a value per time bucket (and optionally per group).
+
+    :param df: DataFrame with the dates and values
+    :param date_column: Name of the date column
+    :param value_column: Name of the value column to sum
+    :param bucket: "day", "week" or "month"
+    :param group_column: Optional column to keep a series per group
+    :return: DataFrame with the date_column (start of each bucket), the
+        group_column (if any) and the summed value_column
+    """
+    keys = [
+        pd.Grouper(
+            key=date_column,
+            freq=BUCKET_FREQUENCIES[bucket],
+            label="left",
+            closed="left",
+        )
+    ]
+    if group_column:
+        keys.append(group_column)
+
+    return df.groupby(keys)[value_column].sum().reset_index()
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm, which
+    keeps the points that preserve the visual shape (peaks and valleys) of the line.
+
+    :param x: X values (numeric, sorted)
+    :param y: Y values
+    :param threshold: Number of points to keep
+    :return: Sorted indices of the points to keep
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # The first and last points are always kept, the others are split in buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Average point of the next bucket (the last point for the last bucket)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Keep the point forming the largest triangle with the previous kept
+        # point and the average of the next bucket
+        previous = selected[-1]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        selected.append(start + int(np.argmax(areas)))
+
+    selected.append(n - 1)
+    return np.array(selected)
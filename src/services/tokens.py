@@ -0,0 +1,16 @@
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Uses the usual ~4 characters per token approximation, which is good enough
+    for budgeting prompts without calling the provider's tokenizer.
+
+    :param text: The text to measure
+    :return: The estimated number of tokens
+    """
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
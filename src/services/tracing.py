@@ -0,0 +1,242 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+
+# --------------------------------------------------------
+# Lightweight span-based tracing
+#
+#   with trace("chat_turn", topic="Despesas") as turn:
+#       with span("search", mode="hybrid") as attributes:
+#           hits = kdb.search(...)
+#           attributes["hits"] = len(hits)
+#   turn.breakdown()
+#
+# Spans are only recorded inside a trace, elsewhere (e.g. in dataprep.py) they
+# cost a context variable lookup. Finished traces are appended to a JSON lines
+# log and, optionally, exported as OpenTelemetry spans to a local file.
+# --------------------------------------------------------
+
+# (trace, ID of the current span) of the running code, None outside of a trace.
+# Threads don't inherit it: run their work with contextvars.copy_context()
+_current = contextvars.ContextVar("tracing_current", default=None)
+
+_log_file = None
+_log_lock = threading.Lock()
+_otel_file = None
+_otel_tracer = None
+
+
+class Trace:
+    """
+    The spans recorded while handling a request (e.g. a chat turn).
+    """
+
+    def __init__(self, name: str, attributes: dict):
+        """
+        Initializes the trace.
+
+        :param name: Name of the request
+        :param attributes: Attributes of the request
+        """
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = datetime.now()
+        self.duration = None
+        self.spans = []  # Finished spans, the root span is the last one
+        self._start = time.perf_counter()
+        self._span_ids = itertools.count()
+
+    def breakdown(self) -> list:
+        """
+        Get the timing breakdown of the trace.
+
+        :return: List of dicts (one per span, in start order) with the "span" name
+            indented by depth, its "start_ms", "duration_ms" and "attributes" (as text)
+        """
+        parents = {span["id"]: span["parent"] for span in self.spans}
+
+        def depth(span):
+            parent, level = span["parent"], 0
+            while parent is not None:
+                parent, level = parents.get(parent), level + 1
+            return level
+
+        return [
+            {
+                "span": "  " * depth(span) + span["name"],
+                "start_ms": round(span["start"] * 1000, 1),
+                "duration_ms": round(span["duration"] * 1000, 1),
+                "attributes": ", ".join(
+                    f"{key}={value}" for key, value in span["attributes"].items()
+                ),
+            }
+            for span in sorted(self.spans, key=lambda span: span["start"])
+        ]
+
+    def to_dict(self) -> dict:
+        """
+        Convert the trace to a JSON serializable dict (one line of the log).
+
+        :return: Dict with the trace and its spans
+        """
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((self.duration or 0) * 1000, 1),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    **span,
+                    "start": round(span["start"] * 1000, 1),
+                    "duration": round(span["duration"] * 1000, 1),
+                }
+                for span in sorted(self.spans, key=lambda span: span["start"])
+            ],
+        }
+
+
+def configure_tracing(log_file=None, otel_file=None, service_name="dashboard"):
+    """
+    Configure where the finished traces are written. Calling it again with the
+    same files does nothing, so it can run on every Streamlit rerun.
+
+    :param log_file: Optional JSON lines file to append each trace (with its timing
+        breakdown) to
+    :param otel_file: Optional JSON lines file to export the spans to with
+        OpenTelemetry (requires the opentelemetry-sdk package)
+    :param service_name: Service name of the OpenTelemetry spans
+    """
+    global _log_file, _otel_file, _otel_tracer
+
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    _log_file = log_file
+
+    if otel_file == _otel_file:
+        return
+
+    _otel_file, _otel_tracer = otel_file, None
+    if not otel_file:
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+    )
+
+    os.makedirs(os.path.dirname(otel_file) or ".", exist_ok=True)
+    exporter = ConsoleSpanExporter(
+        out=open(otel_file, "a", encoding="utf-8"),
+        formatter=lambda span: span.to_json(indent=None) + os.linesep,
+    )
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    _otel_tracer = provider.get_tracer(__name__)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Trace a request: record the spans run inside it and, when it finishes,
+    write it to the configured log and print its timing breakdown.
+
+    :param name: Name of the request
+    :param attributes: Attributes of the request
+    :return: Context manager yielding the Trace
+    """
+    current_trace = Trace(name, attributes)
+    token = _current.set((current_trace, None))
+    try:
+        # The trace shares the attributes of its root span, to add them later
+        with span(name, **attributes) as root_attributes:
+            current_trace.attributes = root_attributes
+            yield current_trace
+    finally:
+        _current.reset(token)
+        current_trace.duration = current_trace.spans[-1]["duration"]
+        _write_trace(current_trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a step of the current trace (does nothing outside of a trace).
+
+    :param name: Name of the step
+    :param attributes: Attributes of the step
+    :return: Context manager yielding the attributes dict, to add attributes
+        known only at the end of the step (e.g. the number of results)
+    """
+    current = _current.get()
+    if current is None:
+        yield attributes
+        return
+
+    current_trace, parent_id = current
+    span_id = next(current_trace._span_ids)
+    token = _current.set((current_trace, span_id))
+    start = time.perf_counter()
+
+    with ExitStack() as stack:
+        otel_span = None
+        if _otel_tracer is not None:
+            otel_span = stack.enter_context(_otel_tracer.start_as_current_span(name))
+
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = repr(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            _current.reset(token)
+            current_trace.spans.append(
+                {
+                    "id": span_id,
+                    "parent": parent_id,
+                    "name": name,
+                    "start": start - current_trace._start,
+                    "duration": end - start,
+                    "attributes": attributes,
+                }
+            )
+            if otel_span is not None:
+                otel_span.set_attributes(
+                    {
+                        key: value
+                        for key, value in attributes.items()
+                        if isinstance(value, (str, bool, int, float))
+                    }
+                )
+
+
+def _write_trace(finished_trace: Trace):
+    """
+    Print the timing breakdown of a finished trace and append it to the log.
+
+    :param finished_trace: The finished trace
+    """
+    root_id = finished_trace.spans[-1]["id"]
+    steps = ", ".join(
+        f"{span['name']} {span['duration'] * 1000:.0f}ms"
+        for span in sorted(finished_trace.spans, key=lambda span: span["start"])
+        if span["parent"] == root_id
+    )
+    print(
+        f"[Tracing] {finished_trace.name} {finished_trace.duration * 1000:.0f}ms: {steps}"
+    )
+
+    if _log_file:
+        line = json.dumps(finished_trace.to_dict(), ensure_ascii=False, default=str)
+        with _log_lock, open(_log_file, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services are imported as in the scripts, from the src folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
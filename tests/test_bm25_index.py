@@ -0,0 +1,44 @@
+from services.bm25_index import BM25Index
+
+
+def test_remove_updates_only_the_document_postings():
+    index = BM25Index()
+    index.add(
+        [1, 2, 3], ["Arthur Lira PP", "Gleisi Hoffmann PT", "Lindbergh Farias PT"]
+    )
+
+    index.remove([2, 4])
+
+    assert index.postings["pt"] == {3: 1}
+    assert "gleisi" not in index.postings and "hoffmann" not in index.postings
+    assert 2 not in index.doc_lengths and 2 not in index.doc_terms
+    assert index.total_length == 6
+    assert [id for id, _ in index.search("PT")] == [3]
+
+
+def test_save_and_load(tmp_path):
+    index = BM25Index()
+    index.add([1, 2, 3], ["Arthur Lira PP", "Gleisi Hoffmann PT PT", "..."])
+    index.save(str(tmp_path / "bm25.parquet"))
+
+    loaded = BM25Index.load(str(tmp_path / "bm25.parquet"), [1, 2, 3])
+
+    assert loaded.postings == index.postings
+    assert loaded.doc_lengths == index.doc_lengths
+    assert loaded._get_doc_terms() == index.doc_terms
+    assert loaded.total_length == index.total_length
+    assert loaded.search("pt") == index.search("pt")
+
+
+def test_remove_after_load(tmp_path):
+    index = BM25Index()
+    index.add([1, 2], ["Arthur Lira PP", "Gleisi Hoffmann PT"])
+    index.save(str(tmp_path / "bm25.parquet"))
+
+    loaded = BM25Index.load(str(tmp_path / "bm25.parquet"), [1, 2])
+    loaded.add([3], ["Lindbergh Farias PT"])
+    loaded.remove([2])
+
+    assert loaded.postings["pt"] == {3: 1}
+    assert "gleisi" not in loaded.postings
+    assert loaded.total_length == 6
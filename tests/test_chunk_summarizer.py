@@ -0,0 +1,245 @@
+import hashlib
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from services.chunk_summarizer import ChunkSummarizer
+from services.tokens import estimate_tokens
+
+
+class EchoProvider:
+    """Summarizes a prompt as its hash, optionally failing the reduce prompts."""
+
+    def __init__(self, fail_reduce=False):
+        self.fail_reduce = fail_reduce
+        self.prompts = []
+
+    def ask(self, prompt):
+        self.prompts.append(prompt)
+        if self.fail_reduce and "partial summaries" in prompt:
+            return None
+        return {"response": hashlib.sha256(prompt.encode()).hexdigest()[:8]}
+
+    def map_calls(self):
+        # Only the chunk prompts contain the records
+        return sum("combustivel" in prompt for prompt in self.prompts)
+
+
+def make_summarizer(provider, cache_file):
+    records = [f"deputado {i} gastou {i * 10} reais com combustivel" for i in range(40)]
+    return ChunkSummarizer(
+        provider,
+        records,
+        window_size=20,
+        overlap_size=0,
+        reduce_mode="tree",
+        reduce_fan_in=2,
+        token_counter=lambda text: len(text.split()),
+        requests_per_minute=None,
+        max_retries=0,
+        cache_file=str(cache_file),
+    )
+
+
+def test_chunk_summaries_survive_a_failed_reduce(tmp_path):
+    cache_file = tmp_path / "summaries.json"
+    failing = EchoProvider(fail_reduce=True)
+    with pytest.raises(RuntimeError):
+        make_summarizer(failing, cache_file).summarize()
+    assert failing.map_calls() > 0
+
+    provider = EchoProvider()
+    make_summarizer(provider, cache_file).summarize()
+
+    assert provider.map_calls() == 0
+    assert provider.prompts
+
+
+class SlowProvider:
+    """Summarizes a chunk as its first record, recording the concurrent calls."""
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def ask(self, prompt):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return prompt.split("\n\n", 1)[-1].split("\n")[0]
+
+
+def test_chunks_are_summarized_concurrently_in_order():
+    provider = SlowProvider()
+    records = [f"registro {i:02d} com quatro palavras" for i in range(24)]
+    summarizer = ChunkSummarizer(
+        provider,
+        records,
+        window_size=10,
+        overlap_size=0,
+        reduce_mode="flat",
+        token_counter=lambda text: len(text.split()),
+        max_workers=4,
+        requests_per_minute=None,
+    )
+
+    summaries = summarizer._summarize_chunks()
+
+    assert provider.max_running > 1
+    assert summaries == sorted(summaries)
+    assert len(summaries) == summarizer.chunks_count
+
+
+def make_reducer(provider, reduce_mode, **kwargs):
+    return ChunkSummarizer(
+        provider,
+        [],
+        reduce_mode=reduce_mode,
+        token_counter=lambda text: len(text.split()),
+        requests_per_minute=None,
+        **kwargs,
+    )
+
+
+def test_tree_reduce_combines_at_most_fan_in_summaries():
+    provider = EchoProvider()
+    summaries = [f"resumo {i}" for i in range(20)]
+    summarizer = make_reducer(provider, "tree", reduce_fan_in=3)
+
+    reduced = summarizer._tree_reduce(summaries)
+
+    assert len(reduced) <= 3
+    reduce_prompts = [p for p in provider.prompts if "partial summaries" in p]
+    assert reduce_prompts
+    assert all(p.count("resumo") <= 3 for p in reduce_prompts)
+
+
+def test_auto_reduce_only_when_the_summaries_exceed_the_budget():
+    summaries = [f"resumo {i}" for i in range(20)]
+
+    provider = EchoProvider()
+    make_reducer(provider, "auto", reduce_max_tokens=1000)._tree_reduce(summaries)
+    assert provider.prompts == []
+
+    provider = EchoProvider()
+    reduced = make_reducer(provider, "auto", reduce_max_tokens=10)._tree_reduce(
+        summaries
+    )
+    assert provider.prompts
+    assert sum(len(summary.split()) for summary in reduced) <= 10
+
+
+def make_chunker(records, window_size, overlap_size=0):
+    return ChunkSummarizer(
+        EchoProvider(),
+        records,
+        window_size=window_size,
+        overlap_size=overlap_size,
+        token_counter=lambda text: len(text.split()),
+        requests_per_minute=None,
+    )
+
+
+def test_chunks_fit_the_window_without_cutting_records():
+    records = [" ".join(["palavra"] * (i % 4 + 1)) + f" {i}" for i in range(50)]
+
+    chunks = list(make_chunker(records, window_size=12)._iter_chunks())
+
+    assert all(sum(len(r.split()) for r in chunk) <= 12 for chunk in chunks)
+    assert [r for chunk in chunks for r in chunk] == records
+
+
+def test_chunks_overlap_and_long_records_are_split():
+    records = [f"registro {i}" for i in range(20)] + [" ".join(["longo"] * 25)]
+
+    chunks = list(make_chunker(records, window_size=10, overlap_size=2)._iter_chunks())
+
+    # Consecutive chunks of short records share their boundary records
+    short_chunks = [chunk for chunk in chunks if chunk[0].startswith("registro")]
+    assert all(a[-1] == b[0] for a, b in zip(short_chunks, short_chunks[1:]))
+    # The record larger than the window is split by words
+    assert all(len(r.split()) <= 10 for chunk in chunks for r in chunk)
+
+
+def test_estimate_tokens_counts_about_four_characters_per_token():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a" * 400) == 101
+
+
+def test_a_new_record_only_summarizes_the_chunks_around_it(tmp_path):
+    cache_file = tmp_path / "summaries.json"
+    records = [
+        f"deputado {i} gastou {i * 10} reais com combustivel" for i in range(200)
+    ]
+
+    def summarize(records):
+        provider = EchoProvider()
+        ChunkSummarizer(
+            provider,
+            records,
+            window_size=60,
+            overlap_size=0,
+            reduce_mode="tree",
+            reduce_fan_in=4,
+            token_counter=lambda text: len(text.split()),
+            requests_per_minute=None,
+            cache_file=str(cache_file),
+        ).summarize()
+        return provider.map_calls()
+
+    first_calls = summarize(records)
+    new_record = "deputado novo gastou 5 reais com combustivel"
+    second_calls = summarize(records[:100] + [new_record] + records[100:])
+
+    # Chunk boundaries depend on the content: they realign after the new record
+    assert first_calls > 20
+    assert 0 < second_calls <= 4
+
+
+def test_streaming_inputs_are_read_lazily(tmp_path):
+    read = []
+
+    def records():
+        for i in range(40):
+            read.append(i)
+            yield f"registro {i} com quatro palavras"
+
+    summarizer = make_chunker(records(), window_size=10)
+    chunks = summarizer._iter_chunks()
+    next(chunks)
+    # Only the records of the first chunk (and the next one) were read
+    assert len(read) < 5
+
+    text_file = tmp_path / "registros.txt"
+    text_file.write_text("registro 1\n\nregistro 2\n", encoding="utf-8")
+    assert list(make_chunker(text_file, window_size=10)._iter_records()) == [
+        "registro 1",
+        "registro 2",
+    ]
+
+
+def test_from_parquet_streams_the_rows(tmp_path):
+    parquet_file = tmp_path / "despesas.parquet"
+    pd.DataFrame({"nome": ["Ana", "Bruno", "Carla"], "valor": [10, 20, 30]}).to_parquet(
+        parquet_file
+    )
+
+    summarizer = ChunkSummarizer.from_parquet(
+        EchoProvider(),
+        parquet_file,
+        lambda row: f"{row['nome']} gastou {row['valor']}",
+        batch_size=1,
+        requests_per_minute=None,
+    )
+
+    assert list(summarizer._iter_records()) == [
+        "Ana gastou 10",
+        "Bruno gastou 20",
+        "Carla gastou 30",
+    ]
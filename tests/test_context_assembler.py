@@ -0,0 +1,59 @@
+import numpy as np
+
+from services.context_assembler import ContextAssembler
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_hits(texts):
+    return [{"id": i, "text": text} for i, text in enumerate(texts)]
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def test_duplicates_are_dropped():
+    hits = make_hits(["a b", "a  b", "c d", "e f"])
+    hits.append({"id": 2, "text": "outro texto"})
+    embeddings = normalize([[1, 0, 0], [1, 0, 0], [1, 0.01, 0], [0, 1, 0], [0, 0, 1]])
+    assembler = ContextAssembler(token_budget=100, token_counter=word_count)
+
+    context = assembler.assemble(np.array([1, 0, 0]), hits, embeddings)
+
+    # Same text, same ID and near-duplicate embeddings are all removed
+    assert [hit["id"] for hit in context] == [0, 3]
+
+
+def test_mmr_prefers_diverse_hits_within_the_budget():
+    hits = make_hits(["a b", "c d", "e f"])
+    embeddings = normalize([[1, 0.1, 0], [1, 0.3, 0], [0.6, 0, 1]])
+    query = normalize([[1, 0.1, 0.1]])[0]
+    assembler = ContextAssembler(
+        token_budget=4,
+        mmr_lambda=0.5,
+        duplicate_threshold=1.1,
+        token_counter=word_count,
+    )
+
+    context = assembler.assemble(query, hits, embeddings)
+
+    # The second most relevant hit is redundant with the first one
+    assert [hit["id"] for hit in context] == [0, 2]
+
+
+def test_hits_that_do_not_fit_are_skipped():
+    hits = make_hits(["a b c d e", "f g", "h i j"])
+    embeddings = normalize(np.eye(3))
+    assembler = ContextAssembler(token_budget=5, token_counter=word_count)
+
+    context = assembler.assemble(normalize([[3, 2, 1]])[0], hits, embeddings)
+
+    assert [hit["id"] for hit in context] == [0]
+    assert ContextAssembler(token_budget=4, token_counter=word_count).assemble(
+        normalize([[3, 2, 1]])[0], hits, embeddings
+    ) == [hits[1]]
+    assert assembler.assemble(np.ones(3), [], np.zeros((0, 3))) == []
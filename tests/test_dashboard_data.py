@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+
+import dashboard_data
+
+
+def test_load_parquet_is_reloaded_when_the_file_changes(tmp_path):
+    filepath = str(tmp_path / "deputados.parquet")
+    pd.DataFrame({"id": [1], "nome": ["Ana"]}).to_parquet(filepath)
+
+    first = dashboard_data.load_parquet(filepath)
+    assert dashboard_data.load_parquet(filepath).equals(first)
+
+    pd.DataFrame({"id": [1, 2], "nome": ["Ana", "Bruno"]}).to_parquet(filepath)
+    os.utime(filepath, ns=(0, os.stat(filepath).st_mtime_ns + 1))
+
+    assert dashboard_data.load_parquet(filepath)["nome"].tolist() == ["Ana", "Bruno"]
+    assert dashboard_data.load_deputado_names(filepath) == {1: "Ana", 2: "Bruno"}
+
+
+def test_load_json_and_yaml(tmp_path):
+    (tmp_path / "insights.json").write_text('{"total": 3}', encoding="utf-8")
+    (tmp_path / "config.yaml").write_text("modelo: hashing\n", encoding="utf-8")
+
+    assert dashboard_data.load_json(str(tmp_path / "insights.json")) == {"total": 3}
+    assert dashboard_data.load_yaml(str(tmp_path / "config.yaml")) == {
+        "modelo": "hashing"
+    }
+
+
+def write_expenses(filepath):
+    pd.DataFrame(
+        {
+            "idDeputado": [2, 1, 2, 1],
+            "dataDocumento": pd.to_datetime(
+                ["2024-03-01", "2024-02-01", "2024-01-01", "2024-01-15"]
+            ),
+            "tipoDespesa": ["COMBUSTÍVEIS", "PASSAGEM", "COMBUSTÍVEIS", "PASSAGEM"],
+            "valorDocumento": [30.0, 20.0, 10.0, 5.0],
+        }
+    ).to_parquet(filepath)
+
+
+def test_expenses_are_partitioned_by_deputado(tmp_path):
+    filepath = str(tmp_path / "despesas.parquet")
+    write_expenses(filepath)
+
+    assert sorted(dashboard_data.load_expenses_deputados(filepath)) == [1, 2]
+    expenses_df = dashboard_data.load_deputado_expenses(filepath, 2)
+    assert expenses_df["valorDocumento"].tolist() == [10.0, 30.0]
+    assert expenses_df.index.tolist() == [0, 1]
+    assert dashboard_data.load_deputado_expenses(filepath, 3).empty
@@ -0,0 +1,26 @@
+import os
+
+from services.data_snapshots import DataSnapshots
+
+
+def make_data_folder(path):
+    os.makedirs(path / "faiss")
+    (path / "deputados.parquet").write_text("data")
+    return str(path)
+
+
+def test_cleanup_removes_stale_stagings(tmp_path):
+    snapshots = DataSnapshots(str(tmp_path / "snapshots"))
+    data_folder = make_data_folder(tmp_path / "data")
+
+    # A worker killed while building its snapshot
+    stale = snapshots.create_staging(data_folder)
+    version = snapshots.publish(snapshots.create_staging(data_folder))
+    in_progress = snapshots.create_staging(data_folder)
+
+    snapshots.cleanup(staging=in_progress)
+
+    assert not os.path.exists(stale)
+    assert os.path.isdir(in_progress)
+    assert snapshots.versions() == [version]
+    assert snapshots.stagings() == [os.path.basename(in_progress)]
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+from test_embedding_pipeline import PoolModel
+
+from services.embedding_cache import CACHE_VECTORS_FILE, EmbeddingCache
+from services.faiss_kdb import FaissKDB
+
+
+def test_cached_embeddings_persist_across_instances(tmp_path):
+    cache = EmbeddingCache(tmp_path, "org/modelo")
+    embeddings = np.arange(6, dtype=np.float32).reshape(3, 2)
+    cache.put_many(["a", "b", "c"], embeddings)
+
+    reloaded = EmbeddingCache(tmp_path, "org/modelo")
+    cached, misses = reloaded.get_many(["c", "x", "a"])
+
+    assert misses == [1]
+    assert np.array_equal(cached[[0, 2]], embeddings[[2, 0]])
+    assert EmbeddingCache(tmp_path, "outro").get_many(["a"]) == (None, [0])
+
+
+def test_keys_without_a_complete_vector_are_ignored(tmp_path):
+    cache = EmbeddingCache(tmp_path, "modelo")
+    cache.put_many(["a", "b"], np.ones((2, 4), dtype=np.float32))
+    # Simulate a write interrupted after the first vector
+    vectors_file = os.path.join(cache.folder, CACHE_VECTORS_FILE)
+    with open(vectors_file, "r+b") as file:
+        file.truncate(4 * 4 + 2)
+
+    reloaded = EmbeddingCache(tmp_path, "modelo")
+    assert reloaded.get_many(["a", "b"])[1] == [1]
+
+    reloaded.put_many(["b"], np.full((1, 4), 2, dtype=np.float32))
+    cached, misses = EmbeddingCache(tmp_path, "modelo").get_many(["a", "b"])
+    assert misses == []
+    assert np.array_equal(cached, [[1] * 4, [2] * 4])
+
+
+def test_kdb_rebuilds_only_encode_new_texts(tmp_path):
+    texts = ["Ana PT", "Bruno PL", "Carla PT"]
+    model = PoolModel()
+    first = FaissKDB(
+        model_name="hashing", embedding_model=model, embedding_cache_folder=tmp_path
+    )
+    first.add_text(texts, ids=[1, 2, 3])
+
+    model.calls.clear()
+    second = FaissKDB(
+        model_name="hashing", embedding_model=model, embedding_cache_folder=tmp_path
+    )
+    second.add_text(texts + ["Davi MDB"], ids=[1, 2, 3, 4])
+
+    assert model.calls == [("encode", 1)]
+    assert np.allclose(
+        second.get_embeddings([1, 2, 3]), first.get_embeddings([1, 2, 3])
+    )
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from test_faiss_kdb import HashingModel
+
+from services.embedding_pipeline import EmbeddingPipeline
+from services.faiss_kdb import FaissKDB
+
+
+class PoolModel(HashingModel):
+    """A HashingModel recording how the texts are encoded."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(("encode", len(texts)))
+        return super().encode(texts)
+
+    def start_multi_process_pool(self, devices):
+        self.calls.append(("start_pool", len(devices)))
+        return "pool"
+
+    def encode_multi_process(self, texts, pool, batch_size=32):
+        self.calls.append(("encode_multi_process", len(texts)))
+        return super().encode(texts)
+
+    def stop_multi_process_pool(self, pool):
+        self.calls.append(("stop_pool", 0))
+
+
+def test_encode_returns_normalized_embeddings_in_order():
+    model = HashingModel()
+    texts = [f"texto {i}" for i in range(10)]
+
+    embeddings = EmbeddingPipeline(model, batch_size=4).encode(texts, report=False)
+
+    assert embeddings.dtype == np.float32
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1)
+    expected = model.encode(texts)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(embeddings, expected)
+
+
+def test_the_process_pool_is_used_for_large_inputs_only():
+    model = PoolModel()
+    pipeline = EmbeddingPipeline(model, batch_size=4, num_workers=2)
+
+    pipeline.encode(["texto"] * 7, report=False)
+    pipeline.encode(["texto"] * 8, report=False)
+    pipeline.encode(["texto"] * 20, report=False)
+    pipeline.close()
+
+    assert model.calls == [
+        ("encode", 7),
+        ("start_pool", 2),
+        ("encode_multi_process", 8),
+        ("encode_multi_process", 20),
+        ("stop_pool", 0),
+    ]
+
+
+def test_add_parquet_streams_the_rows_in_batches(tmp_path):
+    parquet_file = tmp_path / "deputados.parquet"
+    pd.DataFrame(
+        {
+            "id": [10, 20, 30],
+            "nome": ["Ana", "Bruno", "Carla"],
+            "siglaPartido": ["PT", "PL", "PT"],
+        }
+    ).to_parquet(parquet_file)
+    model = PoolModel()
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+
+    kdb.add_parquet(
+        parquet_file,
+        lambda row: f"{row['nome']} {row['siglaPartido']}",
+        id_column="id",
+        metadata_columns=["siglaPartido"],
+        read_batch_size=2,
+    )
+
+    assert model.calls == [("encode", 2), ("encode", 1)]
+    assert kdb.texts == {10: "Ana PT", 20: "Bruno PL", 30: "Carla PT"}
+    assert kdb.metadata[20] == {"siglaPartido": "PL"}
@@ -0,0 +1,253 @@
+import hashlib
+import os
+
+import faiss
+import joblib
+import numpy as np
+import pytest
+
+from services.bm25_index import BM25Index
+from services.faiss_kdb import FaissKDB
+
+
+class HashingModel:
+    """A deterministic stand-in for a SentenceTransformer (bag of hashed words)."""
+
+    def __init__(self, dimension=32):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, texts, **kwargs):
+        embeddings = np.full((len(texts), self.dimension), 1e-3, dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().split():
+                digest = hashlib.md5(word.encode()).hexdigest()
+                embeddings[i, int(digest, 16) % self.dimension] += 1
+        return embeddings
+
+
+@pytest.fixture
+def model():
+    return HashingModel()
+
+
+def test_import_legacy_kdb_converts_it(tmp_path, model):
+    # Pickled objects of the first version: two flat indices and a list of texts
+    texts = ["arthur lira pp", "gleisi hoffmann pt", "despesa combustivel"]
+    embeddings = model.encode(texts)
+    faiss.normalize_L2(embeddings)
+    legacy = object.__new__(FaissKDB)
+    legacy.__dict__.update(
+        {
+            "model_name": "hashing",
+            "cache_folder": None,
+            "device": "cpu",
+            "texts": texts,
+            "index_l2": faiss.IndexFlatL2(model.dimension),
+            "index_ip": faiss.IndexFlatIP(model.dimension),
+        }
+    )
+    legacy.index_l2.add(embeddings)
+    legacy.index_ip.add(embeddings)
+    legacy_file = str(tmp_path / "kdb.joblib")
+    joblib.dump(legacy, legacy_file)
+
+    kdb = FaissKDB.import_kdb(legacy_file, embedding_model=model)
+
+    assert sorted(kdb.texts.values()) == sorted(texts)
+    assert kdb.search("gleisi pt", num_results=1) == ["gleisi hoffmann pt"]
+    assert kdb.search_many(["lira"], num_results=1, mode="hybrid")[0]
+    assert kdb.get_embeddings([0]).shape == (1, model.dimension)
+
+
+def test_export_kdb_replaces_the_previous_version(tmp_path, model):
+    folder = str(tmp_path / "kdb")
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(["arthur lira pp"])
+    kdb.export_kdb(folder)
+    kdb.add_text(["gleisi hoffmann pt"])
+    kdb.export_kdb(folder)
+
+    assert sorted(os.listdir(tmp_path)) == ["kdb"]
+    imported = FaissKDB.import_kdb(folder, embedding_model=model)
+    assert len(imported.texts) == 2
+
+
+def test_import_kdb_after_an_interrupted_export(tmp_path, model):
+    folder = str(tmp_path / "kdb")
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(["arthur lira pp"])
+    kdb.export_kdb(folder)
+
+    # The process died after moving the previous version aside
+    os.replace(folder, f"{folder}.old")
+
+    imported = FaissKDB.import_kdb(folder, embedding_model=model)
+    assert list(imported.texts.values()) == ["arthur lira pp"]
+
+
+def test_search_many_without_queries(model):
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(["arthur lira pp"])
+
+    assert kdb.encode_queries([]).shape == (0, model.dimension)
+    assert kdb.search_many([]) == []
+
+
+def test_filter_list_fields_by_membership(tmp_path, model):
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(
+        ["pl educacao", "pec tributos", "pl saude"],
+        ids=[10, 20, 30],
+        metadata=[
+            {"tema": ["Educação", "Finanças"], "ano": 2023},
+            {"tema": ["Finanças"], "ano": 2024},
+            {"tema": ["Saúde"], "ano": 2024},
+        ],
+    )
+    kdb.export_kdb(str(tmp_path / "kdb"))
+    imported = FaissKDB.import_kdb(str(tmp_path / "kdb"), embedding_model=model)
+
+    for k in (kdb, imported):
+        assert k.metadata_values("tema") == ["Educação", "Finanças", "Saúde"]
+        assert sorted(k._filtered_ids({"tema": ["Finanças"]})) == [10, 20]
+        assert sorted(k._filtered_ids({"tema": "Educação"})) == [10]
+        assert sorted(k._filtered_ids({"tema": ["Finanças"], "ano": (2024, None)})) == [
+            20
+        ]
+    assert imported.metadata[10]["tema"] == ["Educação", "Finanças"]
+
+
+def test_filter_by_date_range(model):
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(
+        ["combustivel", "passagem", "hotel"],
+        ids=[1, 2, 3],
+        metadata=[
+            {"dataDocumento": "2024-01-05"},
+            {"dataDocumento": "2024-02-10"},
+            {"dataDocumento": "2024-03-15"},
+        ],
+    )
+
+    hits = kdb.search_many(
+        ["combustivel passagem hotel"],
+        num_results=3,
+        filters={"dataDocumento": ("2024-02-01", "2024-03-31")},
+    )[0]
+    assert sorted(hit["id"] for hit in hits) == [2, 3]
+
+
+@pytest.mark.parametrize("index_factory", ["Flat", "IVF4,Flat"])
+def test_update_a_memory_mapped_kdb(tmp_path, model, index_factory):
+    folder = str(tmp_path / "kdb")
+    kdb = FaissKDB(
+        model_name="hashing",
+        embedding_model=model,
+        index_factory=index_factory,
+        train_sample_size=1000,
+    )
+    kdb.add_text([f"deputado {i} partido {i % 5}" for i in range(200)])
+    kdb.export_kdb(folder)
+
+    imported = FaissKDB.import_kdb(folder, mmap=True, embedding_model=model)
+    imported.remove([0, 1])
+    imported.upsert([2], ["arthur lira pp"])
+    imported.add_text(["gleisi hoffmann pt"], ids=[1000])
+
+    assert imported.index.ntotal == 199
+    assert imported.search_many(["arthur lira pp"], num_results=1)[0][0]["id"] == 2
+
+
+def test_import_kdb_loads_the_bm25_postings(tmp_path, model, monkeypatch):
+    folder = str(tmp_path / "kdb")
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(["arthur lira pp", "gleisi hoffmann pt"])
+    kdb.export_kdb(folder)
+
+    # The texts are not tokenized again
+    monkeypatch.setattr(BM25Index, "tokenize", None)
+    imported = FaissKDB.import_kdb(folder, embedding_model=model)
+
+    assert imported.bm25_index.postings == kdb.bm25_index.postings
+
+
+@pytest.mark.parametrize(
+    "index_factory, embedding_dtype",
+    [
+        ("Flat", "float32"),
+        ("Flat", "float16"),
+        ("HNSW32", "int8"),
+        ("IVF4,Flat", "float32"),
+    ],
+)
+def test_single_index_types(tmp_path, model, index_factory, embedding_dtype):
+    texts = [f"deputado {i} partido {i % 5} estado {i % 7}" for i in range(100)]
+    kdb = FaissKDB(
+        model_name="hashing",
+        embedding_model=model,
+        index_factory=index_factory,
+        embedding_dtype=embedding_dtype,
+        nprobe=4,
+    )
+    kdb.add_text(texts)
+    kdb.export_kdb(str(tmp_path / "kdb"))
+    imported = FaissKDB.import_kdb(str(tmp_path / "kdb"), embedding_model=model)
+
+    for k in (kdb, imported):
+        # One inner product index over normalized vectors: scores are cosines
+        assert k.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        assert k.index.ntotal == len(texts)
+        hit = k.search_many([texts[42]], num_results=1)[0][0]
+        assert hit["text"] == texts[42]
+        assert hit["score"] == pytest.approx(1.0, abs=0.02)
+
+
+@pytest.mark.parametrize("index_factory", ["Flat", "HNSW32"])
+def test_stable_ids_with_upsert_and_remove(model, index_factory):
+    kdb = FaissKDB(
+        model_name="hashing", embedding_model=model, index_factory=index_factory
+    )
+    assert kdb.add_text(["arthur lira pp", "gleisi hoffmann pt"]) == [0, 1]
+    assert kdb.add_text(["lindbergh farias pt"], ids=[100]) == [100]
+
+    with pytest.raises(ValueError, match="upsert"):
+        kdb.add_text(["outro"], ids=[100])
+
+    kdb.upsert([1], ["gleisi hoffmann presidente pt"])
+    # HNSW can't remove vectors: the index is rebuilt from its own vectors
+    assert kdb.remove([0, 999]) == 1
+
+    assert kdb.texts == {1: "gleisi hoffmann presidente pt", 100: "lindbergh farias pt"}
+    assert kdb.index.ntotal == 2
+    assert kdb.search_many(["presidente"], num_results=1)[0][0]["id"] == 1
+    # Removed IDs are not reused
+    assert kdb.add_text(["novo texto"]) == [101]
+
+
+def test_search_modes(model):
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(
+        ["Arthur Lira PP", "Gleisi Hoffmann PT", "Lindbergh Farias PT"],
+        ids=[1, 2, 3],
+        metadata=[{"siglaPartido": p} for p in ["PP", "PT", "PT"]],
+    )
+
+    bm25_hits = kdb.search_many(["hoffmann"], num_results=3, mode="bm25")[0]
+    assert [hit["id"] for hit in bm25_hits] == [2]
+    assert bm25_hits[0]["text"] == "Gleisi Hoffmann PT"
+
+    hybrid_hits = kdb.search_many(["Gleisi Hoffmann"], num_results=2, mode="hybrid")[0]
+    assert hybrid_hits[0]["id"] == 2
+    # Ranked first by both the dense and the sparse search
+    assert hybrid_hits[0]["score"] == pytest.approx(2 / 61)
+
+    filtered = kdb.search(
+        "PT", num_results=3, filters={"siglaPartido": "PP"}, mode="hybrid"
+    )
+    assert filtered == ["Arthur Lira PP"]
+
+    with pytest.raises(ValueError):
+        kdb.search("PT", mode="keyword")
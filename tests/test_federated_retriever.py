@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+from test_faiss_kdb import HashingModel
+
+from services.faiss_kdb import KDB_MANIFEST_FILE, FaissKDB
+from services.federated_retriever import CALIBRATION_TOP_K, FederatedRetriever
+
+
+def make_kdb(model, texts):
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(texts)
+    return kdb
+
+
+def test_calibration_uses_the_scores_of_the_top_hits():
+    model = HashingModel()
+    texts = [f"despesa {i} combustivel deputado {i % 7}" for i in range(30)]
+    kdb = make_kdb(model, texts)
+
+    mean, std = FederatedRetriever._calibrate(kdb)
+
+    # Same statistics as searching the shard with its own texts
+    results = kdb.search_many(texts, CALIBRATION_TOP_K + 1)
+    scores = [
+        hit["score"]
+        for id, hits in zip(kdb.texts, results)
+        for hit in hits
+        if hit["id"] != id
+    ]
+    assert abs(mean - sum(scores) / len(scores)) < 1e-4
+    assert std > 0
+
+
+def test_uncalibrated_shard_falls_back_to_rrf():
+    model = HashingModel()
+    retriever = FederatedRetriever(
+        {
+            "despesas": make_kdb(model, ["despesa combustivel", "despesa passagem"]),
+            "discursos": make_kdb(model, ["discurso combustivel"]),
+        }
+    )
+    assert retriever.calibration["discursos"] is None
+
+    hits = retriever.search("combustivel", num_results=3)
+
+    assert [hit["score"] for hit in hits][:2] == [1 / 61, 1 / 61]
+    assert {hit["kdb"] for hit in hits[:2]} == {"despesas", "discursos"}
+
+
+def export_shards(tmp_path, model, count):
+    folders = {}
+    for i in range(count):
+        folder = str(tmp_path / f"kdb{i}")
+        make_kdb(model, [f"texto {i} a", f"texto {i} b", f"texto {i} c"]).export_kdb(
+            folder
+        )
+        folders[f"kdb{i}"] = folder
+    return folders
+
+
+def test_load_shares_the_embedding_model(tmp_path, monkeypatch):
+    folders = export_shards(tmp_path, HashingModel(), 2)
+    loaded = []
+    monkeypatch.setattr(
+        FaissKDB,
+        "_load_embedding_model",
+        lambda self: loaded.append(1) or HashingModel(),
+    )
+
+    retriever = FederatedRetriever.load(folders)
+
+    assert len(loaded) == 1
+    assert (
+        retriever.kdbs["kdb0"].embedding_model is retriever.kdbs["kdb1"].embedding_model
+    )
+
+
+def test_load_rejects_shards_with_another_backend(tmp_path, monkeypatch):
+    folders = export_shards(tmp_path, HashingModel(), 2)
+    manifest_file = os.path.join(folders["kdb1"], KDB_MANIFEST_FILE)
+    with open(manifest_file) as file:
+        manifest = json.load(file)
+    manifest.update(embedding_backend="onnx", onnx_model_folder="onnx")
+    with open(manifest_file, "w") as file:
+        json.dump(manifest, file)
+
+    models = []
+    monkeypatch.setattr(
+        FaissKDB,
+        "_load_embedding_model",
+        lambda self: models.append(HashingModel()) or models[-1],
+    )
+
+    with pytest.raises(ValueError, match="backend"):
+        FederatedRetriever.load(folders)
+    # The ONNX shard got its own model instead of the torch one
+    assert len(models) == 2
@@ -0,0 +1,76 @@
+from models.insights import Insights
+from services import gemini
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, system_instruction=None):
+        pass
+
+    def generate_content(self, prompt, generation_config=None):
+        return type("Response", (), {"text": f"```python\nprint({prompt!r})\n```"})()
+
+
+def test_ask_does_not_share_the_response(monkeypatch):
+    monkeypatch.setattr(gemini.genai, "GenerativeModel", FakeGenerativeModel)
+    client = gemini.Gemini(api_key="test")
+
+    response = client.ask("pergunta")
+
+    assert response["response"] == "```python\nprint('pergunta')\n```"
+    assert client.response is None
+    assert client.ask_and_generate_python_code("x") == "\nprint('x')\n"
+
+
+def scripted_model(responses, prompts):
+    """A GenerativeModel answering with the given texts, recording the prompts."""
+
+    class ScriptedGenerativeModel:
+        def __init__(self, model_name, system_instruction=None):
+            pass
+
+        def generate_content(self, prompt, generation_config=None):
+            prompts.append((prompt, generation_config))
+            return type("Response", (), {"text": responses.pop(0)})()
+
+    return ScriptedGenerativeModel
+
+
+def test_ask_and_generate_json_validates_the_schema(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(
+        gemini.genai,
+        "GenerativeModel",
+        scripted_model(['{"insights": ["a", "b"]}'], prompts),
+    )
+
+    insights = gemini.Gemini(api_key="test").ask_and_generate_json("x", Insights)
+
+    assert insights == Insights(insights=["a", "b"])
+    assert prompts[0][1].response_mime_type == "application/json"
+
+
+def test_ask_and_generate_json_repairs_an_invalid_response(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(
+        gemini.genai,
+        "GenerativeModel",
+        scripted_model(['{"insights": "a"}', '{"insights": ["a"]}'], prompts),
+    )
+
+    insights = gemini.Gemini(api_key="test").ask_and_generate_json("x", Insights)
+
+    assert insights == Insights(insights=["a"])
+    # A single repair request, with the invalid JSON and the validation errors
+    assert len(prompts) == 2
+    assert '{"insights": "a"}' in prompts[1][0]
+    assert "insights" in prompts[1][0] and "list" in prompts[1][0]
+
+
+def test_ask_and_generate_json_gives_up_after_one_repair(monkeypatch):
+    monkeypatch.setattr(
+        gemini.genai,
+        "GenerativeModel",
+        scripted_model(['{"insights": 1}', '{"insights": 2}'], []),
+    )
+
+    assert gemini.Gemini(api_key="test").ask_and_generate_json("x", Insights) is None
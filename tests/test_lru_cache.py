@@ -0,0 +1,44 @@
+from test_embedding_pipeline import PoolModel
+
+from services.faiss_kdb import FaissKDB
+from services.lru_cache import LRUCache
+
+
+def test_the_least_recently_used_item_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_a_zero_size_cache_keeps_nothing():
+    cache = LRUCache(maxsize=0)
+    cache.put("a", 1)
+    assert cache.get("a", "vazio") == "vazio"
+
+
+def test_search_many_batches_queries_and_reuses_their_embeddings():
+    model = PoolModel()
+    kdb = FaissKDB(model_name="hashing", embedding_model=model)
+    kdb.add_text(
+        ["Ana PT", "Bruno PL", "Carla PT"],
+        ids=[1, 2, 3],
+        metadata=[{"siglaPartido": p} for p in ["PT", "PL", "PT"]],
+    )
+
+    model.calls.clear()
+    results = kdb.search_many(["Bruno PL", "Ana PT"], num_results=1)
+    kdb.search_many(["Ana PT", "Carla PT"], num_results=1)
+
+    assert [hits[0]["id"] for hits in results] == [2, 1]
+    assert results[0][0]["text"] == "Bruno PL"
+    assert results[0][0]["metadata"] == {"siglaPartido": "PL"}
+    assert results[0][0]["score"] > 0.99
+    # One batch per call, and only the query not seen before is encoded again
+    assert model.calls == [("encode", 2), ("encode", 1)]
@@ -0,0 +1,33 @@
+from test_chunk_summarizer import EchoProvider
+
+from services.chunk_summarizer import ChunkSummarizer
+from services.near_duplicates import MinHashDeduplicator
+
+
+def test_near_duplicates_are_detected():
+    deduplicator = MinHashDeduplicator(threshold=0.8)
+    text = " ".join(f"palavra{i}" for i in range(40))
+
+    assert not deduplicator.is_duplicate(text)
+    # One word changed in 40: most of the shingles are the same
+    assert deduplicator.is_duplicate(text.replace("palavra39", "outra"))
+    assert not deduplicator.is_duplicate(
+        "a proposicao altera a lei de diretrizes orcamentarias para o proximo ano"
+    )
+    assert (deduplicator.seen_count, deduplicator.merged_count) == (3, 1)
+
+
+def test_summarizer_drops_near_duplicate_records():
+    records = [
+        "deputado 1 gastou 1200 reais com combustivel no posto da cidade",
+        "deputado 1 gastou 1200 reais com combustivel no posto da cidade!",
+        "deputado 2 apresentou um projeto sobre educacao basica nas escolas",
+    ]
+    summarizer = ChunkSummarizer(
+        EchoProvider(),
+        records,
+        requests_per_minute=None,
+        dedup_threshold=0.8,
+    )
+
+    assert list(summarizer._iter_records()) == [records[0], records[2]]
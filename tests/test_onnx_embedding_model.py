@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from services import onnx_embedding_model
+from services.onnx_embedding_model import ONNX_CONFIG_FILE, OnnxEmbeddingModel
+
+torch = pytest.importorskip("torch")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+models = pytest.importorskip("sentence_transformers.models")
+
+
+@pytest.fixture
+def tiny_model_folder(tmp_path):
+    """A tiny random BERT SentenceTransformer (mean pooling) saved locally."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(
+        "abcdefghijklmnopqrstuvwxyz"
+    )
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab))
+
+    bert_folder = str(tmp_path / "bert")
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(bert_folder)
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=32,
+    )
+    BertModel(config).save_pretrained(bert_folder)
+
+    transformer = models.Transformer(bert_folder)
+    pooling = models.Pooling(16, pooling_mode="mean")
+    model_folder = str(tmp_path / "sentence_transformer")
+    sentence_transformers.SentenceTransformer(modules=[transformer, pooling]).save(
+        model_folder
+    )
+    return model_folder
+
+
+def test_export_failing_verification_leaves_no_config(
+    tiny_model_folder, tmp_path, monkeypatch
+):
+    # No export can reach a cosine agreement above 1
+    monkeypatch.setattr(onnx_embedding_model, "MIN_COSINE_AGREEMENT", 1.01)
+    folder = str(tmp_path / "onnx")
+
+    with pytest.raises(ValueError):
+        OnnxEmbeddingModel.export(tiny_model_folder, folder, quantize=False)
+
+    assert not os.path.exists(os.path.join(folder, ONNX_CONFIG_FILE))
+
+
+def test_export_passing_verification_writes_config(tiny_model_folder, tmp_path):
+    folder = str(tmp_path / "onnx")
+
+    config = OnnxEmbeddingModel.export(tiny_model_folder, folder, quantize=False)
+
+    assert os.path.exists(os.path.join(folder, ONNX_CONFIG_FILE))
+    assert (
+        config["cosine_agreement"]["min"] >= onnx_embedding_model.MIN_COSINE_AGREEMENT
+    )
@@ -0,0 +1,58 @@
+import pandas as pd
+
+from services.propositions_store import PropositionsStore
+
+
+def test_build_and_query(tmp_path):
+    propositions_df = pd.DataFrame(
+        {
+            "id": [1, 1, 2],
+            "uri": ["uri1", "uri1", "uri2"],
+            "siglaTipo": ["PL", "PL", "PEC"],
+            "numero": [10, 10, 20],
+            "ano": [2023, 2023, 2024],
+            "ementa": [
+                "Dispõe sobre a educação",
+                "Dispõe sobre a educação",
+                "Altera a Constituição",
+            ],
+            "tema": ["Educação", "Finanças", "Finanças"],
+        }
+    )
+    store = PropositionsStore(str(tmp_path / "proposicoes.sqlite"))
+    store.build(propositions_df, source_version="v1")
+
+    assert store.is_current("v1")
+    assert store.distinct("tema") == ["Educação", "Finanças"]
+    assert store.date_bounds() is None
+
+    page_df, total = store.query(temas=["Finanças"], text="educacao")
+    assert total == 1
+    assert page_df["temas"].tolist() == ["Educação, Finanças"]
+
+
+def test_query_by_date_range(tmp_path):
+    propositions_df = pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "uri": ["uri1", "uri2", "uri3"],
+            "siglaTipo": ["PL", "PL", "PEC"],
+            "numero": [10, 20, 30],
+            "ano": [2024, 2024, 2024],
+            "ementa": ["Educação", "Saúde", "Tributos"],
+            "tema": ["Educação", "Saúde", "Finanças"],
+            "dataApresentacao": [
+                "2024-01-10T10:00",
+                "2024-03-05T15:30",
+                "2024-06-20T09:00",
+            ],
+        }
+    )
+    store = PropositionsStore(str(tmp_path / "proposicoes.sqlite"))
+    store.build(propositions_df)
+
+    assert store.date_bounds() == ("2024-01-10", "2024-06-20")
+
+    page_df, total = store.query(date_range=("2024-02-01", "2024-06-20"))
+    assert total == 2
+    assert sorted(page_df["id"]) == [2, 3]
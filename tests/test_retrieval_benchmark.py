@@ -0,0 +1,55 @@
+import json
+
+from test_faiss_kdb import HashingModel
+
+from services.retrieval_benchmark import RetrievalBenchmark
+
+TEXTS = [
+    f"deputado {name} partido {party}"
+    for name, party in [
+        ("ana", "pt"),
+        ("bruno", "pl"),
+        ("carla", "pt"),
+        ("davi", "mdb"),
+        ("eva", "psol"),
+        ("fabio", "pl"),
+        ("gil", "pp"),
+        ("hugo", "novo"),
+    ]
+]
+QUERIES = [
+    {"query": "deputado ana", "relevant_ids": [100]},
+    {"query": "partido mdb", "relevant_ids": [103]},
+    {"query": "hugo", "relevant_ids": [999]},
+]
+
+
+def test_benchmark_reports_recall_against_the_baseline(tmp_path):
+    benchmark = RetrievalBenchmark(TEXTS, list(range(100, 108)), QUERIES, ks=(1, 4))
+    options = {"model_name": "hashing", "embedding_model": HashingModel()}
+
+    baseline = benchmark.run("flat", options)
+    hnsw = benchmark.run(
+        "hnsw",
+        {**options, "index_factory": "HNSW8"},
+        context_options={"token_budget": 20},
+    )
+
+    assert baseline["recall_at_k"] == {1: 1.0, 4: 1.0}
+    assert baseline["label_recall_at_k"][1] == 2 / 3
+    assert hnsw["kdb_options"] == {"model_name": "hashing", "index_factory": "HNSW8"}
+    assert hnsw["assembled_context_tokens_mean"] <= 20
+    assert hnsw["context_tokens_mean"] > hnsw["assembled_context_tokens_mean"]
+    assert baseline["disk_bytes"] > 0 and baseline["qps"] > 0
+
+    with open(benchmark.save_report(tmp_path, dataset="deputados")) as file:
+        report = json.load(file)
+    assert report["baseline"] == "flat"
+    assert report["corpus_size"] == 8
+    assert [result["name"] for result in report["results"]] == ["flat", "hnsw"]
+
+
+def test_queries_round_trip(tmp_path):
+    filepath = tmp_path / "queries" / "deputados.json"
+    RetrievalBenchmark.save_queries(QUERIES, str(filepath))
+    assert RetrievalBenchmark.load_queries(filepath) == QUERIES
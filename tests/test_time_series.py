@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from test_dashboard_data import write_expenses
+
+import dashboard_data
+from services.time_series import choose_bucket, lttb, resample
+
+
+def test_choose_bucket():
+    assert choose_bucket("2024-01-01", "2024-03-31") == "day"
+    assert choose_bucket("2024-01-01", "2025-12-31") == "week"
+    assert choose_bucket("2015-01-01", "2024-12-31") == "month"
+
+
+def test_resample_sums_per_bucket_and_group():
+    df = pd.DataFrame(
+        {
+            "data": pd.to_datetime(["2024-01-01", "2024-01-07", "2024-01-08"]),
+            "tipo": ["A", "B", "A"],
+            "valor": [1.0, 2.0, 4.0],
+        }
+    )
+
+    weeks = resample(df, "data", "valor", "week")
+    assert weeks["data"].dt.strftime("%Y-%m-%d").tolist() == [
+        "2024-01-01",
+        "2024-01-08",
+    ]
+    assert weeks["valor"].tolist() == [3.0, 4.0]
+
+    months = resample(df, "data", "valor", "month", "tipo")
+    assert months[["tipo", "valor"]].values.tolist() == [["A", 5.0], ["B", 2.0]]
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(100)
+    y = np.zeros(100)
+    y[37] = 10
+    y[71] = -10
+
+    keep = lttb(x, y, 10)
+
+    assert len(keep) == 10
+    assert keep[0] == 0 and keep[-1] == 99
+    assert 37 in keep and 71 in keep
+    assert np.all(np.diff(keep) > 0)
+    assert lttb(x[:5], y[:5], 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_expenses_chart_is_aggregated_in_the_range(tmp_path):
+    filepath = str(tmp_path / "despesas.parquet")
+    write_expenses(filepath)
+
+    chart_df, bucket, downsampled = dashboard_data.load_deputado_expenses_chart(
+        filepath, 1, "2024-01-01", "2024-01-31", bucket="month"
+    )
+    assert (bucket, downsampled) == ("month", False)
+    assert chart_df[["tipoDespesa", "valorDocumento"]].values.tolist() == [
+        ["PASSAGEM", 5.0]
+    ]
+
+
+def test_long_expenses_chart_is_downsampled(tmp_path):
+    filepath = str(tmp_path / "despesas.parquet")
+    dates = pd.date_range("2024-01-01", periods=90)
+    pd.DataFrame(
+        {
+            "idDeputado": 1,
+            "dataDocumento": dates.repeat(2),
+            "tipoDespesa": ["COMBUSTÍVEIS", "PASSAGEM"] * 90,
+            "valorDocumento": np.arange(180, dtype=float),
+        }
+    ).to_parquet(filepath)
+
+    chart_df, bucket, downsampled = dashboard_data.load_deputado_expenses_chart(
+        filepath, 1, "2024-01-01", "2024-03-30", max_points=20
+    )
+
+    assert (bucket, downsampled) == ("day", True)
+    assert chart_df.columns.tolist() == ["dataDocumento", "valorDocumento"]
+    assert len(chart_df) == 20
+    assert chart_df["dataDocumento"].iloc[[0, -1]].tolist() == [dates[0], dates[-1]]
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from services.tracing import configure_tracing, span, trace
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    log_file = str(tmp_path / "logs" / "traces.jsonl")
+    configure_tracing(log_file=log_file)
+    yield log_file
+    configure_tracing()
+
+
+def test_nested_spans_are_recorded_and_logged(log_file):
+    with trace("chat_turn", topic="Despesas") as turn:
+        with span("search", mode="hybrid") as attributes:
+            with span("encode_queries"):
+                pass
+            attributes["hits"] = 3
+        turn.attributes["prompt_chars"] = 120
+
+    assert [step["span"] for step in turn.breakdown()] == [
+        "chat_turn",
+        "  search",
+        "    encode_queries",
+    ]
+    assert turn.breakdown()[1]["attributes"] == "mode=hybrid, hits=3"
+
+    with open(log_file, "r", encoding="utf-8") as file:
+        logged = json.loads(file.read())
+    assert logged["trace_id"] == turn.trace_id
+    assert logged["attributes"] == {"topic": "Despesas", "prompt_chars": 120}
+    assert [s["name"] for s in logged["spans"]] == [
+        "chat_turn",
+        "search",
+        "encode_queries",
+    ]
+
+
+def test_failed_spans_record_the_error(log_file):
+    with pytest.raises(KeyError):
+        with trace("chat_turn") as turn:
+            with span("search"):
+                raise KeyError("kdb")
+
+    assert turn.spans[0]["attributes"] == {"error": "KeyError('kdb')"}
+    assert turn.duration is not None
+
+
+def test_spans_outside_of_a_trace_do_nothing():
+    with span("encode", texts=2) as attributes:
+        attributes["batches"] = 1
+    assert attributes == {"texts": 2, "batches": 1}